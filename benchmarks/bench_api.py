@@ -0,0 +1,90 @@
+"""Latence de /api/sources et /api/orphans : connexion ouverte par requête vs pool.
+
+    python benchmarks/bench_api.py --files 50000 --requests 200
+
+« avant » reproduit l'ancien get_db() (init_db() à chaque requête : nouvelle
+connexion et tout le DDL), « après » emprunte une connexion au pool.
+La base est synthétique (deux labels, ``--overlap`` des fichiers en commun) ;
+les requêtes passent par le TestClient de FastAPI, sans réseau.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import media_tool
+
+def build_db(files, overlap):
+    """Remplit une base temporaire : MASTER et TARGET, ``overlap`` des hashs en commun."""
+    conn = media_tool.init_db()
+    paths = media_tool.PathIndex(conn)
+    now = time.strftime('%Y-%m-%d %H:%M:%S')
+    rows = []
+    shared = int(files * overlap)
+    for label in ('MASTER', 'TARGET'):
+        source = media_tool.source_id(conn, label, create=True)
+        for i in range(files):
+            folder = f'/data/{label}/{i % 200:03d}'
+            file_hash = (i if i < shared or label == 'MASTER' else files + i).to_bytes(32, 'big')
+            rows.append((paths.dir_id(folder), f'IMG_{i:06d}.jpg', '.jpg', 100000 + i, 0.0,
+                         file_hash, 'sha256', source, now, 0, None))
+    conn.executemany(media_tool.UPSERT_FILE_SQL, rows)
+    conn.commit()
+    conn.close()
+
+@contextmanager
+def legacy_db():
+    # Ancien server.get_db() : init_db() puis close() à chaque requête
+    conn = media_tool.init_db()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def measure(client, url, count):
+    timings = []
+    for _ in range(count):
+        start = time.perf_counter()
+        response = client.get(url)
+        timings.append((time.perf_counter() - start) * 1000)
+        response.raise_for_status()
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=20000, help='Fichiers par label')
+    parser.add_argument('--overlap', type=float, default=0.9, help='Part des fichiers présents dans les deux labels')
+    parser.add_argument('--requests', type=int, default=100)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_api_')
+    media_tool.DB_NAME = os.path.join(workdir, media_tool.DB_NAME)
+    os.chdir(Path(__file__).resolve().parent.parent)  # static/, .thumb_cache
+    build_db(args.files, args.overlap)
+
+    import server
+    from fastapi.testclient import TestClient
+
+    endpoints = [
+        ('/api/sources', '/api/sources', args.requests),
+        ('/api/orphans', '/api/orphans?master=MASTER&target=TARGET', max(1, args.requests // 10)),
+    ]
+    pooled_db = server.read_db
+    print(f"{args.files} fichiers par label, {args.overlap:.0%} en commun")
+    with TestClient(server.app) as client:
+        for name, url, count in endpoints:
+            for mode, provider in (('avant', legacy_db), ('après', pooled_db)):
+                server.read_db = provider
+                client.get(url)  # Échauffement (cache de pages, pool)
+                p50, p95 = measure(client, url, count)
+                print(f"{name:14s} {mode:6s} p50 {p50:7.2f} ms   p95 {p95:7.2f} ms   ({count} requêtes)")
+    server.read_db = pooled_db
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Micro-benchmark du hachage : boucle historique (f.read 8 KB) vs moteur readinto/mmap.
+
+    python benchmarks/bench_hash.py --size-mb 1024 --algo sha256
+
+Par défaut le fichier est dans le cache (mesure du coût CPU / Python) ;
+--cold vide le cache du fichier avant chaque passe (mesure disque).
+"""
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import media_tool
+
+def legacy_hash(filepath, abort_callback=None):
+    """Version d'origine de get_file_hash."""
+    hasher = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        while chunk := f.read(8192):
+            if abort_callback and abort_callback():
+                return None
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def drop_cache(filepath):
+    fd = os.open(filepath, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=512)
+    parser.add_argument('--algo', default='sha256', choices=sorted(media_tool.HASH_ALGORITHMS))
+    parser.add_argument('--file', help='Fichier existant à hacher (sinon fichier temporaire)')
+    parser.add_argument('--cold', action='store_true', help='Vider le cache avant chaque passe')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    filepath = args.file
+    if not filepath:
+        fd, filepath = tempfile.mkstemp(prefix='bench_hash_')
+        with os.fdopen(fd, 'wb') as f:
+            block = os.urandom(1024 * 1024)
+            for _ in range(args.size_mb):
+                f.write(block)
+    size = os.path.getsize(filepath)
+    never = lambda: False
+
+    candidates = [
+        ('f.read 8 KB (historique, sha256)', lambda: legacy_hash(filepath, never)),
+        (f'readinto 1 MB ({args.algo})', lambda: media_tool.get_file_hash(filepath, never, args.algo, drop_cache=args.cold)),
+        (f'readinto 4 MB ({args.algo})', lambda: media_tool.get_file_hash(filepath, never, args.algo, 4 * 1024 * 1024, drop_cache=args.cold)),
+        (f'mmap ({args.algo})', lambda: media_tool.get_file_hash(filepath, never, args.algo, use_mmap=True, drop_cache=args.cold)),
+    ]
+    try:
+        for name, func in candidates:
+            best = None
+            for _ in range(args.repeat):
+                if args.cold:
+                    drop_cache(filepath)
+                start = time.perf_counter()
+                func()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            print(f"{name:36s} {best:.3f}s -> {size / best / 1024 / 1024:,.0f} MB/s")
+    finally:
+        if not args.file:
+            os.remove(filepath)
+
+if __name__ == '__main__':
+    main()
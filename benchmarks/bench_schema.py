@@ -0,0 +1,187 @@
+"""Taille de la base et requêtes : schéma 3 (chemins, labels et hashs en texte) vs schéma actuel.
+
+    python benchmarks/bench_schema.py --files 1000000 --repeat 5
+
+Construit une base au format d'avant (colonne ``path`` sur chaque ligne,
+UNIQUE(path, source_label)) avec deux labels de ``--files`` fichiers
+rangés par année / événement, mesure sa taille et les requêtes qui
+touchent aux chemins, puis la migre avec ``init_db`` et refait les mêmes
+mesures avec les fonctions de media_tool (dossiers internés, labels dans
+``sources``, hashs binaires). Les requêtes « avant » sont celles du code
+d'avant la migration, recopiées telles quelles. Le renommage d'un label
+est mesuré en aller-retour (BACKUP -> B2 -> BACKUP).
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import media_tool
+
+LEGACY_SCHEMA = '''
+    CREATE TABLE files (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        path TEXT NOT NULL,
+        filename TEXT NOT NULL,
+        extension TEXT,
+        size_bytes INTEGER,
+        mtime REAL,
+        hash TEXT,
+        source_label TEXT NOT NULL,
+        scan_date TEXT,
+        partial_hash TEXT,
+        hash_algo TEXT DEFAULT 'sha256',
+        is_ignored INTEGER NOT NULL DEFAULT 0,
+        parent_dir TEXT,
+        UNIQUE(path, source_label)
+    );
+    CREATE INDEX idx_hash ON files(hash);
+    CREATE INDEX idx_label_hash ON files(source_label, hash, hash_algo);
+    CREATE INDEX idx_size ON files(size_bytes);
+    CREATE INDEX idx_label_dir ON files(source_label, parent_dir);
+    PRAGMA user_version = 3;
+'''
+
+FILES_PER_DIR = 60
+EVENTS = ['Anniversaire', 'Vacances Bretagne', 'Noël en famille', 'Randonnée', 'Mariage', 'Week-end']
+
+def folder_of(label, i):
+    n = i // FILES_PER_DIR
+    year = 2005 + n % 18
+    return (f'/media/utilisateur/{label}_Sauvegarde_2To/Photos et vidéos/{year}/'
+            f'{year}-{1 + n % 12:02d}-{1 + n % 28:02d} {EVENTS[n % len(EVENTS)]} ({n})')
+
+def build_legacy_db(files, overlap):
+    """Base au schéma 3 : MASTER et BACKUP, ``overlap`` des hashs en commun."""
+    conn = media_tool.sqlite3.connect(media_tool.DB_NAME)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(LEGACY_SCHEMA)
+    shared = int(files * overlap)
+    now = time.strftime('%Y-%m-%dT%H:%M:%S')
+    for label in ('MASTER', 'BACKUP'):
+        def rows():
+            for i in range(files):
+                folder = folder_of(label, i)
+                name = f'IMG_{i % 10000:04d}.JPG'
+                file_hash = f'{i:064x}' if i < shared or label == 'MASTER' else f'{i + files:064x}'
+                yield (f'{folder}/{name}', name, '.jpg', 2000000 + i, 1500000000.0 + i, file_hash, 'sha256',
+                       label, now, 0, folder)
+        conn.executemany('''
+            INSERT INTO files (path, filename, extension, size_bytes, mtime, hash, hash_algo, source_label,
+                               scan_date, is_ignored, parent_dir)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows())
+    conn.commit()
+    conn.execute('VACUUM')
+    conn.close()
+
+def db_size():
+    return sum(os.path.getsize(media_tool.DB_NAME + suffix) for suffix in ('', '-wal')
+               if os.path.exists(media_tool.DB_NAME + suffix))
+
+def timed(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+LEGACY_ORPHANS = '''
+    SELECT {select} FROM files t
+    WHERE t.source_label = 'BACKUP' AND t.is_ignored = 0 {where}
+    AND NOT EXISTS (SELECT 1 FROM files m WHERE m.source_label = 'MASTER' AND m.hash = t.hash AND m.hash_algo = t.hash_algo)
+    {tail}
+'''
+
+def legacy_queries(conn, folder, sample, window):
+    return {
+        'orphelins par dossier': lambda: conn.execute(LEGACY_ORPHANS.format(
+            select='t.parent_dir, COUNT(*), SUM(t.size_bytes)', where='',
+            tail='GROUP BY t.parent_dir ORDER BY COUNT(*) DESC, t.parent_dir')).fetchall(),
+        "page d'un dossier": lambda: conn.execute(LEGACY_ORPHANS.format(
+            select='t.id, t.path, t.filename, t.size_bytes, t.hash', where='AND t.parent_dir = ?',
+            tail='ORDER BY t.filename, t.id LIMIT 201'), (folder,)).fetchall(),
+        'liste des orphelins': lambda: sum(1 for _ in conn.execute(LEGACY_ORPHANS.format(
+            select='t.path, t.filename, t.size_bytes, t.hash', where='', tail=''))),
+        '1000 chemins (copie)': lambda: [conn.execute(
+            f"SELECT path, hash, hash_algo, source_label FROM files WHERE path IN ({','.join('?' * len(sample))})",
+            sample).fetchall()],
+        'fenêtre scan --update': lambda: conn.execute(
+            'SELECT filename, size_bytes, mtime FROM files WHERE parent_dir = ? AND source_label = ?',
+            (window, 'BACKUP')).fetchall(),
+        'renommage du label': lambda: [conn.execute('UPDATE files SET source_label = ? WHERE source_label = ?', names)
+                                       and conn.commit() for names in (('B2', 'BACKUP'), ('BACKUP', 'B2'))],
+    }
+
+def current_queries(conn, writer, folder, sample, window):
+    def detector_window():
+        detector = media_tool.ChangeDetector(conn, 'BACKUP')
+        detector._load(window)
+    def rename():
+        with contextlib.redirect_stdout(io.StringIO()):
+            media_tool.rename_source(writer, 'BACKUP', 'B2')
+            media_tool.rename_source(writer, 'B2', 'BACKUP')
+    return {
+        'orphelins par dossier': lambda: media_tool.orphan_folders(conn, 'MASTER', 'BACKUP'),
+        "page d'un dossier": lambda: media_tool.orphan_files_page(conn, 'MASTER', 'BACKUP', folder),
+        'liste des orphelins': lambda: sum(1 for _ in media_tool.iter_orphans(conn, 'MASTER', 'BACKUP')),
+        '1000 chemins (copie)': lambda: media_tool.indexed_files(conn, sample),
+        'fenêtre scan --update': detector_window,
+        'renommage du label': rename,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=1000000, help='Fichiers par label (2 labels)')
+    parser.add_argument('--overlap', type=float, default=0.98, help='Part des fichiers de BACKUP présents dans MASTER')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_schema_')
+    media_tool.DB_NAME = os.path.join(workdir, media_tool.DB_NAME)
+    start = time.perf_counter()
+    build_legacy_db(args.files, args.overlap)
+    print(f"{2 * args.files} lignes générées en {time.perf_counter() - start:.1f} s")
+
+    rng = random.Random(0)
+    orphan_index = int(args.files * args.overlap) + 1
+    folder = folder_of('BACKUP', orphan_index)
+    sample = [f"{folder_of('BACKUP', i)}/IMG_{i % 10000:04d}.JPG"
+              for i in rng.sample(range(args.files), min(1000, args.files))]
+    window = folder_of('BACKUP', 0)  # Fenêtre de ChangeDetector : un dossier
+
+    sizes = {'avant': db_size()}
+    conn = media_tool.connect()
+    timings = {'avant': {name: timed(query, args.repeat)
+                         for name, query in legacy_queries(conn, folder, sample, window).items()}}
+    conn.close()
+
+    start = time.perf_counter()
+    media_tool.init_db().close()  # Migration (et VACUUM)
+    migration = time.perf_counter() - start
+    sizes['après'] = db_size()
+    conn, writer = media_tool.connect(readonly=True), media_tool.connect()
+    timings['après'] = {name: timed(query, args.repeat)
+                        for name, query in current_queries(conn, writer, folder, sample, window).items()}
+    directories = conn.execute('SELECT COUNT(*) FROM directories').fetchone()[0]
+    conn.close()
+    writer.close()
+
+    print(f"Migration : {migration:.1f} s ({directories} dossiers internés)")
+    print(f"Taille de la base : {sizes['avant'] / 2**20:.0f} MB -> {sizes['après'] / 2**20:.0f} MB "
+          f"({1 - sizes['après'] / sizes['avant']:.0%} de moins)")
+    print(f"{'requête':24s} {'avant':>10s} {'après':>10s}")
+    for name in timings['avant']:
+        before, after = timings['avant'][name], timings['après'][name]
+        print(f"{name:24s} {before:8.1f} ms {after:8.1f} ms   x{before / after:.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Benchmark du parcours seul : boucle os.walk historique vs media_tool.walk_files.
+
+Génère (une fois) une arborescence synthétique de fichiers vides puis mesure
+le débit de chaque parcours, filtres d'extension et stat compris, sans hachage.
+
+    python benchmarks/bench_walk.py --files 1000000 --dir /tmp/bench_tree
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import media_tool
+
+EXTENSIONS = ['.jpg', '.jpg', '.jpg', '.nef', '.mp4', '.xmp', '.png', '.txt']
+
+def build_tree(root, n_files, per_dir=200, fanout=10):
+    """Crée n_files fichiers vides répartis en dossiers de per_dir fichiers."""
+    marker = Path(root) / f'.bench_{n_files}'
+    if marker.exists():
+        return
+    print(f"Génération de {n_files} fichiers dans {root}...")
+    n_dirs = (n_files + per_dir - 1) // per_dir
+    created = 0
+    for d in range(n_dirs):
+        # Dossiers imbriqués : a/b/c sur une base `fanout`
+        parts = []
+        x = d
+        for _ in range(3):
+            parts.append(f"d{x % fanout}")
+            x //= fanout
+        parts.append(f"set{d}")
+        folder = Path(root).joinpath(*parts)
+        folder.mkdir(parents=True, exist_ok=True)
+        for i in range(min(per_dir, n_files - created)):
+            open(folder / f"IMG_{i:05d}{EXTENSIONS[i % len(EXTENSIONS)]}", 'wb').close()
+            created += 1
+    marker.touch()
+
+def legacy_walk(root, exclude_ext, include_ext=None):
+    """Reproduit la boucle d'origine de scan_directory (os.walk + Path.stat)."""
+    count = 0
+    for dirpath, dirs, files in os.walk(root):
+        for file in files:
+            filepath = Path(dirpath) / file
+            ext = filepath.suffix.lower()
+            if ext in exclude_ext:
+                continue
+            if include_ext is not None and ext not in include_ext:
+                continue
+            stat = filepath.stat()
+            if stat.st_size >= 0:
+                count += 1
+    return count
+
+def scandir_walk(root, exclude_ext, include_ext=None):
+    count = 0
+    for _ in media_tool.walk_files(root, exclude_ext, include_ext):
+        count += 1
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=1_000_000)
+    parser.add_argument('--dir', default='/tmp/bench_walk_tree')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    build_tree(args.dir, args.files)
+    for name, func in (('os.walk (historique)', legacy_walk), ('walk_files (scandir)', scandir_walk)):
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            count = func(args.dir, media_tool.DEFAULT_EXCLUDE_EXT)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"{name:24s} {count} fichiers en {best:.2f}s -> {count / best:,.0f} fichiers/s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,359 @@
+"""Suite de benchmarks reproductible : scans, rescans --update, orphelins et copies.
+
+    python benchmarks/run_suite.py --output results.json
+    python benchmarks/run_suite.py --files 2000 --rows 10000 --output new.json --compare results.json
+
+Les données sont synthétiques et déterministes (voir synthetic.py) :
+arborescence de fichiers réels pour les scans et les copies, index
+généré directement pour les orphelins (10k, 1M et 5M lignes par label par
+défaut). Arborescence et index sont gardés dans ``--work-dir`` et
+réutilisés tant que les paramètres ne changent pas. Les résultats
+(médiane, minimum et toutes les mesures, plus la machine, la version de
+SQLite et le commit) sont écrits en JSON pour comparer les exécutions ;
+``--compare`` affiche le rapport avec un fichier précédent. Aucun accès
+réseau : l'API est appelée par le TestClient de FastAPI, s'il est installé.
+
+Scan à froid : le cache de pages est vidé avant chaque passe
+(/proc/sys/vm/drop_caches en root, sinon posix_fadvise fichier par fichier,
+qui ne vide pas les métadonnées ; la méthode est notée dans les résultats).
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import media_tool
+import synthetic
+
+SCENARIOS = ['scan', 'update', 'orphans', 'copy']
+
+@contextlib.contextmanager
+def quiet():
+    """Les fonctions mesurées affichent leur progression : on la jette."""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+def drop_caches(root):
+    """Vide le cache de pages (arborescence et base) ; renvoie la méthode employée."""
+    os.sync()
+    try:
+        with open('/proc/sys/vm/drop_caches', 'w') as f:
+            f.write('3\n')
+        return 'drop_caches'
+    except OSError:
+        pass
+    for path, _, _, _, _ in media_tool.walk_files(root, set(), skip_system=False):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    return 'fadvise'
+
+def remove_db(path):
+    for suffix in ('', '-wal', '-shm'):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path + suffix)
+
+def measure(name, params, func, repeat, setup=None, **extra):
+    """Exécute ``func`` ``repeat`` fois (``setup`` avant chaque passe, non mesuré)."""
+    runs = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        runs.append((time.perf_counter() - start) * 1000)
+    result = dict(name=name, params=params, runs_ms=[round(r, 3) for r in runs],
+                  median_ms=round(statistics.median(runs), 3), min_ms=round(min(runs), 3), **extra)
+    best = min(runs) / 1000
+    if 'files' in extra and best:
+        result['files_per_s'] = round(extra['files'] / best, 1)
+    if 'bytes' in extra and best:
+        result['mb_per_s'] = round(extra['bytes'] / 2**20 / best, 1)
+    print(f"{name:28s} {json.dumps(params, ensure_ascii=False):40s} médiane {result['median_ms']:10.1f} ms"
+          + (f"   {result['mb_per_s']:8.1f} MB/s" if 'mb_per_s' in result else ''))
+    return result
+
+def copy_db(src, dst):
+    remove_db(dst)
+    with contextlib.closing(sqlite3.connect(src)) as source, contextlib.closing(sqlite3.connect(dst)) as target:
+        source.backup(target)
+
+def bench_scans(args, tree, manifest, scenarios):
+    """Scans complets à froid et à chaud, puis rescans --update (rien de changé, ``--touch`` modifiés,
+    dossiers réorganisés)."""
+    results = []
+    db = os.path.join(args.work_dir, 'scan.db')
+    media_tool.DB_NAME = db
+    files = manifest['params']['files']
+    params = dict(files=files, profile=manifest['params']['profile'], workers=args.workers, staged=args.staged)
+
+    def scan(update=False, progress=None):
+        conn = media_tool.init_db()
+        with quiet():
+            media_tool.scan_directory(conn, tree, 'BENCH', 0, set(), update, progress_callback=progress,
+                                      staged=args.staged, workers=args.workers)
+        conn.close()
+
+    if 'scan' in scenarios:
+        cache = {}
+        def cold_setup():
+            remove_db(db)
+            cache['method'] = drop_caches(tree)
+        results.append(measure('scan_cold', params, scan, args.repeat, cold_setup,
+                               files=files, bytes=manifest['bytes']))
+        results[-1]['cache_drop'] = cache['method']
+        scan()  # Cache de pages rempli
+        results.append(measure('scan_warm', params, scan, args.repeat, lambda: remove_db(db),
+                               files=files, bytes=manifest['bytes']))
+
+    if 'update' in scenarios or 'copy' in scenarios:
+        remove_db(db)
+        scan()
+    if 'update' in scenarios:
+        results.append(measure('scan_update_unchanged', params, lambda: scan(update=True), args.repeat, files=files))
+        touched = []
+        def touch():
+            if touched:
+                synthetic.restore_files(tree, manifest, touched)
+                scan(update=True)
+            touched[:] = synthetic.touch_files(tree, manifest, args.touch)
+        try:
+            results.append(measure('scan_update_touched', dict(params, touched=args.touch), lambda: scan(update=True),
+                                   args.repeat, touch, files=files))
+            results[-1].update(touched_files=len(touched), touched_bytes=sum(entry[2] for entry in touched))
+        finally:
+            synthetic.restore_files(tree, manifest, touched)
+            scan(update=True)
+
+        # Dossiers de premier niveau renommés, index d'avant le renommage restauré
+        # à chaque passe : tous les fichiers sont à reprendre (HashReuse)
+        baseline = db + '.before_move'
+        copy_db(db, baseline)
+        tops = sorted(entry.name for entry in os.scandir(tree) if entry.is_dir())
+        moved = []
+        def move(forward):
+            for name in tops:
+                pair = (os.path.join(tree, name), os.path.join(tree, name + '_moved'))
+                os.rename(*(pair if forward else pair[::-1]))
+            moved[:] = [True] if forward else []
+        def reorganize():
+            if moved:
+                move(False)
+            copy_db(baseline, db)
+            move(True)
+        progress = {}
+        try:
+            results.append(measure('scan_update_reorganized', params, lambda: scan(update=True, progress=progress.update),
+                                   args.repeat, reorganize, files=files))
+            results[-1].update(reused_files=progress.get('reused'), reused_bytes=progress.get('bytes_reused'))
+        finally:
+            if moved:
+                move(False)
+            copy_db(baseline, db)
+            remove_db(baseline)
+    return results
+
+def bench_copy(args, tree, manifest):
+    """Copies vérifiées d'un lot de fichiers indexés (copy_indexed_files), destination vidée entre les passes."""
+    media_tool.DB_NAME = os.path.join(args.work_dir, 'scan.db')
+    dest = os.path.join(args.work_dir, 'copy_dest')
+    conn = media_tool.connect()
+    rows = conn.execute('''
+        SELECT f.path, f.size_bytes FROM file_paths f JOIN sources s ON s.id = f.source_id
+        WHERE s.label = 'BENCH' AND f.hash IS NOT NULL ORDER BY f.id LIMIT ?
+    ''', (args.copy_files,)).fetchall()
+    paths = [row[0] for row in rows]
+
+    def copy():
+        with quiet():
+            stats = media_tool.copy_indexed_files(conn, paths, dest, dest_label='BENCH_COPY', workers=args.workers)
+        if stats['copied'] != len(paths):
+            raise RuntimeError(f"Copie incomplète : {stats}")
+
+    def setup():
+        shutil.rmtree(dest, ignore_errors=True)
+
+    try:
+        return [measure('copy_batch', dict(files=len(paths), workers=args.workers), copy, args.repeat, setup,
+                        files=len(paths), bytes=sum(row[1] for row in rows))]
+    finally:
+        shutil.rmtree(dest, ignore_errors=True)
+        conn.close()
+
+def index_db(args, rows):
+    """Base d'orphelins de ``rows`` lignes par label, générée une fois puis réutilisée."""
+    path = os.path.join(args.work_dir, f'index_{rows}_s{args.seed}_o{args.overlap}.db')
+    if os.path.exists(path):
+        media_tool.DB_NAME = path
+        conn = media_tool.connect()
+        ready = conn.execute('PRAGMA user_version').fetchone()[0] == media_tool.SCHEMA_VERSION
+        conn.close()
+        if ready:
+            return path
+        remove_db(path)
+    # Générée sous un autre nom : une génération interrompue n'est jamais réutilisée
+    print(f"Génération de l'index : 2 x {rows} lignes...")
+    start = time.perf_counter()
+    media_tool.DB_NAME = path + '.tmp'
+    remove_db(media_tool.DB_NAME)
+    conn = media_tool.init_db()
+    synthetic.build_index(conn, rows, args.overlap, seed=args.seed)
+    conn.execute('PRAGMA optimize')
+    conn.close()
+    os.replace(media_tool.DB_NAME, path)
+    media_tool.DB_NAME = path
+    print(f"  en {time.perf_counter() - start:.1f} s")
+    return path
+
+def api_client():
+    try:
+        from fastapi.testclient import TestClient
+        import server
+    except ImportError:
+        return None
+    return server, TestClient
+
+def bench_orphans(args):
+    """Orphelins : cache construit puis à jour, résumé par dossier, liste, page, et API."""
+    results = []
+    api = api_client()
+    for rows in args.rows:
+        index_db(args, rows)
+        params = dict(rows=rows, overlap=args.overlap)
+        conn = media_tool.connect()
+        reader = media_tool.connect(readonly=True)
+
+        def reset_cache():
+            conn.execute('DELETE FROM orphan_cache')
+            conn.execute('DELETE FROM orphan_cache_items')
+            conn.commit()
+
+        def refresh():
+            cache['id'] = media_tool.refresh_orphan_cache(conn, 'MASTER', 'BACKUP')
+
+        cache = {}
+        results.append(measure('orphans_cache_build', params, refresh, args.repeat, reset_cache))
+        results.append(measure('orphans_cache_fresh', params, refresh, args.repeat))
+        results.append(measure('orphans_folders_uncached', params,
+                               lambda: media_tool.orphan_folders(reader, 'MASTER', 'BACKUP'), args.repeat))
+        folders = media_tool.orphan_folders(reader, 'MASTER', 'BACKUP', cache_id=cache['id'])
+        results.append(measure('orphans_folders', params,
+                               lambda: media_tool.orphan_folders(reader, 'MASTER', 'BACKUP', cache_id=cache['id']),
+                               args.repeat))
+        orphans = sum(1 for _ in media_tool.iter_orphans(reader, 'MASTER', 'BACKUP', cache_id=cache['id']))
+        results.append(measure('orphans_list', params,
+                               lambda: sum(1 for _ in media_tool.iter_orphans(reader, 'MASTER', 'BACKUP', cache_id=cache['id'])),
+                               args.repeat, files=orphans))
+        if folders:
+            results.append(measure('orphans_page', params,
+                                   lambda: media_tool.orphan_files_page(reader, 'MASTER', 'BACKUP', folders[0][0],
+                                                                        cache_id=cache['id']),
+                                   args.repeat))
+        def find_orphans():
+            with quiet():
+                media_tool.find_orphans(conn, 'MASTER', 'BACKUP')
+        results.append(measure('find_orphans', params, find_orphans, args.repeat, files=orphans))
+        reader.close()
+        conn.close()
+
+        if api:
+            server, TestClient = api
+            with TestClient(server.app) as client:
+                for endpoint in ('/api/orphans/folders', '/api/orphans'):
+                    if endpoint == '/api/orphans' and orphans > args.api_max_orphans:
+                        continue  # Réponse JSON de tous les fichiers : hors de propos à cette taille
+                    url = f'{endpoint}?master=MASTER&target=BACKUP'
+                    results.append(measure(f'api {endpoint}', params,
+                                           lambda: client.get(url).raise_for_status(), args.repeat))
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=Path(__file__).resolve().parent,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, previous_path):
+    """Rapport des médianes avec une exécution précédente (mêmes scénario et paramètres)."""
+    with open(previous_path, encoding='utf-8') as f:
+        previous = {(r['name'], json.dumps(r['params'], sort_keys=True)): r for r in json.load(f)['results']}
+    print(f"\nComparaison avec {previous_path}")
+    print(f"{'scénario':28s} {'paramètres':40s} {'avant':>10s} {'après':>10s}")
+    for result in results:
+        old = previous.get((result['name'], json.dumps(result['params'], sort_keys=True)))
+        if old:
+            print(f"{result['name']:28s} {json.dumps(result['params'], ensure_ascii=False):40s} "
+                  f"{old['median_ms']:8.1f} ms {result['median_ms']:8.1f} ms   x{old['median_ms'] / result['median_ms']:.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"Parmi {', '.join(SCENARIOS)}")
+    parser.add_argument('--work-dir', default='/tmp/media_bench', help='Arborescence, bases générées (réutilisées)')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='Résultats précédents (JSON) à comparer')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    # Arborescence des scans et copies
+    parser.add_argument('--files', type=int, default=5000)
+    parser.add_argument('--profile', choices=sorted(synthetic.SIZE_PROFILES), default='small')
+    parser.add_argument('--duplicates', type=float, default=0.1)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fanout', type=int, default=8)
+    parser.add_argument('--per-dir', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--staged', action='store_true', help='Scans par étapes (hash des seules tailles en collision)')
+    parser.add_argument('--touch', type=float, default=0.01, help='Part des fichiers modifiés avant un rescan --update')
+    parser.add_argument('--copy-files', type=int, default=500)
+    # Index des orphelins
+    parser.add_argument('--rows', default='10000,1000000,5000000', help='Lignes par label (liste)')
+    parser.add_argument('--overlap', type=float, default=0.98)
+    parser.add_argument('--api-max-orphans', type=int, default=50000)
+    args = parser.parse_args()
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Scénarios inconnus : {', '.join(sorted(unknown))}")
+    args.rows = [int(r) for r in args.rows.split(',') if r]
+    args.work_dir = os.path.abspath(args.work_dir)
+    args.output = os.path.abspath(args.output)
+    os.makedirs(args.work_dir, exist_ok=True)
+    os.chdir(Path(__file__).resolve().parent.parent)  # static/, .thumb_cache du serveur
+
+    meta = dict(date=time.strftime('%Y-%m-%dT%H:%M:%S'), commit=git_commit(), python=platform.python_version(),
+                sqlite=sqlite3.sqlite_version, platform=platform.platform(), cpus=os.cpu_count(),
+                args={k: v for k, v in vars(args).items() if k not in ('output', 'compare')})
+    results = []
+    if {'scan', 'update', 'copy'} & set(scenarios):
+        tree = os.path.join(args.work_dir, 'tree')
+        manifest = synthetic.generate_tree(tree, args.files, args.seed, args.profile, args.duplicates,
+                                           args.depth, args.fanout, args.per_dir)
+        meta['tree'] = manifest
+        results += bench_scans(args, tree, manifest, scenarios)
+        if 'copy' in scenarios:
+            results += bench_copy(args, tree, manifest)
+    if 'orphans' in scenarios:
+        results += bench_orphans(args)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(dict(meta=meta, results=results), f, indent=2, ensure_ascii=False)
+    print(f"\nRésultats écrits dans {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""Générateur déterministe d'arborescences et d'index synthétiques pour les benchmarks.
+
+    python benchmarks/synthetic.py --dir /tmp/bench_tree --files 5000 --profile photos --duplicates 0.1
+
+Tout dérive de ``--seed`` : contenus, tailles, noms, dates et dossiers sont
+identiques d'une machine à l'autre, et une arborescence déjà générée avec
+les mêmes paramètres (manifeste ``.bench_manifest.json``) est réutilisée.
+Aucun accès réseau, aucun fichier réel n'est lu.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import media_tool
+
+MANIFEST_NAME = '.bench_manifest.json'
+BLOCK_SIZE = 64 * 1024
+BASE_MTIME = 1500000000  # Dates fixes : un rescan --update ne voit rien de changé
+
+# Profils de tailles : (poids, taille min, taille max, extensions), tirage uniforme dans la tranche
+SIZE_PROFILES = {
+    # Rapide, pour la CI ou un portable : quelques centaines de MB pour 5000 fichiers
+    'small': [
+        (0.70, 8 * 1024, 200 * 1024, ['.jpg', '.jpg', '.png']),
+        (0.25, 200 * 1024, 1024 * 1024, ['.jpg', '.heic', '.nef']),
+        (0.05, 1024 * 1024, 4 * 1024 * 1024, ['.mp4', '.mov']),
+    ],
+    # Proche d'une sauvegarde de photos : JPEG, RAW et quelques vidéos
+    'photos': [
+        (0.60, 2 * 1024 * 1024, 6 * 1024 * 1024, ['.jpg', '.jpg', '.heic']),
+        (0.30, 20 * 1024 * 1024, 30 * 1024 * 1024, ['.nef', '.cr2', '.arw']),
+        (0.10, 50 * 1024 * 1024, 200 * 1024 * 1024, ['.mp4', '.mov']),
+    ],
+    # Beaucoup de tailles identiques : met à l'épreuve le scan par étapes (empreintes partielles)
+    'collisions': [
+        (1.00, 256 * 1024, 256 * 1024, ['.jpg']),
+    ],
+}
+# Petits fichiers techniques mêlés aux médias (filtrés par extension ou comme bruit)
+NOISE_FILES = [('.xmp', 2048), ('.txt', 512), ('.json', 1024)]
+
+def _block(seed, content_id):
+    """Bloc pseudo-aléatoire propre à un contenu (reproductible, incompressible)."""
+    return random.Random(seed * 1000003 + content_id).getrandbits(8 * BLOCK_SIZE).to_bytes(BLOCK_SIZE, 'little')
+
+def write_content(path, seed, content_id, size):
+    """Écrit ``size`` octets du contenu ``content_id`` : deux contenus distincts diffèrent dès le premier bloc."""
+    block = bytearray(_block(seed, content_id))
+    header = f'{seed}:{content_id}:{size};'.encode()
+    block[:len(header)] = header
+    with open(path, 'wb') as f:
+        written = 0
+        while written < size:
+            chunk = block[:min(BLOCK_SIZE, size - written)]
+            f.write(chunk)
+            written += len(chunk)
+
+def plan_tree(files, seed=0, profile='small', duplicates=0.0, depth=3, fanout=8, per_dir=100, noise=0.05):
+    """Liste des fichiers à créer : [(chemin relatif, id de contenu, taille, mtime)].
+
+    Une part ``duplicates`` des fichiers reprend le contenu (et la taille)
+    d'un fichier précédent, rangé dans un autre dossier. Les dossiers sont
+    répartis sur ``depth`` niveaux de ``fanout`` sous-dossiers, chacun
+    portant au plus ``per_dir`` fichiers.
+    """
+    rng = random.Random(seed)
+    buckets = SIZE_PROFILES[profile]
+    weights = [bucket[0] for bucket in buckets]
+    plan = []
+    originals = []
+    for i in range(files):
+        n = i // per_dir
+        parts = []
+        x = n
+        for level in range(depth):
+            parts.append(f'{2005 + x % fanout}' if level == 0 else f'{level}-{x % fanout:02d}')
+            x //= fanout
+        folder = os.path.join(*parts, f'Événement {n:05d}')
+        if rng.random() < noise:
+            ext, size = NOISE_FILES[i % len(NOISE_FILES)]
+            plan.append((os.path.join(folder, f'meta_{i:07d}{ext}'), files + i, size, BASE_MTIME + i))
+            continue
+        if originals and rng.random() < duplicates:
+            content_id, size, ext = originals[rng.randrange(len(originals))]
+        else:
+            _, low, high, exts = rng.choices(buckets, weights)[0]
+            content_id, size, ext = i, rng.randint(low, high), rng.choice(exts)
+            originals.append((content_id, size, ext))
+        plan.append((os.path.join(folder, f'IMG_{i:07d}{ext}'), content_id, size, BASE_MTIME + i))
+    return plan
+
+def generate_tree(root, files, seed=0, profile='small', duplicates=0.0, depth=3, fanout=8, per_dir=100, noise=0.05):
+    """Crée (ou réutilise) l'arborescence et renvoie son manifeste (paramètres, totaux)."""
+    params = dict(files=files, seed=seed, profile=profile, duplicates=duplicates, depth=depth,
+                  fanout=fanout, per_dir=per_dir, noise=noise)
+    manifest_path = Path(root) / MANIFEST_NAME
+    try:
+        manifest = json.loads(manifest_path.read_text())
+        if manifest['params'] == params:
+            return manifest
+    except (OSError, ValueError, KeyError):
+        pass
+    if os.path.isdir(root):
+        shutil.rmtree(root)
+    print(f"Génération de {files} fichiers ({profile}, {duplicates:.0%} de doublons) dans {root}...")
+    start = time.perf_counter()
+    total_bytes = 0
+    dirs = set()
+    for rel, content_id, size, mtime in plan_tree(files, seed, profile, duplicates, depth, fanout, per_dir, noise):
+        path = os.path.join(root, rel)
+        folder = os.path.dirname(path)
+        if folder not in dirs:
+            os.makedirs(folder, exist_ok=True)
+            dirs.add(folder)
+        write_content(path, seed, content_id, size)
+        os.utime(path, (mtime, mtime))
+        total_bytes += size
+    manifest = dict(params=params, bytes=total_bytes, dirs=len(dirs),
+                    generated_in=round(time.perf_counter() - start, 1))
+    manifest_path.write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+def touch_files(root, manifest, fraction):
+    """Modifie (contenu et date) une part des fichiers : ce que doit retrouver un rescan --update.
+
+    Renvoie les entrées du plan touchées, à passer à ``restore_files``.
+    """
+    plan = plan_tree(**manifest['params'])
+    touched = random.Random(manifest['params']['seed'] + 1).sample(plan, int(len(plan) * fraction))
+    for rel, _, _, mtime in touched:
+        path = os.path.join(root, rel)
+        with open(path, 'r+b') as f:
+            f.write(b'touched')
+        os.utime(path, (mtime + 1, mtime + 1))
+    return touched
+
+def restore_files(root, manifest, entries):
+    """Remet les fichiers touchés dans leur état généré (le manifeste reste valable)."""
+    seed = manifest['params']['seed']
+    for rel, content_id, size, mtime in entries:
+        path = os.path.join(root, rel)
+        write_content(path, seed, content_id, size)
+        os.utime(path, (mtime, mtime))
+
+def folder_of(label, i, per_dir=60):
+    """Dossier synthétique (année / date et événement) du fichier ``i`` d'un label indexé."""
+    n = i // per_dir
+    year = 2005 + n % 18
+    return f'/media/bench/{label}/Photos/{year}/{year}-{1 + n % 12:02d}-{1 + n % 28:02d} Événement {n}'
+
+def build_index(conn, rows, overlap=0.98, labels=('MASTER', 'BACKUP'), seed=0, batch=50000):
+    """Remplit l'index de ``rows`` lignes par label, sans fichier sur le disque.
+
+    Une part ``overlap`` des fichiers du dernier label a son hash dans le
+    premier (les autres sont ses orphelins) ; 1 % des fichiers de chaque
+    label sont des doublons internes. Les lignes passent par UPSERT_FILE_SQL
+    et ses triggers, comme un scan.
+    """
+    rng = random.Random(seed)
+    paths = media_tool.PathIndex(conn)
+    now = time.strftime('%Y-%m-%dT%H:%M:%S')
+    shared = int(rows * overlap)
+    for n, label in enumerate(labels):
+        source = media_tool.source_id(conn, label, create=True)
+        values = []
+        for i in range(rows):
+            content = i if n == 0 or i < shared else rows * n + i
+            if rng.random() < 0.01:
+                content = rng.randrange(max(1, i))  # Doublon interne
+            ext = '.jpg' if i % 10 else '.nef'
+            values.append((paths.dir_id(folder_of(label, i)), f'IMG_{i:07d}{ext}', ext, 2000000 + content,
+                           BASE_MTIME + i, content.to_bytes(32, 'big'), 'sha256', source, now, 0, None))
+            if len(values) >= batch:
+                conn.executemany(media_tool.UPSERT_FILE_SQL, values)
+                values.clear()
+        conn.executemany(media_tool.UPSERT_FILE_SQL, values)
+        conn.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dir', default='/tmp/bench_tree')
+    parser.add_argument('--files', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--profile', choices=sorted(SIZE_PROFILES), default='small')
+    parser.add_argument('--duplicates', type=float, default=0.1, help='Part des fichiers copiant un fichier précédent')
+    parser.add_argument('--depth', type=int, default=3, help='Niveaux de dossiers')
+    parser.add_argument('--fanout', type=int, default=8, help='Sous-dossiers par niveau')
+    parser.add_argument('--per-dir', type=int, default=100, help='Fichiers par dossier')
+    args = parser.parse_args()
+
+    manifest = generate_tree(args.dir, args.files, args.seed, args.profile, args.duplicates,
+                             args.depth, args.fanout, args.per_dir)
+    print(json.dumps(manifest, indent=2))
+
+if __name__ == '__main__':
+    main()
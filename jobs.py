@@ -0,0 +1,204 @@
+import os
+import time
+import itertools
+import threading
+from collections import deque
+
+import media_tool
+import metrics
+
+# États d'un job de scan
+ACTIVE_STATES = ('queued', 'running', 'paused')
+FINAL_STATES = ('finished', 'stopped', 'error')
+MAX_FINISHED_JOBS = 50  # Jobs terminés conservés pour consultation
+
+class ScanJob:
+    """Un scan (chemin, label, options) avec son état, sa progression et son arrêt.
+
+    ``should_stop`` sert de callback d'arrêt au scan : il bloque tant que le
+    job est en pause, ce qui suspend aussi les hachages en cours (le callback
+    est consulté pendant la lecture des gros fichiers).
+    Avec ``profile``, le scan tourne sous cProfile et ``profile_report``
+    garde le rapport (voir ``metrics.profiled``).
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, path, label, device, options, profile=False):
+        self.id = next(ScanJob._ids)
+        self.path = path
+        self.label = label
+        self.device = device
+        self.options = options
+        self.profile = profile
+        self.profile_report = None
+        self.state = 'queued'
+        self.progress = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._cancel = threading.Event()
+        self._resume = threading.Event()
+        self._resume.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def report(self, data):
+        self.progress = data
+
+    def should_stop(self):
+        if not self._resume.is_set():
+            self.state = 'paused'
+            self._resume.wait()
+            if not self._cancel.is_set():
+                self.state = 'running'
+        return self._cancel.is_set()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "path": self.path,
+            "label": self.label,
+            "device": self.device,
+            "state": self.state,
+            "progress": self.progress,
+            "error": self.error,
+            "profile": self.profile,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished
+        }
+
+def run_scan_job(job):
+    """Exécute un job avec sa propre connexion (une par thread).
+
+    Le schéma est déjà initialisé par l'appelant (serveur ou ligne de commande).
+    """
+    conn = media_tool.connect()
+    report = None
+    try:
+        with metrics.profiled(job.profile) as report:
+            media_tool.scan_directory(conn, job.path, job.label, progress_callback=job.report,
+                                      abort_callback=job.should_stop, **job.options)
+    finally:
+        job.profile_report = report and report.text
+        conn.close()
+
+class JobScheduler:
+    """Planificateur de scans : une file par disque physique, les disques en parallèle.
+
+    Deux scans d'un même disque se disputeraient la tête de lecture (ou le
+    bus USB) : ils passent l'un après l'autre. Des disques différents sont
+    scannés simultanément, chacun par son propre thread, créé à la demande
+    et arrêté quand sa file est vide. Un job en pause dans la file cède son
+    tour aux suivants.
+    """
+
+    def __init__(self, runner=run_scan_job):
+        self.runner = runner
+        self._jobs = {}
+        self._queues = {}
+        self._threads = {}
+        self._cond = threading.Condition()
+
+    def submit(self, path, label, profile=False, **options):
+        """Met un scan en file sur le disque de ``path`` et renvoie le job (profilé si ``profile``)."""
+        device = media_tool.physical_device(os.stat(path).st_dev)
+        job = ScanJob(path, label, device, options, profile)
+        with self._cond:
+            self._jobs[job.id] = job
+            self._queues.setdefault(device, deque()).append(job)
+            if device not in self._threads:
+                thread = threading.Thread(target=self._worker, args=(device,), name=f'scan-{device}', daemon=True)
+                self._threads[device] = thread
+                thread.start()
+            self._cond.notify_all()
+        return job
+
+    def _next_job(self, device):
+        queue = self._queues[device]
+        for job in queue:
+            if job._resume.is_set():
+                queue.remove(job)
+                return job
+        return None
+
+    def _worker(self, device):
+        while True:
+            with self._cond:
+                job = self._next_job(device)
+                while job is None:
+                    if not self._queues[device]:
+                        del self._queues[device]
+                        del self._threads[device]
+                        return
+                    self._cond.wait()
+                    job = self._next_job(device)
+            job.state = 'running'
+            job.started = time.time()
+            try:
+                self.runner(job)
+                self._finish(job, 'stopped' if job.cancelled else 'finished')
+            except Exception as e:
+                job.error = str(e)
+                self._finish(job, 'error')
+
+    def _finish(self, job, state):
+        job.state = state
+        job.finished = time.time()
+        with self._cond:
+            done = [j for j in self._jobs.values() if j.state in FINAL_STATES]
+            for old in done[:-MAX_FINISHED_JOBS]:
+                del self._jobs[old.id]
+
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._cond:
+            return list(self._jobs.values())
+
+    def active(self):
+        return [job for job in self.jobs() if job.state in ACTIVE_STATES]
+
+    def pause(self, job_id):
+        job = self.get(job_id)
+        if job and job.state in ('queued', 'running'):
+            job._resume.clear()
+            job.state = 'paused'
+        return job
+
+    def resume(self, job_id):
+        job = self.get(job_id)
+        if job and job.state == 'paused':
+            with self._cond:
+                job.state = 'queued' if job.started is None else 'running'
+                job._resume.set()
+                self._cond.notify_all()
+        return job
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job and job.state in ACTIVE_STATES:
+            with self._cond:
+                job._cancel.set()
+                job._resume.set()  # Débloque un job en pause pour qu'il s'arrête
+                queue = self._queues.get(job.device)
+                if job.started is None and queue and job in queue:
+                    queue.remove(job)
+                    self._finish(job, 'stopped')
+                self._cond.notify_all()
+        return job
+
+    def wait(self, timeout=None):
+        """Attend la fin de tous les jobs (utilisé par la ligne de commande)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.active():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.2)
+        return True
@@ -1,17 +1,67 @@
 import os
+import errno
+import json
 import sqlite3
 import hashlib
+import mmap
 import argparse
 import shutil
 import time
+import queue
+import threading
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
 
+import metrics
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    from send2trash import send2trash
+except ImportError:
+    send2trash = None
+
 # Configuration par défaut
 DB_NAME = "media_index.db"
 DEFAULT_MIN_SIZE = 10 * 1024  # 10 KB (pour ignorer les très petits fichiers/miniatures)
 DEFAULT_EXCLUDE_EXT = {'.xmp', '.lrcat', '.lrdata', '.db', '.tmp', '.ini', '.thm', '.ctg'}
-CHUNK_SIZE = 8192
+# Moteur de hachage : tampon réutilisé, adapté au type de disque
+HASH_BUFFER_SIZE = 1024 * 1024  # SSD / NVMe
+HASH_BUFFER_SIZE_ROTATIONAL = 4 * 1024 * 1024  # Disque rotatif : moins de déplacements de tête
+ABORT_CHECK_BYTES = 64 * 1024 * 1024  # Vérifier la demande d'arrêt tous les 64 MB lus
+PARTIAL_BLOCK_SIZE = 64 * 1024  # Taille des blocs début/fin pour l'empreinte partielle (mode staged)
+PROGRESS_INTERVAL = 0.25  # Secondes minimum entre deux rapports de progression
+STAT_SAMPLE_EVERY = 16  # Un stat chronométré sur 16 pendant le parcours (métriques)
+# Moteur de copie
+COPY_CHUNK_SIZE = 8 * 1024 * 1024  # Bloc lu, haché puis copié par le noyau
+COPY_WORKERS = 4  # Copies simultanées par disque de destination (1 sur disque rotatif)
+MOVE_JOURNAL_NAME = "move_journal.jsonl"  # À côté de la base
+MOVE_SYNC_EVERY = 256  # Sources supprimées par lot, après un fsync du journal
+TRASH_BATCH_SIZE = 200  # Fichiers envoyés ensemble à la corbeille
+READ_POOL_SIZE = 4  # Connexions de lecture partagées par le serveur
+ORPHAN_CACHE_MAX = 16  # Recherches d'orphelins (maître, cible, filtres) gardées en base
+ORPHAN_DELTA_MAX = 50000  # Changements au-delà desquels le cache est recalculé d'un bloc
+RESOLVE_SIZES_MAX = 50000  # Tailles suivies par scan ; au-delà, passe de collisions sur toute la table
+ORPHAN_LOCK_TIMEOUT = 0.1  # Attente max. du verrou d'écriture pour rafraîchir le cache (consultation)
+DB_TIMEOUT = 60.0  # Attente max. d'un verrou SQLite (secondes)
+
+# Dossiers et fichiers système/bruit écartés pendant le parcours (skip_system)
+SKIP_DIR_NAMES = {'$RECYCLE.BIN', 'System Volume Information', '@eaDir', 'lost+found', '.Trash', '.Trashes',
+                  '.thumbnails', '.Spotlight-V100', '.fseventsd', '.TemporaryItems', '.DocumentRevisions-V100'}
+SKIP_DIR_SUFFIXES = ('.lrdata',)
+SKIP_FILE_NAMES = {'Thumbs.db', '.DS_Store', 'desktop.ini'}
+
+# Bruit technique toujours écarté des orphelins (sous-chaîne du chemin).
+# Le drapeau files.is_ignored est calculé une fois à l'indexation.
+IGNORED_PATTERNS = ['.lrdata', '.lrprev', '.thumb', 'Thumbs.db', '.DS_Store', '_data', '.au']
 
 # Catégories de fichiers
 FILE_CATEGORIES = {
@@ -21,28 +71,421 @@ FILE_CATEGORIES = {
     'document': {'.pdf', '.doc', '.docx', '.txt', '.xls', '.xlsx', '.ppt', '.pptx', '.odt', '.ods', '.odp', '.rtf', '.csv'}
 }
 
-def get_file_hash(filepath, abort_callback=None):
-    """Calcule le hash SHA-256 d'un fichier."""
-    hasher = hashlib.sha256()
+# Algorithmes de hash disponibles. Seule l'égalité compte pour les doublons :
+# un hash rapide non cryptographique suffit. sha256 reste celui des anciennes bases.
+HASH_ALGORITHMS = {
+    'sha256': hashlib.sha256,
+    'blake2b': lambda: hashlib.blake2b(digest_size=16),
+}
+if xxhash is not None:
+    HASH_ALGORITHMS['xxh128'] = xxhash.xxh3_128
+LEGACY_HASH_ALGO = 'sha256'
+# Algorithme des nouvelles bases, fixe : les mêmes fichiers ont le même hash
+# d'une machine ou d'une exécution à l'autre (comparaison entre labels)
+DEFAULT_HASH_ALGO = 'blake2b'
+
+def benchmark_hash_algos(sample_size=64 * 1024 * 1024):
+    """Débit (octets/s) de chaque algorithme disponible sur cette machine.
+
+    Aide au choix (``config --bench-hash``) : le réglage de la base n'est
+    jamais changé automatiquement.
+    """
+    sample = bytes(1024 * 1024)
+    rates = {}
+    for algo, factory in HASH_ALGORITHMS.items():
+        h = factory()
+        start = time.perf_counter()
+        for _ in range(sample_size // len(sample)):
+            h.update(sample)
+        rates[algo] = sample_size / max(time.perf_counter() - start, 1e-9)
+    return rates
+
+@lru_cache(maxsize=None)
+def _is_rotational(st_dev):
+    """Vrai si le périphérique est un disque rotatif (d'après /sys, Linux)."""
+    sys_dev = f'/sys/dev/block/{os.major(st_dev)}:{os.minor(st_dev)}'
+    # Pour une partition, l'attribut "queue" est porté par le disque parent
+    for candidate in (os.path.join(sys_dev, 'queue', 'rotational'),
+                      os.path.join(sys_dev, '..', 'queue', 'rotational')):
+        try:
+            with open(candidate) as f:
+                return f.read().strip() == '1'
+        except OSError:
+            continue
+    return False
+
+@lru_cache(maxsize=None)
+def physical_device(st_dev):
+    """Nom du disque physique qui porte ``st_dev`` (ex. ``sdb``), d'après /sys (Linux).
+
+    Les partitions d'un même disque partagent sa bande passante : elles
+    sont ramenées au disque parent, un volume chiffré ou LVM à son unique
+    disque sous-jacent. À défaut (autre OS, réseau, FUSE), ``dev:<st_dev>``.
+    """
+    node = os.path.realpath(f'/sys/dev/block/{os.major(st_dev)}:{os.minor(st_dev)}')
+    if not os.path.isdir(node):
+        return f'dev:{st_dev}'
+    for _ in range(4):
+        try:
+            slaves = os.listdir(os.path.join(node, 'slaves'))
+        except OSError:
+            slaves = []
+        if len(slaves) != 1:
+            break
+        node = os.path.realpath(os.path.join(node, 'slaves', slaves[0]))
+    if os.path.exists(os.path.join(node, 'partition')):
+        node = os.path.dirname(node)
+    return os.path.basename(node)
+
+def _fadvise(fd, advice):
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(fd, 0, 0, advice)
+        except OSError:
+            pass
+
+_thread_buffers = threading.local()
+
+def _hash_buffer(size):
+    """Tampon de lecture réutilisé, un par thread (les workers du HashPool)."""
+    buffers = getattr(_thread_buffers, 'buffers', None)
+    if buffers is None:
+        buffers = _thread_buffers.buffers = {}
+    buf = buffers.get(size)
+    if buf is None:
+        buf = buffers[size] = bytearray(size)
+    return buf
+
+def get_file_hash(filepath, abort_callback=None, algo=LEGACY_HASH_ALGO, buffer_size=None, use_mmap=False, drop_cache=True):
+    """Calcule le hash d'un fichier (SHA-256 par défaut, voir HASH_ALGORITHMS).
+
+    Lecture par ``readinto`` dans un tampon préalloué (ou ``mmap`` si
+    ``use_mmap``), sans allouer d'objet bytes par bloc. La taille du tampon
+    dépend du disque si ``buffer_size`` n'est pas fourni. ``posix_fadvise``
+    annonce une lecture séquentielle puis libère le cache (``drop_cache``)
+    pour ne pas évincer les données utiles. L'arrêt est vérifié tous les
+    ABORT_CHECK_BYTES. Renvoie le condensat binaire (``digest``), tel que
+    stocké en base ; ``.hex()`` pour l'afficher.
+    """
+    if abort_callback and abort_callback():
+        return None
+    hasher = HASH_ALGORITHMS[algo]()
+    try:
+        with open(filepath, 'rb', buffering=0) as f:
+            fd = f.fileno()
+            st = os.fstat(fd)
+            if buffer_size is None:
+                buffer_size = HASH_BUFFER_SIZE_ROTATIONAL if _is_rotational(st.st_dev) else HASH_BUFFER_SIZE
+            if hasattr(os, 'POSIX_FADV_SEQUENTIAL'):
+                _fadvise(fd, os.POSIX_FADV_SEQUENTIAL)
+
+            if use_mmap and st.st_size > 0:
+                with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+                    view = memoryview(mm)
+                    try:
+                        for offset in range(0, st.st_size, ABORT_CHECK_BYTES):
+                            if abort_callback and offset and abort_callback():
+                                return None
+                            hasher.update(view[offset:offset + ABORT_CHECK_BYTES])
+                    finally:
+                        view.release()
+            else:
+                buf = _hash_buffer(buffer_size)
+                view = memoryview(buf)
+                since_check = 0
+                while True:
+                    n = f.readinto(buf)
+                    if not n:
+                        break
+                    hasher.update(view[:n])
+                    since_check += n
+                    if since_check >= ABORT_CHECK_BYTES:
+                        since_check = 0
+                        if abort_callback and abort_callback():
+                            return None
+
+            if drop_cache and hasattr(os, 'POSIX_FADV_DONTNEED'):
+                _fadvise(fd, os.POSIX_FADV_DONTNEED)
+        return hasher.digest()
+    except (PermissionError, OSError) as e:
+        print(f"Erreur de lecture {filepath}: {e}")
+        return None
+
+def measured_file_hash(task, abort_callback=None, algo=LEGACY_HASH_ALGO):
+    """``get_file_hash`` d'une tâche (chemin, taille, ScanMetrics) de HashPool,
+    dont la durée et les octets lus vont aux métriques.
+    """
+    filepath, size, meter = task
+    start = time.perf_counter()
+    file_hash = get_file_hash(filepath, abort_callback, algo)
+    if file_hash:
+        meter.hashed(size, time.perf_counter() - start)
+    return file_hash
+
+def get_partial_hash(filepath):
+    """Calcule une empreinte rapide : taille + premier et dernier bloc du fichier.
+
+    Deux fichiers d'empreintes différentes sont forcément différents ; deux
+    empreintes identiques imposent en revanche un hash complet pour conclure.
+    """
+    hasher = hashlib.blake2b(digest_size=16)
     try:
         with open(filepath, 'rb') as f:
-            while chunk := f.read(CHUNK_SIZE):
-                if abort_callback and abort_callback():
-                    return None
-                hasher.update(chunk)
-        return hasher.hexdigest()
+            size = os.fstat(f.fileno()).st_size
+            hasher.update(str(size).encode())
+            hasher.update(f.read(PARTIAL_BLOCK_SIZE))
+            if size > PARTIAL_BLOCK_SIZE:
+                f.seek(max(PARTIAL_BLOCK_SIZE, size - PARTIAL_BLOCK_SIZE))
+                hasher.update(f.read(PARTIAL_BLOCK_SIZE))
+        return hasher.digest()
     except (PermissionError, OSError) as e:
         print(f"Erreur de lecture {filepath}: {e}")
         return None
 
-def init_db():
-    """Initialise la base de données."""
-    conn = sqlite3.connect(DB_NAME, timeout=60.0)  # Timeout augmenté à 60s
-    cursor = conn.cursor()
+# Mécanisme de copie retenu par couple (st_dev source, st_dev destination) :
+# un échec de copy_file_range (autre système de fichiers, noyau ancien...)
+# n'est payé qu'une fois
+_copy_methods = {}
+_OFFLOAD_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF}
+
+def _kernel_copy(method, src_fd, dst_fd, offset, count):
+    done = 0
+    while done < count:
+        if method == 'copy_file_range':
+            n = os.copy_file_range(src_fd, dst_fd, count - done, offset + done, offset + done)
+        else:
+            os.lseek(dst_fd, offset + done, os.SEEK_SET)
+            n = os.sendfile(dst_fd, src_fd, offset + done, count - done)
+        if not n:
+            raise OSError(errno.EIO, "Copie interrompue (fichier source tronqué ?)")
+        done += n
+
+def copy_file_hashed(src, dst_fd, algo=LEGACY_HASH_ALGO, abort_callback=None):
+    """Copie ``src`` dans le descripteur ``dst_fd`` en hachant le flux au passage.
+
+    Chaque bloc est lu une seule fois sur le disque (``readinto`` dans le
+    tampon du thread) et haché ; sa copie est confiée au noyau
+    (``copy_file_range``, à défaut ``sendfile``), qui le reprend dans le
+    cache de pages sans repasser par Python, voire le clone (reflink) sur
+    un même volume btrfs/xfs. Sinon le tampon est écrit tel quel.
+    Renvoie le hash (binaire) des données copiées, None si l'arrêt est demandé.
+    """
+    hasher = HASH_ALGORITHMS[algo]()
+    with open(src, 'rb', buffering=0) as f:
+        src_fd = f.fileno()
+        key = (os.fstat(src_fd).st_dev, os.fstat(dst_fd).st_dev)
+        method = _copy_methods.get(key, 'copy_file_range' if hasattr(os, 'copy_file_range') else 'sendfile')
+        if hasattr(os, 'POSIX_FADV_SEQUENTIAL'):
+            _fadvise(src_fd, os.POSIX_FADV_SEQUENTIAL)
+        buf = _hash_buffer(COPY_CHUNK_SIZE)
+        view = memoryview(buf)
+        offset = 0
+        since_check = 0
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            hasher.update(view[:n])
+            while method != 'write':
+                try:
+                    _kernel_copy(method, src_fd, dst_fd, offset, n)
+                    break
+                except OSError as e:
+                    if e.errno not in _OFFLOAD_ERRNOS:
+                        raise
+                    method = 'sendfile' if method == 'copy_file_range' and hasattr(os, 'sendfile') else 'write'
+                    _copy_methods[key] = method
+            if method == 'write':
+                written = 0
+                while written < n:
+                    written += os.pwrite(dst_fd, view[written:n], offset + written)
+            offset += n
+            since_check += n
+            if since_check >= ABORT_CHECK_BYTES:
+                since_check = 0
+                if abort_callback and abort_callback():
+                    return None
+        if hasattr(os, 'POSIX_FADV_DONTNEED'):
+            _fadvise(src_fd, os.POSIX_FADV_DONTNEED)
+    return hasher.digest()
+
+def _reserve_target(target_file):
+    """Crée (O_EXCL) le premier nom libre parmi ``nom``, ``nom_1``, ``nom_2``...
+
+    La création exclusive garantit que deux copies parallèles de fichiers
+    homonymes ne choisissent jamais le même nom. Renvoie (chemin, descripteur).
+    """
+    candidate = target_file
+    counter = 1
+    while True:
+        try:
+            return candidate, os.open(candidate, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            candidate = target_file.with_name(f"{target_file.stem}_{counter}{target_file.suffix}")
+            counter += 1
+
+def copy_verified(src, target_file, expected_hash=None, algo=LEGACY_HASH_ALGO, abort_callback=None, journal=None):
+    """Copie ``src`` vers ``target_file`` (renommée si le nom est pris) en un seul passage.
+
+    Le hash calculé pendant la copie est comparé au hash indexé de la source
+    (``expected_hash``, calculé avec ``algo``) : plus besoin de relire la
+    destination. Renvoie (statut, chemin final, hash ou message d'erreur),
+    le statut valant 'copied', 'mismatch', 'aborted' ou 'error'. Une copie
+    incomplète ou non conforme est supprimée. Ne lève pas d'exception.
+
+    Avec un ``journal`` (déplacement), la copie est annoncée avant d'écrire,
+    synchronisée sur disque puis journalisée comme terminée.
+    """
+    target = None
+
+    def discard():
+        # Copie incomplète ou non conforme : supprimée, et marquée comme telle
+        # au journal pour que la reprise ne touche plus à ce nom
+        try:
+            os.remove(target)
+        except OSError:
+            pass
+        if journal:
+            journal.record('failed', src, target)
+
+    try:
+        target, fd = _reserve_target(Path(target_file))
+    except Exception as e:
+        return 'error', target_file, str(e)
+    try:
+        if journal:
+            journal.record('start', src, target)
+        try:
+            file_hash = copy_file_hashed(src, fd, algo, abort_callback)
+            if file_hash and journal:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        if file_hash is None:
+            discard()
+            return 'aborted', target, None
+        if expected_hash and file_hash != expected_hash:
+            discard()
+            return 'mismatch', target, f"Hash source {expected_hash.hex()}, copié {file_hash.hex()}"
+        shutil.copystat(src, target)
+        if journal:
+            journal.record('copied', src, target, hash=file_hash.hex(), algo=algo)
+        return 'copied', target, file_hash
+    except Exception as e:
+        discard()
+        return 'error', target, str(e)
+
+def _ensure_columns(cursor, table, columns):
+    """Ajoute les colonnes manquantes à une table existante (migration légère)."""
+    existing = {row[1] for row in cursor.execute(f'PRAGMA table_info({table})')}
+    for name, decl in columns:
+        if name not in existing:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {decl}')
+
+# Table des fichiers : un dossier interné (voir PathIndex), un nom et un label
+# (voir source_id) ; hashs stockés en binaire (32 octets pour sha256 au lieu de 64 en hexa)
+FILES_TABLE_SQL = '''
+    CREATE TABLE {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        dir_id INTEGER NOT NULL,
+        filename TEXT NOT NULL,
+        extension TEXT,
+        size_bytes INTEGER,
+        mtime REAL,
+        hash BLOB,
+        source_id INTEGER NOT NULL,
+        scan_date TEXT,
+        partial_hash BLOB,
+        hash_algo TEXT DEFAULT 'sha256',
+        is_ignored INTEGER NOT NULL DEFAULT 0,
+        inode INTEGER,
+        UNIQUE(dir_id, filename, source_id)
+    )
+'''
+
+# Écriture d'une ligne d'index (scan) : insertion ou mise à jour si le fichier est connu.
+# Valeurs : (dir_id, nom, extension, taille, mtime, hash, algorithme, id du label, date, bruit, inode)
+UPSERT_FILE_SQL = '''
+    INSERT INTO files (dir_id, filename, extension, size_bytes, mtime, hash, hash_algo, source_id, scan_date, is_ignored, inode)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(dir_id, filename, source_id) DO UPDATE SET
+        size_bytes=excluded.size_bytes,
+        mtime=excluded.mtime,
+        hash=excluded.hash,
+        hash_algo=excluded.hash_algo,
+        partial_hash=NULL,
+        scan_date=excluded.scan_date,
+        inode=excluded.inode
+'''
+
+SCHEMA_VERSION = 6
+
+def normalize_extension(ext):
+    """Forme canonique d'une extension : minuscules, avec le point ('' si aucune)."""
+    if not ext:
+        return ''
+    ext = ext.lower()
+    return ext if ext.startswith('.') else '.' + ext
+
+def is_ignored_path(path_str):
+    """Vrai si le chemin contient un motif de bruit technique (IGNORED_PATTERNS)."""
+    return any(pat in path_str for pat in IGNORED_PATTERNS)
+
+def _migrate(cursor, version):
+    """Mises à niveau de schéma, suivies par PRAGMA user_version."""
+    if version < 1:
+        # Extensions normalisées et drapeau "bruit" calculés à l'indexation,
+        # pour filtrer les orphelins directement en SQL
+        cursor.execute("UPDATE files SET extension = '' WHERE extension IS NULL")
+        cursor.execute('''
+            UPDATE files SET extension = lower(CASE WHEN substr(extension, 1, 1) = '.'
+                                               THEN extension ELSE '.' || extension END)
+            WHERE extension != ''
+        ''')
+        ignored_sql = ' OR '.join('instr(path, ?) > 0' for _ in IGNORED_PATTERNS)
+        cursor.execute(f'UPDATE files SET is_ignored = ({ignored_sql})', IGNORED_PATTERNS)
+    if version < 2:
+        # Dossier parent stocké pour résumer les orphelins par dossier en SQL :
+        # rtrim(path, <caractères du chemin sauf séparateurs>) coupe le nom de fichier
+        cursor.execute('''
+            UPDATE files SET parent_dir = rtrim(rtrim(path, replace(path, :sep, '')), :sep)
+            WHERE parent_dir IS NULL
+        ''', {'sep': os.sep})
+    # Version 3 : hash_groups, recalculée à la version 5 (nouvelles clés)
+    if version < 4:
+        _migrate_to_directories(cursor)
+    if version < 5:
+        _migrate_to_sources(cursor)
+    if version < 6:
+        # Inode des fichiers, pour reprendre leur hash après un déplacement (voir HashReuse) ;
+        # déjà présente si la table vient d'être reconstruite
+        _ensure_columns(cursor, 'files', [('inode', 'INTEGER')])
+
+def _replace_files_table(cursor):
+    """Remplace ``files`` par ``files_new`` (remplie, ids conservés) sans reculer le compteur AUTOINCREMENT."""
+    row = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'files'").fetchone()
+    cursor.execute('DROP VIEW IF EXISTS file_paths')  # Le RENAME échoue sur une vue orpheline ; recréée par init_db
+    cursor.execute('DROP TABLE files')  # Index et triggers partent avec elle, recréés par init_db
+    cursor.execute('ALTER TABLE files_new RENAME TO files')
+    if row:
+        cursor.execute("UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = 'files'", row)
+
+def _migrate_to_directories(cursor):
+    """Remplace le chemin absolu de chaque ligne par (dossier interné, nom).
+
+    Les ids des fichiers sont conservés : empreintes perceptuelles, cache
+    des orphelins et groupes de doublons restent valables. Un dossier d'un
+    disque absent est rattaché au volume de son plus proche parent présent,
+    puis adopté par le disque à son prochain montage (voir PathIndex).
+    """
+    paths = PathIndex(cursor.connection)
+    dirs = [row[0] for row in cursor.execute('SELECT DISTINCT parent_dir FROM files')]
+    cursor.execute('CREATE TEMP TABLE dir_map (parent_dir TEXT PRIMARY KEY, dir_id INTEGER NOT NULL)')
+    cursor.executemany('INSERT INTO dir_map (parent_dir, dir_id) VALUES (?, ?)', ((d, paths.dir_id(d)) for d in dirs))
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS files (
+        CREATE TABLE files_new (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            path TEXT NOT NULL,
+            dir_id INTEGER NOT NULL,
             filename TEXT NOT NULL,
             extension TEXT,
             size_bytes INTEGER,
@@ -50,9 +493,169 @@ def init_db():
             hash TEXT,
             source_label TEXT NOT NULL,
             scan_date TEXT,
-            UNIQUE(path, source_label)
+            partial_hash TEXT,
+            hash_algo TEXT DEFAULT 'sha256',
+            is_ignored INTEGER NOT NULL DEFAULT 0,
+            UNIQUE(dir_id, filename, source_label)
         )
     ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO files_new (id, dir_id, filename, extension, size_bytes, mtime, hash, source_label,
+                                         scan_date, partial_hash, hash_algo, is_ignored)
+        SELECT f.id, m.dir_id, f.filename, f.extension, f.size_bytes, f.mtime, f.hash, f.source_label,
+               f.scan_date, f.partial_hash, f.hash_algo, f.is_ignored
+        FROM files f JOIN dir_map m ON m.parent_dir = f.parent_dir
+        ORDER BY f.id
+    ''')
+    _replace_files_table(cursor)
+    cursor.execute('DROP TABLE dir_map')
+
+def _hex_to_blob(value):
+    try:
+        return bytes.fromhex(value)
+    except (TypeError, ValueError):
+        return None  # Hash illisible : recalculé au prochain scan
+
+def _migrate_to_sources(cursor):
+    """Remplace le label de chaque ligne par l'id de sa source, et les hashs hexadécimaux par leurs octets.
+
+    Les ids des fichiers sont conservés. Les groupes de doublons sont
+    recalculés ; les caches des orphelins, clés et journal en texte, sont
+    simplement vidés (recréés par init_db, remplis à la prochaine recherche).
+    """
+    cursor.connection.create_function('hex_to_blob', 1, _hex_to_blob, deterministic=True)
+    cursor.execute('INSERT OR IGNORE INTO sources (label) SELECT DISTINCT source_label FROM files ORDER BY source_label')
+    cursor.execute(FILES_TABLE_SQL.format(name='files_new'))
+    cursor.execute('''
+        INSERT INTO files_new (id, dir_id, filename, extension, size_bytes, mtime, hash, source_id,
+                               scan_date, partial_hash, hash_algo, is_ignored)
+        SELECT f.id, f.dir_id, f.filename, f.extension, f.size_bytes, f.mtime, hex_to_blob(f.hash), s.id,
+               f.scan_date, hex_to_blob(f.partial_hash), f.hash_algo, f.is_ignored
+        FROM files f JOIN sources s ON s.label = f.source_label
+        ORDER BY f.id
+    ''')
+    _replace_files_table(cursor)
+    for table in ('hash_groups', 'orphan_cache', 'orphan_cache_items', 'file_changes'):
+        cursor.execute(f'DROP TABLE IF EXISTS {table}')
+    _create_hash_groups(cursor)
+    rebuild_hash_groups(cursor)
+
+# Groupes de doublons d'un label, tenus à jour par les triggers de ``files`` :
+# on retire la ligne de son ancien groupe, on l'ajoute au nouveau. Seules les
+# lignes hachées et hors bruit technique comptent.
+_HASH_GROUP_ADD = '''
+    INSERT INTO hash_groups (source_id, hash, hash_algo, file_count, total_size)
+    SELECT NEW.source_id, NEW.hash, NEW.hash_algo, 1, COALESCE(NEW.size_bytes, 0)
+    WHERE NEW.hash IS NOT NULL AND NEW.hash_algo IS NOT NULL AND NEW.is_ignored = 0
+    ON CONFLICT(source_id, hash, hash_algo) DO UPDATE SET
+        file_count = file_count + 1,
+        total_size = total_size + excluded.total_size;
+'''
+_HASH_GROUP_REMOVE = '''
+    UPDATE hash_groups SET file_count = file_count - 1, total_size = total_size - COALESCE(OLD.size_bytes, 0)
+    WHERE source_id = OLD.source_id AND hash = OLD.hash AND hash_algo = OLD.hash_algo AND OLD.is_ignored = 0;
+    DELETE FROM hash_groups
+    WHERE source_id = OLD.source_id AND hash = OLD.hash AND hash_algo = OLD.hash_algo AND file_count <= 0;
+'''
+
+def _create_hash_groups(cursor):
+    # Doublons internes : (label, hash) -> nombre et volume, matérialisé pour
+    # que le rapport ne refasse pas un GROUP BY sur toute la table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS hash_groups (
+            source_id INTEGER NOT NULL,
+            hash BLOB NOT NULL,
+            hash_algo TEXT NOT NULL,
+            file_count INTEGER NOT NULL,
+            total_size INTEGER NOT NULL,
+            PRIMARY KEY (source_id, hash, hash_algo)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_hash_groups_dup ON hash_groups(source_id) WHERE file_count > 1')
+
+def rebuild_hash_groups(cursor):
+    """Recalcule entièrement ``hash_groups`` depuis ``files`` (migration, réparation)."""
+    cursor.execute('DELETE FROM hash_groups')
+    cursor.execute('''
+        INSERT INTO hash_groups (source_id, hash, hash_algo, file_count, total_size)
+        SELECT source_id, hash, hash_algo, COUNT(*), SUM(COALESCE(size_bytes, 0)) FROM files
+        WHERE hash IS NOT NULL AND hash_algo IS NOT NULL AND is_ignored = 0
+        GROUP BY source_id, hash, hash_algo
+    ''')
+
+def connect(readonly=False):
+    """Ouvre une connexion sur une base déjà initialisée (sans DDL).
+
+    ``readonly`` active ``query_only`` : toute écriture, même dans une
+    table temporaire, est refusée. La connexion peut changer de thread
+    (pool du serveur), à condition de n'être utilisée que par un seul à la fois.
+    """
+    conn = sqlite3.connect(DB_NAME, timeout=DB_TIMEOUT, check_same_thread=False)
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA cache_size=-65536')  # 64 MB
+    # Les lignes remplacées par un OR REPLACE passent aussi par les triggers DELETE
+    conn.execute('PRAGMA recursive_triggers=ON')
+    if readonly:
+        conn.execute('PRAGMA query_only=ON')
+    return conn
+
+def init_db():
+    """Initialise la base de données (schéma, migrations) et renvoie une connexion."""
+    conn = connect()
+    cursor = conn.cursor()
+    # WAL (persistant dans le fichier) : les lectures de l'interface ne sont
+    # plus bloquées par le scan en cours
+    cursor.execute('PRAGMA journal_mode=WAL')
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(files)')}
+    fresh = not columns
+    legacy = 'path' in columns
+    if fresh:
+        cursor.execute(FILES_TABLE_SQL.format(name='files'))
+    elif legacy:
+        # Bases créées avant le scan par étapes / les algorithmes de hash au choix
+        # (les lignes existantes sont en sha256) / le filtrage des orphelins en SQL
+        # / le résumé par dossier. Converties ensuite en dossiers internés.
+        _ensure_columns(cursor, 'files', [('partial_hash', 'TEXT'), ('hash_algo', "TEXT DEFAULT 'sha256'"),
+                                          ('is_ignored', 'INTEGER NOT NULL DEFAULT 0'), ('parent_dir', 'TEXT')])
+
+    # Volumes (UUID du système de fichiers -> point de montage actuel) et
+    # dossiers internés, relatifs à leur volume (voir PathIndex)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS volumes (
+            id INTEGER PRIMARY KEY,
+            uuid TEXT NOT NULL UNIQUE,
+            mount_point TEXT NOT NULL,
+            last_seen TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS directories (
+            id INTEGER PRIMARY KEY,
+            volume_id INTEGER NOT NULL,
+            rel_path TEXT NOT NULL,
+            UNIQUE(volume_id, rel_path)
+        )
+    ''')
+    # Labels des sources : les lignes de ``files`` n'en portent que l'id (voir source_id)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sources (
+            id INTEGER PRIMARY KEY,
+            label TEXT NOT NULL UNIQUE
+        )
+    ''')
+
+    # Réglages persistants (algorithme de hash par défaut...)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+    if cursor.execute("SELECT 1 FROM settings WHERE key = 'hash_algo'").fetchone() is None:
+        # Base existante : on garde sha256 pour rester comparable sans rescan
+        has_rows = cursor.execute('SELECT 1 FROM files LIMIT 1').fetchone() is not None
+        cursor.execute("INSERT INTO settings (key, value) VALUES ('hash_algo', ?)",
+                       (LEGACY_HASH_ALGO if has_rows else DEFAULT_HASH_ALGO,))
     
     # Table Historique
     cursor.execute('''
@@ -66,198 +669,1274 @@ def init_db():
         )
     ''')
     
+    # Empreintes perceptuelles (photos) : table annexe, remplie par le scan --perceptual.
+    # Les triggers effacent l'empreinte d'un fichier supprimé ou modifié.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS perceptual_hashes (
+            file_id INTEGER PRIMARY KEY,
+            dhash INTEGER NOT NULL
+        )
+    ''')
+
+    version = cursor.execute('PRAGMA user_version').fetchone()[0]
+    if fresh or version >= 5:
+        _create_hash_groups(cursor)  # Sinon créée par la migration, avec ses nouvelles clés
+    if fresh:
+        cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    elif version < SCHEMA_VERSION:
+        _migrate(cursor, version)
+        cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    # Triggers créés après les migrations : la table ``files`` a pu être
+    # reconstruite, et leurs mises à jour en masse ne passent pas par les
+    # triggers (hash_groups est recalculée d'un bloc)
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_perceptual_delete AFTER DELETE ON files
+        BEGIN
+            DELETE FROM perceptual_hashes WHERE file_id = OLD.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_perceptual_update AFTER UPDATE OF size_bytes, mtime ON files
+        WHEN OLD.size_bytes IS NOT NEW.size_bytes OR OLD.mtime IS NOT NEW.mtime
+        BEGIN
+            DELETE FROM perceptual_hashes WHERE file_id = OLD.id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_groups_insert AFTER INSERT ON files
+        BEGIN {_HASH_GROUP_ADD} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_groups_delete AFTER DELETE ON files
+        BEGIN {_HASH_GROUP_REMOVE} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_groups_update
+        AFTER UPDATE OF hash, hash_algo, source_id, size_bytes, is_ignored ON files
+        BEGIN {_HASH_GROUP_REMOVE} {_HASH_GROUP_ADD} END
+    ''')
+
+    # Cache des orphelins : le résultat de chaque recherche (maître, cible,
+    # filtres) est gardé en base. Les triggers journalisent les lignes
+    # touchées des labels concernés (ancienne et nouvelle valeur) : le cache
+    # n'applique ensuite que ce delta au lieu de refaire l'anti-jointure.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS orphan_cache (
+            id INTEGER PRIMARY KEY,
+            master_id INTEGER NOT NULL,
+            target_id INTEGER NOT NULL,
+            filters TEXT NOT NULL,
+            generation INTEGER NOT NULL,
+            used_at REAL,
+            UNIQUE(master_id, target_id, filters)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS orphan_cache_items (
+            cache_id INTEGER NOT NULL,
+            file_id INTEGER NOT NULL,
+            PRIMARY KEY (cache_id, file_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS file_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            source_id INTEGER NOT NULL,
+            file_id INTEGER NOT NULL,
+            hash BLOB,
+            hash_algo TEXT
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_changes_source ON file_changes(source_id, seq)')
+    watched = 'EXISTS (SELECT 1 FROM orphan_cache WHERE {0}.source_id IN (master_id, target_id))'
+    log = 'INSERT INTO file_changes (source_id, file_id, hash, hash_algo) VALUES ({0}.source_id, {0}.id, {0}.hash, {0}.hash_algo);'
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_changes_insert AFTER INSERT ON files
+        WHEN {watched.format('NEW')}
+        BEGIN {log.format('NEW')} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_changes_delete AFTER DELETE ON files
+        WHEN {watched.format('OLD')}
+        BEGIN {log.format('OLD')} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_changes_update
+        AFTER UPDATE OF hash, hash_algo, source_id, is_ignored, extension ON files
+        WHEN {watched.format('OLD')} OR {watched.format('NEW')}
+        BEGIN {log.format('OLD')} {log.format('NEW')} END
+    ''')
+
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_hash ON files(hash)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_source ON files(source_label)')
+    # Anti-jointure des orphelins : (label, hash) couvre aussi les recherches par label seul
+    cursor.execute('DROP INDEX IF EXISTS idx_source')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_label_hash ON files(source_id, hash, hash_algo)')
+    # (taille, date) : collisions de taille et reprise des hashs (HashReuse)
+    cursor.execute('DROP INDEX IF EXISTS idx_size')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_size_mtime ON files(size_bytes, mtime)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_label_dir ON files(source_id, dir_id)')
+
+    # Chemin absolu et dossier parent recomposés pour les lectures
+    cursor.execute(f'''
+        CREATE VIEW IF NOT EXISTS file_paths AS
+        SELECT f.*, v.mount_point || d.rel_path || '{os.sep}' || f.filename AS path,
+               COALESCE(NULLIF(v.mount_point || d.rel_path, ''), '{os.sep}') AS parent_dir
+        FROM files f JOIN directories d ON d.id = f.dir_id JOIN volumes v ON v.id = d.volume_id
+    ''')
     conn.commit()
+    if not fresh and version < 5:
+        conn.execute('VACUUM')  # Rend au disque la place des chemins, labels et hashs en texte
     return conn
 
-def scan_directory(conn, path, label, min_size, exclude_ext, update_mode, progress_callback=None, abort_callback=None, include_ext=None):
-    """Scanne un répertoire et indexe les fichiers."""
-    cursor = conn.cursor()
+class ConnectionPool:
+    """Connexions partagées par les requêtes du serveur.
+
+    Le schéma est initialisé (migrations comprises) une seule fois, à la
+    création du pool. Les lectures empruntent une des ``readers`` connexions
+    en lecture seule, ouvertes à la demande puis réutilisées : en WAL elles
+    avancent en parallèle, y compris pendant une écriture. Les écritures
+    courtes passent par une connexion unique, protégée par un verrou.
+    """
+
+    def __init__(self, readers=READ_POOL_SIZE):
+        init_db().close()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(readers)
+        self._opened = []
+        self._writer = connect()
+        self._write_lock = threading.Lock()
+
+    @contextmanager
+    def reader(self):
+        with self._slots:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = connect(readonly=True)
+                self._opened.append(conn)
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                self._idle.put(conn)
+
+    @contextmanager
+    def writer(self, timeout=-1):
+        """Connexion d'écriture : validée en sortie, annulée sur exception.
+
+        Avec ``timeout`` (secondes), None si elle est encore occupée après ce délai.
+        """
+        if not self._write_lock.acquire(timeout=timeout):
+            yield None
+            return
+        try:
+            yield self._writer
+        except BaseException:
+            self._writer.rollback()
+            raise
+        else:
+            self._writer.commit()
+        finally:
+            self._write_lock.release()
+
+    def close(self):
+        with self._write_lock:
+            self._writer.close()
+        for conn in self._opened:
+            conn.close()
+
+def _subtree_bounds(prefix):
+    # Intervalle [prefix + '/', prefix + '0') : tout le sous-arbre, via un index sur le chemin
+    return prefix + os.sep, prefix + chr(ord(os.sep) + 1)
+
+def _volume_uuid(mount_point):
+    """UUID du système de fichiers monté sur ``mount_point`` (celui de lsblk et
+    de /api/drives), d'après /dev/disk/by-uuid (Linux) ; None à défaut."""
+    by_uuid = '/dev/disk/by-uuid'
+    try:
+        st_dev = os.stat(mount_point).st_dev
+        for name in os.listdir(by_uuid):
+            if os.stat(os.path.join(by_uuid, name)).st_rdev == st_dev:
+                return name
+    except OSError:
+        pass
+    return None
+
+class PathIndex:
+    """Correspondance chemin absolu <-> (dossier interné, nom) de la table ``files``.
+
+    Une ligne de ``files`` ne garde que l'id de son dossier et son nom. Le
+    dossier est stocké une fois, relativement au point de montage de son
+    volume, lui-même identifié par l'UUID du système de fichiers : un disque
+    remonté ailleurs garde son index, seul ``volumes.mount_point`` change.
+    Un volume vu pour la première fois adopte les dossiers déjà indexés sous
+    son point de montage (base migrée alors que le disque était absent).
+
+    ``dir_id`` et ``key`` enregistrent volume et dossier (connexion
+    d'écriture). ``lookup_dir``, ``find`` et ``subtree`` se contentent des
+    dossiers connus, d'après les chemins seuls : ils conviennent aux
+    connexions en lecture seule. Les caches vivent avec l'instance (un scan,
+    un lot, une requête).
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._dir_ids = {}      # dossier -> id (enregistré)
+        self._found = {}        # dossier -> id (lu)
+        self._dir_volumes = {}  # dossier -> (id du volume, point de montage)
+        self._volumes = None
+
+    def _known_volumes(self):
+        # Montage le plus long d'abord ; à montage égal, le volume vu le plus récemment
+        if self._volumes is None:
+            self._volumes = self.conn.execute(
+                'SELECT id, mount_point FROM volumes ORDER BY length(mount_point) DESC, last_seen DESC').fetchall()
+        return self._volumes
+
+    def _containing(self, dirpath):
+        return [(volume_id, mount) for volume_id, mount in self._known_volumes()
+                if dirpath == mount or dirpath.startswith(mount + os.sep)]
+
+    def _register(self, mount_path):
+        mount = mount_path.rstrip(os.sep)
+        uuid = _volume_uuid(mount_path) or f'mount:{mount_path}'
+        now = datetime.now().isoformat()
+        created = self.conn.execute('INSERT OR IGNORE INTO volumes (uuid, mount_point, last_seen) VALUES (?, ?, ?)',
+                                    (uuid, mount, now)).rowcount
+        volume_id = self.conn.execute('SELECT id FROM volumes WHERE uuid = ?', (uuid,)).fetchone()[0]
+        if created:
+            for other_id, other_mount in self._containing(mount):
+                if len(other_mount) >= len(mount):
+                    continue
+                rel = mount[len(other_mount):]
+                lower, upper = _subtree_bounds(rel)
+                self.conn.execute('''
+                    UPDATE OR IGNORE directories SET volume_id = ?, rel_path = substr(rel_path, ?)
+                    WHERE volume_id = ? AND (rel_path = ? OR (rel_path >= ? AND rel_path < ?))
+                ''', (volume_id, len(rel) + 1, other_id, rel, lower, upper))
+        else:
+            self.conn.execute('UPDATE volumes SET mount_point = ?, last_seen = ? WHERE id = ?', (mount, now, volume_id))
+        self._volumes = None
+        self._found.clear()
+        return volume_id, mount
+
+    def _volume(self, dirpath):
+        # Remonte jusqu'à un dossier déjà situé ou à un point de montage
+        # (un dossier disparu prend le volume de son parent présent)
+        chain = []
+        path = dirpath or os.sep
+        volume = self._dir_volumes.get(path)
+        while volume is None:
+            parent = os.path.dirname(path)
+            if parent == path or os.path.ismount(path):
+                volume = self._register(path)
+                break
+            chain.append(path)
+            path = parent
+            volume = self._dir_volumes.get(path)
+        for p in chain + [path]:
+            self._dir_volumes[p] = volume
+        return volume
+
+    def dir_id(self, dirpath):
+        """Id du dossier, enregistré (avec son volume) s'il est nouveau."""
+        dirpath = str(dirpath).rstrip(os.sep)
+        dir_id = self._dir_ids.get(dirpath)
+        if dir_id is None:
+            volume_id, mount = self._volume(dirpath)
+            rel = dirpath[len(mount):]
+            self.conn.execute('INSERT OR IGNORE INTO directories (volume_id, rel_path) VALUES (?, ?)', (volume_id, rel))
+            dir_id = self.conn.execute('SELECT id FROM directories WHERE volume_id = ? AND rel_path = ?',
+                                       (volume_id, rel)).fetchone()[0]
+            self._dir_ids[dirpath] = dir_id
+        return dir_id
+
+    def volume_id(self, dirpath):
+        """Id du volume qui porte ``dirpath``, enregistré s'il est nouveau."""
+        return self._volume(str(dirpath).rstrip(os.sep))[0]
+
+    def key(self, path):
+        """(id du dossier, nom) d'un chemin, dossier enregistré au besoin."""
+        dirpath, name = os.path.split(str(path))
+        return self.dir_id(dirpath), name
+
+    def lookup_dirs(self, dirpaths):
+        """{dossier: id} des dossiers déjà connus parmi ``dirpaths`` (aucune écriture).
+
+        Une requête par volume candidat, quel que soit le nombre de dossiers.
+        """
+        found = {}
+        pending = {}
+        for dirpath in dirpaths:
+            key = str(dirpath).rstrip(os.sep)
+            dir_id = self._dir_ids.get(key) or self._found.get(key)
+            if dir_id is None:
+                pending.setdefault(key, []).append(dirpath)
+            else:
+                found[dirpath] = dir_id
+        for volume_id, mount in self._known_volumes():
+            if not pending:
+                break
+            rels = {key[len(mount):]: key for key in pending if key == mount or key.startswith(mount + os.sep)}
+            if not rels:
+                continue
+            # CROSS JOIN : SQLite garde la liste en boucle externe (sondage de l'index unique)
+            rows = self.conn.execute('''
+                SELECT d.id, d.rel_path FROM json_each(?) k
+                CROSS JOIN directories d ON d.volume_id = ? AND d.rel_path = k.value
+            ''', (json.dumps(list(rels)), volume_id))
+            for dir_id, rel_path in rows:
+                key = rels[rel_path]
+                self._found[key] = dir_id
+                for dirpath in pending.pop(key):
+                    found[dirpath] = dir_id
+        return found
+
+    def lookup_dir(self, dirpath):
+        """Id d'un dossier déjà connu, sinon None (aucune écriture)."""
+        return self.lookup_dirs([dirpath]).get(dirpath)
+
+    def find_all(self, paths):
+        """{chemin: (id du dossier, nom)} des chemins dont le dossier est indexé."""
+        split = {path: os.path.split(str(path)) for path in paths}
+        dir_ids = self.lookup_dirs({dirpath for dirpath, _ in split.values()})
+        return {path: (dir_ids[dirpath], name) for path, (dirpath, name) in split.items() if dirpath in dir_ids}
+
+    def find(self, path):
+        """(id du dossier, nom) d'un chemin, ou None si son dossier n'est pas indexé."""
+        return self.find_all([path]).get(path)
+
+    def subtree(self, top):
+        """Dossiers connus sous ``top`` (compris) : [(id, chemin absolu)]."""
+        top = str(top).rstrip(os.sep)
+        found = {}
+        for volume_id, mount in self._known_volumes():
+            if top == mount or top.startswith(mount + os.sep):
+                rel = top[len(mount):]
+                lower, upper = _subtree_bounds(rel)
+                rows = self.conn.execute('''
+                    SELECT id, rel_path FROM directories
+                    WHERE volume_id = ? AND (rel_path = ? OR (rel_path >= ? AND rel_path < ?))
+                ''', (volume_id, rel, lower, upper))
+            elif mount.startswith(top + os.sep):
+                rows = self.conn.execute('SELECT id, rel_path FROM directories WHERE volume_id = ?', (volume_id,))
+            else:
+                continue
+            for dir_id, rel_path in rows:
+                found.setdefault(mount + rel_path, dir_id)
+        return [(dir_id, path) for path, dir_id in found.items()]
+
+def source_id(conn, label, create=False):
+    """Id du label dans ``sources`` : les lignes de ``files`` ne portent que cet entier.
+
+    Un label inconnu est enregistré avec ``create`` (écritures), sinon
+    renvoie None, qui ne correspond à aucune ligne.
+    """
+    if create:
+        conn.execute('INSERT OR IGNORE INTO sources (label) VALUES (?)', (label,))
+    row = conn.execute('SELECT id FROM sources WHERE label = ?', (label,)).fetchone()
+    return row[0] if row else None
+
+def source_labels(conn):
+    """Labels qui ont au moins un fichier indexé, triés."""
+    return [row[0] for row in conn.execute(
+        'SELECT label FROM sources s WHERE EXISTS (SELECT 1 FROM files f WHERE f.source_id = s.id) ORDER BY label')]
+
+def get_hash_algo(conn):
+    """Algorithme de hash par défaut de la base."""
+    row = conn.execute("SELECT value FROM settings WHERE key = 'hash_algo'").fetchone()
+    if row and row[0] in HASH_ALGORITHMS:
+        return row[0]
+    return DEFAULT_HASH_ALGO
+
+def set_hash_algo(conn, algo):
+    """Change l'algorithme par défaut. Les lignes existantes sont re-hachées
+    à la demande, quand elles croisent un fichier de même taille (voir
+    ``resolve_collisions``)."""
+    if algo not in HASH_ALGORITHMS:
+        raise ValueError(f"Algorithme inconnu : {algo} (disponibles : {', '.join(HASH_ALGORITHMS)})")
+    conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('hash_algo', ?)", (algo,))
+    conn.commit()
+
+def _device_concurrency(st_dev, workers, device_workers=None):
+    """Nombre de lectures simultanées autorisées sur un périphérique.
+
+    Un réglage explicite dans ``device_workers`` ({st_dev: n}) est prioritaire.
+    Sinon un disque rotatif (d'après /sys) est limité à 1 lecteur pour éviter
+    les allers-retours de tête, les SSD/NVMe reçoivent ``workers`` lecteurs.
+    """
+    if device_workers and st_dev in device_workers:
+        return max(1, device_workers[st_dev])
+    if workers <= 1 or _is_rotational(st_dev):
+        return 1
+    return workers
+
+class ProgressThrottle:
+    """Cadence les rapports de progression (affichage et callback) dans le temps.
+
+    Un rapport tous les N fichiers est trop bavard sur les petits fichiers et
+    figé sur les gros ; ``due()`` ne laisse passer qu'un rapport par intervalle.
+    """
+
+    def __init__(self, interval=PROGRESS_INTERVAL):
+        self.interval = interval
+        self._last = 0.0
+
+    def due(self, force=False):
+        now = time.monotonic()
+        if force or now - self._last >= self.interval:
+            self._last = now
+            return True
+        return False
+
+class IndexWriter:
+    """Écrivain unique de l'index : accumule les lignes et les écrit par lots.
+
+    Un lot est écrit (``executemany`` + commit) dès qu'il atteint
+    ``batch_size`` lignes ou que ``max_delay`` secondes se sont écoulées
+    depuis la dernière écriture, ce qui laisse la main aux lecteurs.
+    ``on_flush(lignes, secondes)`` reçoit la durée de chaque lot (métriques).
+
+    Le verrou d'écriture de SQLite n'est tenu que le temps d'un lot : les
+    suppressions passent par ``queue`` et partent avec le lot suivant, et
+    ``release`` valide aussitôt une écriture faite hors lot (dossier ou
+    volume enregistré par PathIndex), jamais gardée pendant un hachage.
+    """
+
+    def __init__(self, conn, sql=UPSERT_FILE_SQL, batch_size=500, max_delay=1.0, on_flush=None):
+        self.conn = conn
+        self.sql = sql
+        self.on_flush = on_flush
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.written = 0
+        self._rows = []
+        self._queued = []
+        self._last_flush = time.monotonic()
+
+    def add(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size or time.monotonic() - self._last_flush >= self.max_delay:
+            self.flush()
+
+    def queue(self, sql, rows):
+        """Écriture annexe (``executemany``), exécutée dans la transaction du prochain lot."""
+        self._queued.append((sql, rows))
+
+    def release(self):
+        """Valide une écriture faite hors lot sur la connexion, s'il y en a une en cours."""
+        if self.conn.in_transaction:
+            self.conn.commit()
+
+    def flush(self):
+        rows = len(self._rows)
+        start = time.perf_counter()
+        for sql, params in self._queued:
+            self.conn.executemany(sql, params)
+        self._queued = []
+        if self._rows:
+            self.conn.executemany(self.sql, self._rows)
+            self.written += rows
+            self._rows = []
+        self.conn.commit()
+        if self.on_flush:
+            self.on_flush(rows, time.perf_counter() - start)
+        self._last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+def _suffix(name):
+    """Extension en minuscules, même règle que ``Path.suffix``, sans objet Path."""
+    i = name.rfind('.')
+    if 0 < i < len(name) - 1:
+        return name[i:].lower()
+    return ''
+
+def is_system_dir(name):
+    """Dossier système (SKIP_DIR_NAMES, SKIP_DIR_SUFFIXES), écarté du parcours avec ``skip_system``.
+
+    Les autres dossiers cachés (``.photos``...) restent parcourus.
+    """
+    return name in SKIP_DIR_NAMES or name.endswith(SKIP_DIR_SUFFIXES)
+
+def walk_files(root, exclude_ext, include_ext=None, skip_system=True, onerror=None, stat_timer=None):
+    """Parcourt ``root`` en profondeur avec ``os.scandir``.
+
+    Renvoie des tuples (chemin, dossier, nom, extension, stat). Le filtre
+    d'extension s'applique au nom brut, avant tout stat ; le stat est celui
+    du ``DirEntry`` (mis en cache, gratuit sous Windows). Avec
+    ``skip_system``, les dossiers système (voir ``is_system_dir``) ne sont pas descendus.
+    ``stat_timer`` (histogramme) reçoit la durée d'un stat sur STAT_SAMPLE_EVERY.
+    """
+    stack = [str(root)]
+    sample = 0
+    while stack:
+        dirpath = stack.pop()
+        subdirs = []
+        try:
+            with os.scandir(dirpath) as it:
+                for entry in it:
+                    name = entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if skip_system and is_system_dir(name):
+                                continue
+                            subdirs.append(entry.path)
+                            continue
+                        if not entry.is_file():
+                            continue
+                    except OSError as e:
+                        if onerror:
+                            onerror(entry.path, e)
+                        continue
+
+                    if skip_system and name in SKIP_FILE_NAMES:
+                        continue
+                    ext = _suffix(name)
+                    if ext in exclude_ext:
+                        continue
+                    if include_ext is not None and ext not in include_ext:
+                        continue
+
+                    try:
+                        sample -= 1
+                        if stat_timer is None or sample > 0:
+                            st = entry.stat()
+                        else:
+                            sample = STAT_SAMPLE_EVERY
+                            start = time.perf_counter()
+                            st = entry.stat()
+                            stat_timer.observe(time.perf_counter() - start)
+                    except OSError as e:
+                        if onerror:
+                            onerror(entry.path, e)
+                        continue
+                    yield entry.path, dirpath, name, ext, st
+        except OSError as e:
+            if onerror:
+                onerror(dirpath, e)
+            continue
+        # Ordre inverse pour dépiler les sous-dossiers dans l'ordre de lecture ;
+        # les fichiers d'un dossier sortent d'affilée (fenêtre de ChangeDetector)
+        stack.extend(reversed(subdirs))
+
+class ChangeDetector:
+    """Reconnaît en mémoire les fichiers déjà indexés et inchangés (mode update).
+
+    Au lieu d'une requête par fichier, l'index du label est chargé une fois
+    par dossier parcouru (``walk_files`` livre les fichiers d'un dossier
+    d'affilée), par une requête sur idx_label_dir (label, dossier). Seule la
+    fenêtre du dossier courant reste en mémoire, quelle que soit la forme de
+    l'arborescence : un tableau trié d'empreintes 64 bits de (nom, taille,
+    mtime), soit ~8 octets par fichier.
+    """
+
+    def __init__(self, conn, label, paths=None):
+        self.conn = conn
+        self.source = source_id(conn, label)
+        self.paths = paths or PathIndex(conn)
+        self._window = None
+        self._keys = array('q')
+
+    @staticmethod
+    def _key(name, size, mtime):
+        return hash((name, size, mtime))
+
+    def _load(self, dirpath):
+        dir_id = self.paths.lookup_dir(dirpath)
+        keys = []
+        if dir_id is not None:
+            keys = [self._key(name, size, mtime) for name, size, mtime in self.conn.execute(
+                'SELECT filename, size_bytes, mtime FROM files WHERE source_id = ? AND dir_id = ?', (self.source, dir_id))]
+        self._keys = array('q', sorted(keys))
+        self._window = dirpath
+
+    def is_unchanged(self, dirpath, name, size, mtime):
+        """Vrai si (dossier, nom, taille, mtime) est déjà dans l'index du label."""
+        dirpath = str(dirpath)
+        if dirpath != self._window:
+            self._load(dirpath)
+        keys = self._keys
+        if not keys:
+            return False
+        key = self._key(name, size, mtime)
+        i = bisect_left(keys, key)
+        return i < len(keys) and keys[i] == key
+
+class HashReuse:
+    """Reprend le hash déjà indexé d'un fichier déplacé, renommé ou indexé sous un autre label.
+
+    Identité : (volume, inode, taille, mtime), le volume (UUID, voir
+    PathIndex) remplaçant st_dev qui change d'un montage à l'autre. À
+    défaut, (nom, taille, mtime) sur le même volume, seulement si le fichier
+    de la ligne a disparu (déplacé par copie) ou s'il est ce même fichier
+    (ligne indexée avant l'inode). Une modification change taille ou date :
+    une ligne périmée ne correspond plus, et une copie encore présente
+    ailleurs n'est jamais reprise sans relecture. Une requête sur
+    idx_size_mtime par fichier à hacher, sûre pour tout scan.
+
+    La ligne du chemin scanné lui-même (ce label ou un autre) n'est reprise
+    qu'avec ``same_path`` (mode update) : un scan simple relit ce qu'il
+    trouve à sa place, seuls les fichiers venus d'ailleurs sont repris.
+
+    Les lignes reprises du label ``source`` dont le fichier a disparu sont
+    celles de l'ancien chemin : leur suppression part avec le prochain lot
+    de ``writer`` (même transaction que la nouvelle ligne), sans laisser de
+    faux doublon ni d'orphelin périmé.
+    """
+
+    def __init__(self, conn, writer, algo, source=None, same_path=False):
+        self.conn = conn
+        self.writer = writer
+        self.algo = algo
+        self.source = source
+        self.same_path = same_path
+        self.files = 0
+        self.bytes = 0  # Octets non relus
+        self.removed = 0  # Lignes d'anciens chemins supprimées
+
+    def lookup(self, volume_id, path, st):
+        """(hash, inchangé) : hash indexé réutilisable pour le fichier ``path`` (stat ``st``), sinon None.
+
+        ``inchangé`` est vrai quand le hash vient d'une ligne de ce même
+        chemin : le fichier n'a pas bougé, il n'est pas compté comme repris.
+        """
+        rows = self.conn.execute(f'''
+            SELECT f.id, f.source_id, f.hash, f.inode, v.mount_point || d.rel_path || '{os.sep}' || f.filename
+            FROM files f JOIN directories d ON d.id = f.dir_id JOIN volumes v ON v.id = d.volume_id
+            WHERE f.size_bytes = ? AND f.mtime = ? AND f.hash_algo = ? AND f.hash IS NOT NULL
+            AND d.volume_id = ? AND (f.inode = ? OR f.filename = ?)
+        ''', (st.st_size, st.st_mtime, self.algo, volume_id, st.st_ino, os.path.basename(path))).fetchall()
+        # Identité d'abord
+        rows.sort(key=lambda row: row[3] != st.st_ino)
+        found = None
+        unchanged = False
+        stale = []
+        for row_id, source, file_hash, inode, row_path in rows:
+            if row_path == path:
+                if self.same_path:
+                    found, unchanged = file_hash, True  # Préférée : le fichier n'a pas bougé
+                continue
+            try:
+                other = os.stat(row_path)
+            except FileNotFoundError:
+                if source == self.source:
+                    stale.append((row_id,))  # Ancien chemin de ce fichier
+            except OSError:
+                continue
+            else:
+                if inode != st.st_ino and (other.st_dev, other.st_ino) != (st.st_dev, st.st_ino):
+                    continue  # Autre fichier (copie) : contenu non prouvé
+            if found is None:
+                found = file_hash
+        if stale:
+            self.writer.queue('DELETE FROM files WHERE id = ?', stale)
+            self.removed += len(stale)
+        if found is not None and not unchanged:
+            self.files += 1
+            self.bytes += st.st_size
+        return found, unchanged
+
+class HashPool:
+    """Pool de threads de hachage alimenté par une file bornée.
+
+    hashlib relâche le GIL sur les gros blocs, les lectures peuvent donc
+    avancer en parallèle. Le thread appelant garde la main sur la base et les
+    callbacks : il soumet les fichiers avec ``submit`` puis récupère les
+    résultats avec ``results``. La concurrence est plafonnée par st_dev.
+    ``hash_func`` reçoit la tâche soumise : un chemin, ou un tuple dont le
+    chemin est le premier élément.
+    """
+
+    def __init__(self, hash_func, workers=1, device_workers=None, max_pending=None):
+        self.hash_func = hash_func
+        self.workers = max(1, workers)
+        self.device_workers = device_workers
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='hash')
+        self._slots = threading.BoundedSemaphore(max_pending or self.workers * 4)
+        self._results = queue.Queue()
+        self._device_locks = {}
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._returned = 0
+
+    def _device_semaphore(self, st_dev):
+        with self._lock:
+            sem = self._device_locks.get(st_dev)
+            if sem is None:
+                limit = _device_concurrency(st_dev, self.workers, self.device_workers)
+                sem = self._device_locks[st_dev] = threading.Semaphore(limit)
+            return sem
+
+    def _run(self, task, st_dev, payload):
+        try:
+            with self._device_semaphore(st_dev):
+                result = self.hash_func(task)
+        except Exception as e:
+            print(f"\nErreur hachage {task[0] if isinstance(task, tuple) else task}: {e}")
+            result = None
+        finally:
+            self._slots.release()
+        self._results.put((payload, result))
+
+    def submit(self, task, st_dev, payload):
+        """Ajoute un fichier à hacher ; bloque tant que la file est pleine."""
+        self._slots.acquire()
+        self._submitted += 1
+        self._executor.submit(self._run, task, st_dev, payload)
+
+    def results(self, wait=False):
+        """Renvoie les (payload, hash) terminés ; tous les restants si ``wait``."""
+        while self._returned < self._submitted:
+            try:
+                item = self._results.get(block=wait)
+            except queue.Empty:
+                return
+            self._returned += 1
+            yield item
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def run_copies(tasks, workers=COPY_WORKERS, abort_callback=None, journal=None):
+    """Exécute des copies vérifiées en parallèle, plafonnées par disque de destination.
+
+    ``tasks`` : itérable de (source, fichier cible, hash attendu, algorithme,
+    payload). Génère (payload, (statut, chemin final, hash ou message)) au
+    fur et à mesure, voir ``copy_verified``. Le plafond par disque est celui
+    du HashPool : ``workers`` copies sur SSD, une seule sur disque rotatif.
+    """
+    pool = HashPool(lambda task: copy_verified(*task), workers)
+    devices = {}
+    try:
+        for src, target_file, expected_hash, algo, payload in tasks:
+            if abort_callback and abort_callback():
+                break
+            parent = str(Path(target_file).parent)
+            if parent not in devices:
+                os.makedirs(parent, exist_ok=True)
+                devices[parent] = os.stat(parent).st_dev
+            pool.submit((src, target_file, expected_hash, algo, abort_callback, journal), devices[parent], payload)
+            yield from pool.results()
+        yield from pool.results(wait=True)
+    finally:
+        pool.close()
+
+def scan_directory(conn, path, label, min_size, exclude_ext, update_mode, progress_callback=None, abort_callback=None, include_ext=None, staged=False, workers=1, device_workers=None, skip_system=True, hash_algo=None, perceptual=False, rehash=False):
+    """Scanne un répertoire et indexe les fichiers.
+
+    En mode ``staged``, le parcours n'enregistre que chemin, taille et date ;
+    les hashs ne sont calculés ensuite que pour les tailles en collision
+    (voir ``resolve_collisions``). ``workers`` fixe le nombre de hachages
+    simultanés par périphérique (voir ``HashPool``). ``skip_system`` écarte
+    dès le parcours les dossiers système (voir ``is_system_dir``).
+    ``hash_algo`` remplace pour ce scan l'algorithme par défaut de la base.
+    Un fichier déplacé, renommé ou déjà indexé ailleurs sous un autre label
+    reprend son hash sans relecture, l'ancienne ligne d'un fichier déplacé
+    étant retirée (voir ``HashReuse``) ; la ligne de son propre chemin n'est
+    reprise qu'en mode update. ``rehash`` relit tout (contrôle du contenu).
+    Stat, hachages et écritures alimentent les métriques (label, disque de la racine).
+    """
     root_path = Path(path).resolve()
     
     if not root_path.exists():
         print(f"Erreur: Le chemin {root_path} n'existe pas.")
         return
 
-    print(f"Début du scan de : {root_path} (Label: {label})")
-    count = 0
+    hash_algo = hash_algo or get_hash_algo(conn)
+    print(f"Début du scan de : {root_path} (Label: {label}, hash: {hash_algo})")
     added = 0
     skipped = 0
     errors = 0
+    bytes_indexed = 0
     
     start_time = time.time()
+    throttle = ProgressThrottle()
 
-    for root, dirs, files in os.walk(root_path):
-        # Vérification d'arrêt demandé
-        if abort_callback and abort_callback():
-            print("\n[STOP] Scan interrompu par l'utilisateur.")
-            break
+    def report(file, root, force=False):
+        if not throttle.due(force):
+            return
+        meter.progress(added, skipped, errors, reuse.files, reuse.bytes, time.time() - start_time)
+        print(f"Indexés: {added} | Skippés: {skipped} | En cours: {file[:30]}...", end='\r')
+        if progress_callback:
+            progress_callback({
+                "status": "scanning",
+                "added": added,
+                "skipped": skipped,
+                "errors": errors,
+                "bytes": bytes_indexed,
+                "reused": reuse.files,
+                "bytes_reused": reuse.bytes,
+                "current_file": file,
+                "current_dir": root,
+                "label": label
+            })
+
+    def store(filepath, root, file, ext, size, mtime, inode, file_hash, unchanged=False):
+        nonlocal added, skipped, bytes_indexed
+        # Insertion / Mise à jour (écrite par lots) ; un dossier nouveau est
+        # enregistré et validé aussitôt
+        dir_id = paths.dir_id(root)
+        writer.release()
+        writer.add((
+            dir_id,
+            file, 
+            ext, 
+            size, 
+            mtime, 
+            file_hash, 
+            hash_algo, 
+            source, 
+            datetime.now().isoformat(),
+            is_ignored_path(filepath),
+            inode
+        ))
+        
+        if unchanged:
+            skipped += 1
+        else:
+            added += 1
+            bytes_indexed += size
+        report(file, root)
+
+    def collect(wait=False):
+        nonlocal errors
+        for (filepath, root, file, ext, size, mtime, inode), file_hash in pool.results(wait):
+            if not file_hash:
+                # Si None retourné, soit erreur soit abort
+                if not (abort_callback and abort_callback()):
+                    errors += 1
+                continue
+            store(filepath, root, file, ext, size, mtime, inode, file_hash)
 
-        for file in files:
+    meter = metrics.ScanMetrics(label, physical_device(root_path.stat().st_dev))
+    writer = IndexWriter(conn, on_flush=meter.batch_written)
+    source = source_id(conn, label, create=True)
+    paths = PathIndex(conn)
+    # Volume de la racine enregistré d'emblée : un disque remonté ailleurs
+    # (ou vu pour la première fois) est reconnu avant la comparaison à l'index
+    paths.dir_id(root_path)
+    conn.commit()
+    detector = ChangeDetector(conn, label, paths) if update_mode else None
+    reuse = HashReuse(conn, writer, hash_algo, source, same_path=update_mode)
+    def on_error(filepath, e):
+        nonlocal errors
+        print(f"\nErreur accès {filepath}: {e}")
+        errors += 1
+
+    sizes = set()  # Tailles vues : la passe de collisions s'y limite
+    pool = HashPool(lambda task: measured_file_hash(task, abort_callback, hash_algo), workers, device_workers)
+    try:
+        for filepath, root, file, ext, stat in walk_files(root_path, exclude_ext, include_ext, skip_system, on_error, meter.stat):
+            # Vérification d'arrêt demandé
             if abort_callback and abort_callback():
+                print("\n[STOP] Scan interrompu par l'utilisateur.")
                 break
 
-            filepath = Path(root) / file
-            
-            # Filtres rapides (nom/extension)
-            ext = filepath.suffix.lower()
-            
-            # 1. Exclusion explicite
-            if ext in exclude_ext:
+            size = stat.st_size
+            if size < min_size:
                 continue
-                
-            # 2. Inclusion explicite (si définie)
-            if include_ext is not None and ext not in include_ext:
+            if sizes is not None:
+                sizes.add(size)
+                if len(sizes) > RESOLVE_SIZES_MAX:
+                    sizes = None
+
+            # Vérifier si déjà scanné (mode update), ou ailleurs dans l'index
+            if update_mode and detector.is_unchanged(root, file, size, stat.st_mtime):
+                skipped += 1
+                report(file, root)
                 continue
-            
-            try:
-                stat = filepath.stat()
-                size = stat.st_size
-                
-                if size < min_size:
+            if not rehash:
+                volume_id = paths.volume_id(root)
+                writer.release()
+                file_hash, unchanged = reuse.lookup(volume_id, filepath, stat)
+                if file_hash:
+                    store(filepath, root, file, ext, size, stat.st_mtime, stat.st_ino, file_hash, unchanged)
                     continue
 
-                # Vérifier si déjà scanné (mode update)
-                if update_mode:
-                    cursor.execute('SELECT hash FROM files WHERE path = ? AND source_label = ? AND size_bytes = ? AND mtime = ?', 
-                                   (str(filepath), label, size, stat.st_mtime))
-                    if cursor.fetchone():
-                        skipped += 1
-                        # Update progress for skipped files too (every 50 files)
-                        if skipped % 50 == 0:
-                            print(f"Skipped {skipped} files (already indexed)...", end='\r')
-                            if progress_callback:
-                                progress_callback({
-                                    "status": "scanning",
-                                    "added": added,
-                                    "skipped": skipped,
-                                    "current_file": file,
-                                    "label": label
-                                })
-                        continue
+            # Calcul du hash (opération lourde) : délégué au pool,
+            # différé en mode staged
+            if staged:
+                store(filepath, root, file, ext, size, stat.st_mtime, stat.st_ino, None)
+            else:
+                pool.submit((filepath, size, meter), stat.st_dev, (filepath, root, file, ext, size, stat.st_mtime, stat.st_ino))
+                collect()
 
-                # Calcul du hash (opération lourde)
-                file_hash = get_file_hash(filepath, abort_callback)
-                if not file_hash:
-                    # Si None retourné, soit erreur soit abort
-                    if abort_callback and abort_callback():
-                        break
-                    errors += 1
-                    continue
+        collect(wait=True)
+    finally:
+        pool.close()
+        writer.flush()
+    # Dernier état exact avant les étapes suivantes
+    report('', str(root_path), force=True)
 
-                # Insertion / Mise à jour
-                cursor.execute('''
-                    INSERT INTO files (path, filename, extension, size_bytes, mtime, hash, source_label, scan_date)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    ON CONFLICT(path, source_label) DO UPDATE SET
-                        size_bytes=excluded.size_bytes,
-                        mtime=excluded.mtime,
-                        hash=excluded.hash,
-                        scan_date=excluded.scan_date
-                ''', (
-                    str(filepath), 
-                    file, 
-                    ext, 
-                    size, 
-                    stat.st_mtime, 
-                    file_hash, 
-                    label, 
-                    datetime.now().isoformat()
-                ))
-                
-                added += 1
-                
-                # Update progress frequently (every 5 files or if it's the first few)
-                if added % 5 == 0 or added < 10:
-                    msg = f"Indexés: {added} | Skippés: {skipped} | En cours: {file[:30]}..."
-                    print(msg, end='\r')
-                    # Commit less frequently to save speed
-                    if added % 50 == 0:
-                        conn.commit()
-                        
+    # Hors mode staged, seules les lignes d'un autre algorithme en collision
+    # de taille avec ce scan sont concernées (re-hachage à la demande) ;
+    # seules les tailles vues par ce scan sont examinées
+    if not (abort_callback and abort_callback()):
+        resolve_collisions(conn, label, progress_callback, abort_callback, workers, device_workers, hash_algo, sizes)
+    if perceptual and not (abort_callback and abort_callback()):
+        import perceptual as perceptual_hashing  # Dépend de Pillow
+        perceptual_hashing.compute_perceptual_hashes(conn, label, progress_callback, abort_callback, workers)
+
+    duration = time.time() - start_time
+    print(f"\nScan terminé en {duration:.1f}s.")
+    print(f"Total ajoutés/mis à jour: {added}")
+    print(f"Total ignorés (update): {skipped}")
+    if reuse.files:
+        print(f"Hashs repris (déplacés/renommés): {reuse.files}, {reuse.bytes / 1024 / 1024:.1f} MB non relus")
+    if reuse.removed:
+        print(f"Anciens chemins retirés de l'index: {reuse.removed}")
+    print(f"Erreurs: {errors}")
+
+def resolve_collisions(conn, label=None, progress_callback=None, abort_callback=None, workers=1, device_workers=None, hash_algo=None,
+                       sizes=None):
+    """Calcule les empreintes nécessaires pour départager les fichiers de même taille.
+
+    Étape 1 : empreinte partielle (début/fin) pour toute taille partagée par
+    au moins deux fichiers, tous labels confondus.
+    Étape 2 : hash complet uniquement quand les empreintes partielles
+    collisionnent (ou quand l'autre fichier n'a qu'un hash complet). Les
+    hashs d'un ancien algorithme sont recalculés ici aussi, seulement quand
+    un fichier de même taille utilise l'algorithme courant : la migration
+    d'algorithme se fait ainsi à la demande, sans rescan complet.
+    Les fichiers inaccessibles (disque non monté) restent non résolus et sont
+    donc considérés comme orphelins par prudence.
+    ``sizes`` limite la passe aux tailles vues par un scan (sondages de
+    idx_size_mtime) : un petit rescan ne parcourt pas toute la table.
+    """
+    cursor = conn.cursor()
+    hash_algo = hash_algo or get_hash_algo(conn)
+    meters = {}  # st_dev -> ScanMetrics
+    params = {'algo': hash_algo, 'sizes': json.dumps(sorted(sizes or ()))}
+    # CROSS JOIN : la liste des tailles reste en boucle externe (sondage de idx_size_mtime)
+    rows = 'file_paths f' if sizes is None else 'json_each(:sizes) s CROSS JOIN file_paths f ON f.size_bytes = s.value'
+
+    stages = [
+        ('partial', lambda task: get_partial_hash(task[0]), '''
+            SELECT f.id, f.path FROM {rows}
+            WHERE f.hash IS NULL AND f.partial_hash IS NULL
+            AND EXISTS (
+                SELECT 1 FROM files o WHERE o.size_bytes = f.size_bytes AND o.id != f.id
+            )
+        ''', 'UPDATE files SET partial_hash = ? WHERE id = ?'),
+        ('full', lambda task: measured_file_hash(task, abort_callback, hash_algo), '''
+            SELECT f.id, f.path FROM {rows}
+            WHERE (
+                f.hash IS NULL AND f.partial_hash IS NOT NULL
+                AND EXISTS (
+                    SELECT 1 FROM files o WHERE o.size_bytes = f.size_bytes AND o.id != f.id
+                    AND (o.partial_hash = f.partial_hash OR o.partial_hash IS NULL)
+                )
+            ) OR (
+                f.hash IS NOT NULL AND f.hash_algo != :algo
+                AND EXISTS (
+                    SELECT 1 FROM files o WHERE o.size_bytes = f.size_bytes AND o.id != f.id
+                    AND o.hash_algo = :algo
+                )
+            )
+        ''', 'UPDATE files SET hash = ?, hash_algo = ? WHERE id = ?'),
+    ]
+
+    resolved = {}
+    for stage, hash_func, select_sql, update_sql in stages:
+        cursor.execute(select_sql.format(rows=rows), params)
+        candidates = cursor.fetchall()
+        done = 0
+        if not candidates:
+            continue
+        print(f"\nÉtape '{stage}' : {len(candidates)} fichiers à départager...")
+        throttle = ProgressThrottle()
+
+        def collect(wait=False):
+            nonlocal done
+            for file_id, value in pool.results(wait):
+                if not value:
+                    continue
+                writer.add((value, file_id) if stage == 'partial' else (value, hash_algo, file_id))
+                done += 1
+                if throttle.due():
+                    print(f"Étape '{stage}' : {done}/{len(candidates)}", end='\r')
                     if progress_callback:
                         progress_callback({
                             "status": "scanning",
-                            "added": added,
-                            "skipped": skipped,
-                            "current_file": file,
+                            "stage": stage,
+                            "resolved": done,
+                            "to_resolve": len(candidates),
                             "label": label
                         })
 
-            except (PermissionError, OSError) as e:
-                print(f"\nErreur accès {filepath}: {e}")
-                errors += 1
-        
+        with IndexWriter(conn, update_sql) as writer, HashPool(hash_func, workers, device_workers) as pool:
+            for file_id, path_str in candidates:
+                if abort_callback and abort_callback():
+                    break
+                try:
+                    st = os.stat(path_str)
+                except OSError:
+                    # Disque d'un autre label non monté : reste non résolu
+                    continue
+                meter = meters.get(st.st_dev)
+                if meter is None:
+                    meter = meters[st.st_dev] = metrics.ScanMetrics(label, physical_device(st.st_dev))
+                pool.submit((path_str, st.st_size, meter), st.st_dev, file_id)
+                collect()
+            collect(wait=True)
+
+        resolved[stage] = done
         if abort_callback and abort_callback():
-            break
+            return resolved
 
-    conn.commit()
-    duration = time.time() - start_time
-    print(f"\nScan terminé en {duration:.1f}s.")
-    print(f"Total ajoutés/mis à jour: {added}")
-    print(f"Total ignorés (update): {skipped}")
-    print(f"Erreurs: {errors}")
+    if resolved:
+        print(f"Empreintes partielles: {resolved.get('partial', 0)} | Hashs complets: {resolved.get('full', 0)}")
+    return resolved
 
-def find_orphans(conn, master_label, target_label, list_files=False, export_file=None, include_ext=None, exclude_ext=None):
-    """Trouve les fichiers dans target_label qui ne sont PAS dans master_label (basé sur le hash)."""
-    cursor = conn.cursor()
-    
-    print(f"Recherche d'orphelins : {target_label} vs MASTER ({master_label})...")
-    
-    # On cherche les fichiers de la cible dont le hash n'existe pas dans le maître
-    query = '''
-        SELECT t.path, t.filename, t.size_bytes, t.hash, t.extension
-        FROM files t
-        WHERE t.source_label = ?
-        AND t.hash NOT IN (
-            SELECT m.hash FROM files m WHERE m.source_label = ?
+def _orphan_query(select, master_id, target_id, include_ext=None, exclude_ext=None, where=(), params=(), tail='',
+                  cache_id=None, table='file_paths'):
+    """Construit la requête des orphelins : fichiers de la source ``target_id``
+    sans équivalent (même hash, même algorithme) dans la source ``master_id``.
+
+    Anti-jointure indexée (NOT EXISTS sur idx_label_hash) ; les filtres
+    d'extension et de bruit sont appliqués dans la requête.
+    Un hash NULL (scan staged) signifie taille ou empreinte partielle unique :
+    le fichier est un orphelin prouvé (ou non résolu, donc gardé par prudence).
+
+    Avec ``cache_id`` (voir ``refresh_orphan_cache``), les orphelins sont lus
+    dans le cache, filtres déjà appliqués. ``table`` : ``file_paths`` (chemins
+    recomposés) ou ``files`` quand seuls les ids comptent.
+    """
+    if cache_id is not None:
+        conditions = ['c.cache_id = ?'] + list(where)
+        query = f'''
+            SELECT {select}
+            FROM orphan_cache_items c JOIN {table} t ON t.id = c.file_id
+            WHERE {' AND '.join(conditions)}
+            {tail}
+        '''
+        return query, [cache_id] + list(params)
+
+    conditions = ['t.source_id = ?', 't.is_ignored = 0']
+    values = [target_id]
+
+    # EXCLUDE prioritaire, puis INCLUDE (si défini, on ne garde QUE ce qui est dedans)
+    blocked_exts = sorted({normalize_extension(e) for e in exclude_ext or []})
+    allowed_exts = sorted({normalize_extension(e) for e in include_ext or []})
+    if blocked_exts:
+        conditions.append(f"t.extension NOT IN ({','.join('?' * len(blocked_exts))})")
+        values.extend(blocked_exts)
+    if allowed_exts:
+        conditions.append(f"t.extension IN ({','.join('?' * len(allowed_exts))})")
+        values.extend(allowed_exts)
+    conditions.extend(where)
+    values.extend(params)
+
+    values.append(master_id)
+    query = f'''
+        SELECT {select}
+        FROM {table} t
+        WHERE {' AND '.join(conditions)}
+        AND NOT EXISTS (
+            SELECT 1 FROM files m
+            WHERE m.source_id = ? AND m.hash = t.hash AND m.hash_algo = t.hash_algo
         )
+        {tail}
     '''
+    return query, values
+
+def _near_filter(conn, master_label, target_label, near_distance):
+    """Condition (et paramètre) excluant les photos qui ont une quasi-copie dans master_label.
+
+    Les ids trouvés par l'index de Hamming sont passés en un seul tableau
+    JSON (json_each) : l'anti-jointure reste en SQL sans rien écrire, la
+    requête peut donc tourner sur une connexion en lecture seule.
+    """
+    if near_distance is None:
+        return [], []
+    import perceptual  # Dépend de Pillow
+    matched = perceptual.near_matches(conn, master_label, target_label, near_distance)
+    return ['t.id NOT IN (SELECT value FROM json_each(?))'], [json.dumps(sorted(matched))]
+
+def _orphan_filters_key(include_ext, exclude_ext):
+    return json.dumps([sorted({normalize_extension(e) for e in include_ext or []}),
+                       sorted({normalize_extension(e) for e in exclude_ext or []})])
+
+def _fill_orphan_cache(conn, cache_id, master_id, target_id, include_ext, exclude_ext, where=(), params=()):
+    query, values = _orphan_query(f'{int(cache_id)}, t.id', master_id, target_id,
+                                  include_ext, exclude_ext, where, params, table='files')
+    conn.execute(f'INSERT OR IGNORE INTO orphan_cache_items (cache_id, file_id) {query}', values)
+
+def _change_generation(conn):
+    # sqlite_sequence reste croissant même quand le journal est purgé
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'file_changes'").fetchone()
+    return row[0] if row else 0
+
+def _try_begin_immediate(conn, timeout):
+    # BEGIN IMMEDIATE sans attendre plus de ``timeout`` secondes l'écrivain en cours
+    conn.execute(f'PRAGMA busy_timeout = {int(timeout * 1000)}')
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        return True
+    except sqlite3.OperationalError as e:
+        if 'locked' not in str(e) and 'busy' not in str(e):
+            raise
+        return False
+    finally:
+        conn.execute(f'PRAGMA busy_timeout = {int(DB_TIMEOUT * 1000)}')
+
+def current_orphan_cache(conn, master_label, target_label, include_ext=None, exclude_ext=None):
+    """Id du cache de la recherche s'il est à jour (génération courante), sinon None.
+
+    Lecture seule : convient aux connexions du pool de lecture.
+    """
+    master_id, target_id = source_id(conn, master_label), source_id(conn, target_label)
+    row = conn.execute('SELECT id, generation FROM orphan_cache WHERE master_id = ? AND target_id = ? AND filters = ?',
+                       (master_id, target_id, _orphan_filters_key(include_ext, exclude_ext))).fetchone()
+    return row[0] if row and row[1] == _change_generation(conn) else None
+
+def refresh_orphan_cache(conn, master_label, target_label, include_ext=None, exclude_ext=None, lock_timeout=None):
+    """Met à jour (ou crée) le cache des orphelins de la recherche et renvoie son id.
+
+    Le journal ``file_changes`` sert de compteur de génération par label :
+    scan, copie, déplacement, corbeille et renommage y laissent une entrée
+    par ligne touchée. Un cache à jour ne coûte que deux sondages d'index ;
+    sinon on ne recalcule que les fichiers de la cible touchés depuis la
+    génération du cache, et ceux dont le hash est apparu ou a disparu du
+    maître. Au-delà de ORPHAN_DELTA_MAX changements, le cache est refait
+    d'un bloc. Écrit dans la base : à appeler sur une connexion d'écriture.
+
+    Avec ``lock_timeout`` (secondes), renvoie None au lieu d'attendre un
+    écrivain (scan, copie, suivi) qui garde le verrou au-delà de ce délai.
+    """
+    filters = _orphan_filters_key(include_ext, exclude_ext)
+    start = time.perf_counter()
+    if not conn.in_transaction:
+        # Aucun changement ne s'intercale pendant la mise à jour
+        if lock_timeout is None:
+            conn.execute('BEGIN IMMEDIATE')
+        elif not _try_begin_immediate(conn, lock_timeout):
+            return None
+    try:
+        generation = _change_generation(conn)
+        # Labels enregistrés même sans fichier : les triggers suivent leurs ids dès maintenant
+        master_id, target_id = source_id(conn, master_label, create=True), source_id(conn, target_label, create=True)
+        row = conn.execute('SELECT id, generation FROM orphan_cache WHERE master_id = ? AND target_id = ? AND filters = ?',
+                           (master_id, target_id, filters)).fetchone()
+        if row is None:
+            cache_id = conn.execute('INSERT INTO orphan_cache (master_id, target_id, filters, generation) VALUES (?, ?, ?, ?)',
+                                    (master_id, target_id, filters, generation)).lastrowid
+            _fill_orphan_cache(conn, cache_id, master_id, target_id, include_ext, exclude_ext)
+        else:
+            cache_id, cached_generation = row
+            changed = 'SELECT DISTINCT {} FROM file_changes WHERE source_id = ? AND seq > ?'
+            target_ids = {r[0] for r in conn.execute(changed.format('file_id'), (target_id, cached_generation))}
+            master_hashes = conn.execute(changed.format('hash, hash_algo') + ' AND hash IS NOT NULL',
+                                         (master_id, cached_generation)).fetchall()
+            if len(target_ids) + len(master_hashes) > ORPHAN_DELTA_MAX:
+                conn.execute('DELETE FROM orphan_cache_items WHERE cache_id = ?', (cache_id,))
+                _fill_orphan_cache(conn, cache_id, master_id, target_id, include_ext, exclude_ext)
+            elif target_ids or master_hashes:
+                for file_hash, algo in master_hashes:
+                    target_ids.update(r[0] for r in conn.execute(
+                        'SELECT id FROM files WHERE source_id = ? AND hash = ? AND hash_algo = ?',
+                        (target_id, file_hash, algo)))
+                ids = json.dumps(sorted(target_ids))
+                conn.execute('DELETE FROM orphan_cache_items WHERE cache_id = ? AND file_id IN (SELECT value FROM json_each(?))',
+                             (cache_id, ids))
+                _fill_orphan_cache(conn, cache_id, master_id, target_id, include_ext, exclude_ext,
+                                   ['t.id IN (SELECT value FROM json_each(?))'], [ids])
+        conn.execute('UPDATE orphan_cache SET generation = ?, used_at = ? WHERE id = ?', (generation, time.time(), cache_id))
+        _prune_orphan_caches(conn)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    metrics.ORPHAN_QUERY_SECONDS.labels(target_label, 'refresh').observe(time.perf_counter() - start)
+    return cache_id
+
+def _prune_orphan_caches(conn):
+    """Oublie les recherches les moins récentes et le journal déjà appliqué partout."""
+    conn.execute('DELETE FROM orphan_cache WHERE id NOT IN (SELECT id FROM orphan_cache ORDER BY used_at DESC LIMIT ?)',
+                 (ORPHAN_CACHE_MAX,))
+    conn.execute('DELETE FROM orphan_cache_items WHERE cache_id NOT IN (SELECT id FROM orphan_cache)')
+    conn.execute('DELETE FROM file_changes WHERE seq <= (SELECT MIN(generation) FROM orphan_cache)')
+
+def iter_orphans(conn, master_label, target_label, include_ext=None, exclude_ext=None, near_distance=None, cache_id=None):
+    """Itère sur les orphelins (path, filename, size, hash), lus au fil du curseur.
+
+    Avec ``near_distance``, les photos ayant une quasi-copie dans le maître
+    (empreinte perceptuelle à distance <= near_distance) ne sont pas des orphelins.
+    ``cache_id`` lit le résultat dans le cache (voir ``refresh_orphan_cache``).
+    """
+    where, params = _near_filter(conn, master_label, target_label, near_distance)
+    query, params = _orphan_query('t.path, t.filename, t.size_bytes, t.hash',
+                                  source_id(conn, master_label), source_id(conn, target_label), include_ext, exclude_ext, where, params,
+                                  cache_id=cache_id)
+    yield from conn.execute(query, params)
+
+def orphan_folders(conn, master_label, target_label, include_ext=None, exclude_ext=None, near_distance=None, cache_id=None):
+    """Résumé des orphelins par dossier parent : [(dossier, nombre, octets)], du plus fourni au moins fourni."""
+    where, params = _near_filter(conn, master_label, target_label, near_distance)
+    query, params = _orphan_query('t.parent_dir, COUNT(*), SUM(t.size_bytes)',
+                                  source_id(conn, master_label), source_id(conn, target_label), include_ext, exclude_ext, where, params,
+                                  tail='GROUP BY t.dir_id ORDER BY COUNT(*) DESC, t.parent_dir', cache_id=cache_id)
+    start = time.perf_counter()
+    folders = conn.execute(query, params).fetchall()
+    metrics.ORPHAN_QUERY_SECONDS.labels(target_label, 'folders').observe(time.perf_counter() - start)
+    return folders
+
+# Colonnes de tri autorisées pour la pagination des orphelins d'un dossier
+ORPHAN_SORT_COLUMNS = {'name': 't.filename', 'size': 't.size_bytes'}
+
+def orphan_files_page(conn, master_label, target_label, folder, include_ext=None, exclude_ext=None,
+                      sort='name', descending=False, after=None, limit=200, near_distance=None, cache_id=None):
+    """Une page d'orphelins d'un dossier, paginée par clé (valeur triée, id).
+
+    ``after`` est le curseur renvoyé par la page précédente. Renvoie
+    (lignes (id, path, filename, size, hash), curseur suivant ou None).
+    """
+    column = ORPHAN_SORT_COLUMNS[sort]
+    direction = 'DESC' if descending else 'ASC'
+    near_where, near_params = _near_filter(conn, master_label, target_label, near_distance)
+    where = ['t.dir_id = ?'] + near_where
+    params = [PathIndex(conn).lookup_dir(folder)] + near_params
+    if after:
+        where.append(f"({column}, t.id) {'<' if descending else '>'} (?, ?)")
+        params.extend(after)
+    query, values = _orphan_query('t.id, t.path, t.filename, t.size_bytes, t.hash',
+                                  source_id(conn, master_label), source_id(conn, target_label), include_ext, exclude_ext, where, params,
+                                  tail=f'ORDER BY {column} {direction}, t.id {direction} LIMIT ?', cache_id=cache_id)
+    start = time.perf_counter()
+    rows = conn.execute(query, values + [limit + 1]).fetchall()
+    metrics.ORPHAN_QUERY_SECONDS.labels(target_label, 'page').observe(time.perf_counter() - start)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = [last[2] if sort == 'name' else last[3], last[0]]
+    return rows, next_cursor
+
+def find_orphans(conn, master_label, target_label, list_files=False, export_file=None, include_ext=None, exclude_ext=None, near_distance=None):
+    """Trouve les fichiers dans target_label qui ne sont PAS dans master_label (basé sur le hash).
+
+    Avec ``near_distance``, les quasi-copies de photos (ré-export, redimensionnement)
+    sont aussi considérées comme présentes dans le maître.
+    """
+    print(f"Recherche d'orphelins : {target_label} vs MASTER ({master_label})...")
+    if near_distance is not None:
+        print(f"Mode quasi-doublons : distance perceptuelle <= {near_distance}")
     
-    cursor.execute(query, (target_label, master_label))
-    raw_orphans = cursor.fetchall()
-    
-    # Filtrage post-requête
-    orphans = []
-    # Extensions système/bruit toujours ignorées par défaut (sauf si explicitement demandées ?)
-    # On garde une liste minimale de "bruit" technique pur.
-    ignored_patterns = ['.lrdata', '.lrprev', '.thumb', 'Thumbs.db', '.DS_Store', '_data', '.au']
-    
-    # Normalisation des sets d'extensions (tout en minuscule, avec point)
-    allowed_exts = set()
-    if include_ext:
-        for ext in include_ext:
-            if not ext.startswith('.'): ext = '.' + ext
-            allowed_exts.add(ext.lower())
-            
-    blocked_exts = set()
-    if exclude_ext:
-        for ext in exclude_ext:
-            if not ext.startswith('.'): ext = '.' + ext
-            blocked_exts.add(ext.lower())
-
-    for o in raw_orphans:
-        path_str = o[0]
-        filename = o[1]
-        size = o[2]
-        fhash = o[3]
-        ext = o[4].lower() if o[4] else ""
-        
-        # 1. Filtre patterns ignorés (système)
-        if any(pat in path_str for pat in ignored_patterns):
-            continue
-            
-        # 2. Filtre EXCLUDE (prioritaire)
-        if ext in blocked_exts:
-            continue
-            
-        # 3. Filtre INCLUDE (si défini, on ne garde QUE ce qui est dedans)
-        if allowed_exts and ext not in allowed_exts:
-            continue
-            
-        # Si on arrive ici, c'est bon
-        orphans.append((path_str, filename, size, fhash))
+    cache_id = refresh_orphan_cache(conn, master_label, target_label, include_ext, exclude_ext)
+    orphans = list(iter_orphans(conn, master_label, target_label, include_ext, exclude_ext, near_distance, cache_id))
     
     total_size = sum(o[2] for o in orphans)
     print(f"\nRésultats pour {target_label}:")
@@ -297,8 +1976,100 @@ def find_orphans(conn, master_label, target_label, list_files=False, export_file
     
     return orphans
 
-def copy_orphans(orphans, dest_root, dry_run=False):
-    """Copie les fichiers orphelins vers la destination."""
+def duplicate_summary(conn, labels):
+    """Doublons internes par label : {label: (groupes, fichiers en trop, octets récupérables)}.
+
+    Lu dans ``hash_groups`` (index partiel sur les groupes de 2 fichiers et plus).
+    """
+    summary = {label: (0, 0, 0) for label in labels}
+    rows = conn.execute(f'''
+        SELECT s.label, COUNT(*), SUM(g.file_count - 1), SUM(g.total_size - g.total_size / g.file_count)
+        FROM sources s JOIN hash_groups g ON g.source_id = s.id
+        WHERE s.label IN ({','.join('?' * len(labels))}) AND g.file_count > 1
+        GROUP BY s.label
+    ''', list(labels))
+    for label, groups, extra, reclaimable in rows:
+        summary[label] = (groups, extra, reclaimable)
+    return summary
+
+def duplicate_groups(conn, labels, limit=100, offset=0, with_paths=True):
+    """Groupes de doublons des labels, du plus gros gain au plus petit.
+
+    Renvoie des dicts (label, hash, count, size, reclaimable, paths), le
+    hash en octets ; on garde un exemplaire par groupe, le reste est
+    récupérable. Les chemins ne sont lus que pour la page demandée.
+    """
+    rows = conn.execute(f'''
+        SELECT s.id, s.label, g.hash, g.hash_algo, g.file_count, g.total_size / g.file_count AS size,
+               g.total_size - g.total_size / g.file_count AS reclaimable
+        FROM sources s JOIN hash_groups g ON g.source_id = s.id
+        WHERE s.label IN ({','.join('?' * len(labels))}) AND g.file_count > 1
+        ORDER BY reclaimable DESC, s.label, g.hash LIMIT ? OFFSET ?
+    ''', list(labels) + [limit, offset]).fetchall()
+    groups = []
+    for source, label, file_hash, algo, count, size, reclaimable in rows:
+        group = {"label": label, "hash": file_hash, "count": count, "size": size, "reclaimable": reclaimable}
+        if with_paths:
+            group["paths"] = [row[0] for row in conn.execute(
+                'SELECT path FROM file_paths WHERE source_id = ? AND hash = ? AND hash_algo = ? AND is_ignored = 0 ORDER BY path',
+                (source, file_hash, algo))]
+        groups.append(group)
+    return groups
+
+def find_duplicates(conn, labels, limit=20, export_file=None):
+    """Affiche les doublons internes de chaque label (même fichier copié dans plusieurs dossiers)."""
+    print(f"Doublons internes : {', '.join(labels)}")
+    for label, (groups, extra, reclaimable) in duplicate_summary(conn, labels).items():
+        print(f"{label} : {groups} groupes, {extra} fichiers en trop, {reclaimable / (1024*1024):.2f} MB récupérables")
+
+    groups = duplicate_groups(conn, labels, limit=limit)
+    if groups:
+        print(f"\n--- Plus gros gains (premiers {len(groups)}) ---")
+        for group in groups:
+            print(f"[{group['label']}] {group['count']} x {group['size'] / (1024*1024):.2f} MB "
+                  f"-> {group['reclaimable'] / (1024*1024):.2f} MB récupérables ({group['hash'].hex()[:12]})")
+            for path in group['paths']:
+                print(f"    {path}")
+
+    if export_file:
+        try:
+            with open(export_file, 'w', encoding='utf-8') as f:
+                for group in duplicate_groups(conn, labels, limit=-1):
+                    f.write('\t'.join([group['label'], str(group['reclaimable'])] + group['paths']) + '\n')
+            print(f"\n[OK] Groupes de doublons exportés dans : {export_file}")
+        except Exception as e:
+            print(f"\n[Erreur] Impossible d'écrire le fichier d'export : {e}")
+    return groups
+
+def indexed_files(conn, paths):
+    """Infos indexées par chemin : {path: (hash, hash_algo, label)}.
+
+    Les (dossier, nom) sont passés en un seul tableau JSON, joint à l'index
+    unique de ``files`` : deux requêtes quel que soit le nombre de chemins.
+    """
+    keys = {key: path for path, key in PathIndex(conn).find_all(paths).items()}
+    rows = conn.execute('''
+        SELECT f.dir_id, f.filename, f.hash, f.hash_algo, s.label FROM json_each(?) k
+        CROSS JOIN files f ON f.dir_id = json_extract(k.value, '$[0]') AND f.filename = json_extract(k.value, '$[1]')
+        JOIN sources s ON s.id = f.source_id
+    ''', (json.dumps(list(keys)),))
+    return {keys[(dir_id, name)]: (file_hash, hash_algo or LEGACY_HASH_ALGO, label)
+            for dir_id, name, file_hash, hash_algo, label in rows}
+
+def label_for_path(conn, path):
+    """Label de la source correspondant à ``path`` (d'après les noms), sinon ``dest_<dossier>``."""
+    path_str = str(path)
+    for label in source_labels(conn):
+        if path_str in label or label in path_str:
+            return label
+    return f"dest_{Path(path).name}"
+
+def copy_orphans(orphans, dest_root, dry_run=False, conn=None, workers=COPY_WORKERS):
+    """Copie les fichiers orphelins vers la destination.
+
+    Avec ``conn``, chaque copie est vérifiée contre le hash indexé de sa
+    source (voir ``copy_verified``), calculé pendant la copie elle-même.
+    """
     dest_path = Path(dest_root)
     if not dest_path.exists():
         if not dry_run:
@@ -307,48 +2078,364 @@ def copy_orphans(orphans, dest_root, dry_run=False):
     print(f"\nDébut de la copie vers {dest_path}...")
     copied = 0
     errors = 0
-    
-    for path_str, filename, size, fhash in orphans:
-        src = Path(path_str)
-        # On peut organiser par extension ou garder à plat. 
-        # Ici on va faire simple : Destination/Extension/Fichier
-        # Pour éviter les collisions de noms, on peut ajouter le hash ou un suffixe si besoin.
-        
-        # Structure : Dest/jpg/photo.jpg
-        ext = src.suffix.lstrip('.').lower() or "no_ext"
-        target_dir = dest_path / ext
-        target_file = target_dir / filename
-        
-        # Gestion collision nom de fichier
-        if target_file.exists():
-            # Si le fichier existe déjà (même nom), on vérifie si c'est le même contenu (hash déjà fait par le scan, mais ici on parle du fichier physique destination)
-            # Mais ici on copie des orphelins, donc par définition ils ne sont pas dans le set "Maître".
-            # Si on copie plusieurs orphelins qui ont le même nom mais hash différent (ex: DSC001.jpg de voyage A et DSC001.jpg de voyage B), il faut renommer.
-            stem = target_file.stem
-            suffix = target_file.suffix
-            counter = 1
-            while target_file.exists():
-                target_file = target_dir / f"{stem}_{counter}{suffix}"
-                counter += 1
-        
-        if dry_run:
-            print(f"[DRY RUN] Copie {src} -> {target_file}")
+    info = indexed_files(conn, (o[0] for o in orphans)) if conn is not None else {}
+
+    def tasks():
+        for path_str, filename, size, fhash in orphans:
+            src = Path(path_str)
+            # Structure : Dest/jpg/photo.jpg
+            # Deux orphelins homonymes (DSC001.jpg de voyages différents) sont
+            # renommés DSC001_1.jpg... à la création (voir _reserve_target)
+            ext = src.suffix.lstrip('.').lower() or "no_ext"
+            target_file = dest_path / ext / filename
+            if dry_run:
+                print(f"[DRY RUN] Copie {src} -> {target_file}")
+                continue
+            expected_hash, algo, _ = info.get(path_str, (None, LEGACY_HASH_ALGO, None))
+            yield src, target_file, expected_hash, algo, src
+
+    for src, (status, target, detail) in run_copies(tasks(), workers):
+        if status == 'copied':
+            copied += 1
+            print(f"Copié: {target.name}", end='\r')
         else:
-            try:
-                target_dir.mkdir(parents=True, exist_ok=True)
-                shutil.copy2(src, target_file)
-                copied += 1
-                print(f"Copié: {filename}", end='\r')
-            except Exception as e:
-                print(f"\nErreur copie {src}: {e}")
-                errors += 1
+            print(f"\nErreur copie {src}: {detail}")
+            errors += 1
                 
     print(f"\nCopie terminée. Succès: {copied}, Erreurs: {errors}")
 
+class MoveJournal:
+    """Journal (JSON lines) des déplacements, pour reprendre un lot après un crash.
+
+    Chaque copie entre disques est annoncée ('start') avant l'écriture puis
+    marquée 'copied' une fois vérifiée et synchronisée (ou 'failed') ; une
+    source n'est supprimée qu'après un fsync du journal qui la marque copiée.
+    Les renommages ('renamed') y figurent aussi, pour rejouer la mise à jour
+    de l'index. ``recover`` termine un lot interrompu sans recopier les
+    fichiers finis.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(os.path.dirname(os.path.abspath(DB_NAME)), MOVE_JOURNAL_NAME)
+        self.label = None  # Label de destination, noté avec chaque copie
+        self._file = None
+        self._lock = threading.Lock()
+
+    def record(self, op, src, dst, **extra):
+        entry = dict(op=op, src=str(src), dst=str(dst), label=self.label, **extra)
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(json.dumps(entry) + '\n')
+            self._file.flush()  # Survit à l'arrêt du processus ; fsync dans sync()
+
+    def sync(self):
+        with self._lock:
+            if self._file is not None:
+                os.fsync(self._file.fileno())
+
+    def entries(self):
+        """État final de chaque déplacement journalisé : {src: entrée}."""
+        states = {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # Dernière ligne tronquée par le crash
+                    states[entry['src']] = entry
+        except FileNotFoundError:
+            pass
+        return states
+
+    def recover(self, conn):
+        """Termine le lot interrompu ; renvoie {src: dst} des déplacements achevés."""
+        done = {}
+        rows = []
+        removed = []
+        renamed = []
+        paths = PathIndex(conn)
+        for src, entry in self.entries().items():
+            dst = entry['dst']
+            if entry['op'] == 'renamed':
+                # Renommage fait, mise à jour de l'index peut-être perdue (rejouée à l'identique)
+                if os.path.exists(dst) and not os.path.exists(src):
+                    label = entry.get('label') or label_for_path(conn, os.path.dirname(dst))
+                    renamed.append(paths.key(dst) + (normalize_extension(os.path.splitext(dst)[1]), is_ignored_path(dst),
+                                                     source_id(conn, label, create=True), datetime.now().isoformat())
+                                   + _old_key(paths, src))
+                    done[src] = dst
+                continue
+            if entry['op'] == 'failed':
+                continue
+            if entry['op'] == 'start':
+                # Copie interrompue : destination partielle
+                if os.path.exists(dst):
+                    os.remove(dst)
+                continue
+            if not os.path.exists(dst):
+                continue  # Copie disparue depuis : la source est conservée
+            if os.path.exists(src):
+                os.remove(src)
+            removed.append(_old_key(paths, src))
+            st = os.stat(dst)
+            label = entry.get('label') or label_for_path(conn, os.path.dirname(dst))
+            rows.append(paths.key(dst) + (normalize_extension(os.path.splitext(dst)[1]), st.st_size, st.st_mtime,
+                                          bytes.fromhex(entry['hash']), entry['algo'], source_id(conn, label, create=True),
+                                          datetime.now().isoformat(), is_ignored_path(dst), st.st_ino))
+            done[src] = dst
+        conn.executemany(MOVE_UPDATE_SQL, renamed)
+        conn.executemany(UPSERT_FILE_SQL, rows)
+        conn.executemany(DELETE_FILE_SQL, removed)
+        if done:
+            print(f"Reprise du journal de déplacement : {len(done)} fichiers achevés.")
+        conn.commit()
+        self.close()
+        return done
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+# Un seul lot de déplacements à la fois (journal partagé)
+_move_lock = threading.Lock()
+
+# Valeurs : (dir_id, nom, extension, bruit, id du label, date) puis (dir_id, nom) d'origine
+MOVE_UPDATE_SQL = '''
+    UPDATE OR REPLACE files SET dir_id = ?, filename = ?, extension = ?, is_ignored = ?,
+        source_id = ?, scan_date = ?
+    WHERE dir_id = ? AND filename = ?
+'''
+DELETE_FILE_SQL = 'DELETE FROM files WHERE dir_id = ? AND filename = ?'
+
+def _old_key(paths, path):
+    # Dossier inconnu de l'index : (None, nom) ne correspond à aucune ligne
+    return paths.find(path) or (None, os.path.basename(path))
+
+def copy_indexed_files(conn, paths, dest, move=False, dest_label=None, workers=COPY_WORKERS, abort_callback=None):
+    """Copie (ou déplace) des fichiers vers ``dest`` et indexe les copies.
+
+    Chaque copie est vérifiée en un seul passage contre le hash indexé de sa
+    source. Le label de destination est déterminé une fois pour toutes
+    (``label_for_path``). Renvoie les compteurs copied / errors /
+    verification_failed / db_updated (et renamed / resumed pour un déplacement).
+    """
+    if move:
+        with _move_lock:
+            return _move_indexed_files(conn, paths, dest, dest_label, workers, abort_callback)
+    stats = {"copied": 0, "errors": 0, "verification_failed": 0, "db_updated": 0}
+    dest_path = Path(dest)
+    dest_path.mkdir(parents=True, exist_ok=True)
+    dest_label = dest_label or label_for_path(conn, dest_path)
+    dest_source = source_id(conn, dest_label, create=True)
+    default_algo = get_hash_algo(conn)
+    info = indexed_files(conn, paths)
+    meter = metrics.CopyMetrics(dest_label, physical_device(os.stat(dest_path).st_dev))
+
+    def tasks():
+        for path_str in paths:
+            if path_str not in info:
+                print(f"Warning: {path_str} not found in database, skipping verification")
+            # La vérification utilise l'algorithme avec lequel la source a été indexée
+            expected_hash, algo, _ = info.get(path_str, (None, default_algo, None))
+            yield Path(path_str), dest_path / Path(path_str).name, expected_hash, algo, (path_str, algo)
+
+    paths_index = PathIndex(conn)
+    with IndexWriter(conn) as writer:
+        for (path_str, algo), (status, target, detail) in run_copies(tasks(), workers, abort_callback):
+            if status == 'aborted':
+                continue
+            if status == 'mismatch':
+                stats["verification_failed"] += 1
+                meter.failed(status)
+                print(f"ERROR: Hash mismatch for {target}: {detail}")
+                continue
+            if status == 'error':
+                stats["errors"] += 1
+                meter.failed(status)
+                print(f"Error copying {path_str}: {detail}")
+                continue
+            st = target.stat()
+            writer.add((paths_index.dir_id(target.parent), target.name, normalize_extension(target.suffix), st.st_size,
+                        st.st_mtime, detail, algo, dest_source, datetime.now().isoformat(), is_ignored_path(str(target)),
+                        st.st_ino))
+            meter.copied(st.st_size)
+            stats["copied"] += 1
+            stats["db_updated"] += 1
+    meter.finish()
+    return stats
+
+def _move_indexed_files(conn, paths, dest, dest_label, workers, abort_callback):
+    """Déplacement : ``rename`` atomique sur un même système de fichiers, la
+    ligne de l'index étant mise à jour sur place (hash, empreintes conservés) ;
+    copie vérifiée et journalisée sinon (voir ``MoveJournal``).
+    """
+    stats = {"copied": 0, "errors": 0, "verification_failed": 0, "db_updated": 0, "renamed": 0, "resumed": 0}
+    dest_path = Path(dest)
+    dest_path.mkdir(parents=True, exist_ok=True)
+    dest_label = dest_label or label_for_path(conn, dest_path)
+    dest_source = source_id(conn, dest_label, create=True)
+    dest_dev = os.stat(dest_path).st_dev
+    default_algo = get_hash_algo(conn)
+    meter = metrics.CopyMetrics(dest_label, physical_device(dest_dev))
+
+    # Lot précédent interrompu : on l'achève, ses fichiers ne sont pas recopiés
+    journal = MoveJournal()
+    finished = journal.recover(conn)
+    journal.label = dest_label
+    pending = [p for p in paths if p not in finished]
+    stats["resumed"] = len(paths) - len(pending)
+    stats["copied"] += stats["resumed"]
+    info = indexed_files(conn, pending)
+    paths_index = PathIndex(conn)
+
+    cross_device = []
+    with IndexWriter(conn, MOVE_UPDATE_SQL) as writer:
+        for path_str in pending:
+            if abort_callback and abort_callback():
+                break
+            try:
+                same_device = path_str in info and os.stat(path_str).st_dev == dest_dev
+            except OSError as e:
+                print(f"Error moving {path_str}: {e}")
+                stats["errors"] += 1
+                continue
+            if not same_device:
+                cross_device.append(path_str)
+                continue
+            target, fd = _reserve_target(dest_path / Path(path_str).name)
+            os.close(fd)
+            try:
+                os.rename(path_str, target)  # Remplace atomiquement le nom réservé
+            except OSError as e:
+                os.remove(target)
+                if e.errno == errno.EXDEV:  # Montages distincts d'un même volume
+                    cross_device.append(path_str)
+                    continue
+                print(f"Error moving {path_str}: {e}")
+                stats["errors"] += 1
+                continue
+            journal.record('renamed', path_str, target)
+            writer.add((paths_index.dir_id(target.parent), target.name, normalize_extension(target.suffix),
+                        is_ignored_path(str(target)), dest_source, datetime.now().isoformat()) + _old_key(paths_index, path_str))
+            stats["renamed"] += 1
+            stats["copied"] += 1
+            stats["db_updated"] += 1
+
+    def tasks():
+        for path_str in cross_device:
+            expected_hash, algo, _ = info.get(path_str, (None, default_algo, None))
+            yield Path(path_str), dest_path / Path(path_str).name, expected_hash, algo, (path_str, algo)
+
+    copied = []
+    def release_sources():
+        # Les sources ne sont supprimées qu'une fois leur copie inscrite durablement au journal
+        journal.sync()
+        for path_str in copied:
+            try:
+                os.remove(path_str)
+            except OSError as e:
+                print(f"Error removing {path_str}: {e}")
+                stats["errors"] += 1
+        conn.executemany(DELETE_FILE_SQL, (_old_key(paths_index, path_str) for path_str in copied))
+        copied.clear()
+
+    with IndexWriter(conn) as writer:
+        for (path_str, algo), (status, target, detail) in run_copies(tasks(), workers, abort_callback, journal):
+            if status == 'mismatch':
+                stats["verification_failed"] += 1
+                meter.failed(status)
+                print(f"ERROR: Hash mismatch for {target}: {detail}")
+            elif status == 'error':
+                stats["errors"] += 1
+                meter.failed(status)
+                print(f"Error moving {path_str}: {detail}")
+            elif status == 'copied':
+                st = target.stat()
+                meter.copied(st.st_size)
+                writer.add((paths_index.dir_id(target.parent), target.name, normalize_extension(target.suffix), st.st_size,
+                            st.st_mtime, detail, algo, dest_source, datetime.now().isoformat(), is_ignored_path(str(target)),
+                            st.st_ino))
+                copied.append(path_str)
+                stats["copied"] += 1
+                stats["db_updated"] += 1
+                if len(copied) >= MOVE_SYNC_EVERY:
+                    writer.flush()
+                    release_sources()
+        writer.flush()
+        release_sources()
+    meter.finish()
+    # Lot complet et indexé : le journal n'a plus d'utilité (conservé en cas d'exception)
+    journal.close()
+    return stats
+
+def _trash_one(path):
+    """Corbeille si possible, sinon suppression définitive (volume sans corbeille...)."""
+    if send2trash is not None:
+        try:
+            send2trash(path)
+            return
+        except Exception:
+            pass
+    os.remove(path)
+
+def trash_files(conn, paths, batch_size=TRASH_BATCH_SIZE, progress_callback=None):
+    """Envoie des fichiers à la corbeille et les retire de l'index.
+
+    Send2Trash est appelé dans le processus, un lot de ``batch_size``
+    chemins à la fois ; si un lot échoue, ses fichiers restants sont repris
+    un par un. Les fichiers déjà absents du disque sont seulement retirés de
+    l'index. Toutes les lignes sont supprimées en un seul ``executemany``,
+    dans une seule transaction. Renvoie (nombre retiré, erreurs).
+    """
+    removed = []
+    errors = []
+    total = len(paths)
+    throttle = ProgressThrottle()
+    for start in range(0, total, batch_size):
+        batch = []
+        for path in paths[start:start + batch_size]:
+            if not os.path.exists(path):
+                removed.append(path)
+                errors.append(f"Not found (removed from DB): {path}")
+            elif not os.path.isfile(path):
+                errors.append(f"Not a file: {path}")
+            else:
+                batch.append(path)
+        if batch:
+            try:
+                if send2trash is None:
+                    raise OSError("Send2Trash indisponible")
+                send2trash(batch)
+                removed.extend(batch)
+            except Exception:
+                for path in batch:
+                    try:
+                        if os.path.exists(path):  # Le lot a pu être traité en partie
+                            _trash_one(path)
+                        removed.append(path)
+                    except OSError as e:
+                        errors.append(f"Error processing {path}: {e}")
+        done = min(start + batch_size, total)
+        if progress_callback and (throttle.due() or done == total):
+            progress_callback({"status": "deleting", "done": done, "total": total})
+
+    with conn:
+        conn.executemany(DELETE_FILE_SQL, PathIndex(conn).find_all(removed).values())
+    return len(removed), errors
+
 def get_orphans_from_list(conn, list_file):
     """Récupère les infos des fichiers depuis une liste texte."""
     orphans = []
     cursor = conn.cursor()
+    paths_index = PathIndex(conn)
     
     try:
         with open(list_file, 'r', encoding='utf-8') as f:
@@ -358,8 +2445,9 @@ def get_orphans_from_list(conn, list_file):
         
         for path in paths:
             # On récupère les infos dans la DB pour avoir le hash et la taille
-            cursor.execute('SELECT path, filename, size_bytes, hash FROM files WHERE path = ?', (path,))
-            row = cursor.fetchone()
+            key = paths_index.find(path)
+            row = key and cursor.execute('SELECT path, filename, size_bytes, hash FROM file_paths WHERE dir_id = ? AND filename = ?',
+                                         key).fetchone()
             if row:
                 orphans.append(row)
             else:
@@ -374,8 +2462,15 @@ def get_orphans_from_list(conn, list_file):
 def delete_source(conn, label):
     """Supprime toutes les entrées associées à un label source."""
     cursor = conn.cursor()
-    cursor.execute("DELETE FROM files WHERE source_label = ?", (label,))
+    source = source_id(conn, label)
+    cursor.execute("DELETE FROM files WHERE source_id = ?", (source,))
     deleted = cursor.rowcount
+    cursor.execute("DELETE FROM sources WHERE id = ?", (source,))
+    # Recherches d'orphelins sur ce label : un nouveau scan du même nom aura un autre id
+    cursor.execute("DELETE FROM orphan_cache WHERE ? IN (master_id, target_id)", (source,))
+    cursor.execute("DELETE FROM orphan_cache_items WHERE cache_id NOT IN (SELECT id FROM orphan_cache)")
+    # Dossiers qui ne portent plus aucun fichier, tous labels confondus
+    cursor.execute("DELETE FROM directories WHERE NOT EXISTS (SELECT 1 FROM files WHERE dir_id = directories.id)")
     
     # Nettoyer aussi l'historique si on veut, mais on peut le garder pour trace.
     # Pour l'instant on garde l'historique.
@@ -385,15 +2480,29 @@ def delete_source(conn, label):
     return deleted
 
 def rename_source(conn, old_label, new_label):
-    """Renomme un label source dans la base de données."""
+    """Renomme un label source dans la base de données.
+
+    Les fichiers ne portent que l'id de leur source : renommer ne touche
+    qu'une ligne de ``sources``. Vers un label déjà existant, les fichiers
+    sont rattachés à celui-ci (fusion). Renvoie le nombre de fichiers concernés.
+    """
     cursor = conn.cursor()
+    old_id, new_id = source_id(conn, old_label), source_id(conn, new_label)
+    if old_id is None or old_id == new_id:
+        return 0
     try:
-        cursor.execute("UPDATE files SET source_label = ? WHERE source_label = ?", (new_label, old_label))
-        updated = cursor.rowcount
+        if new_id is None:
+            cursor.execute("UPDATE sources SET label = ? WHERE id = ?", (new_label, old_id))
+            new_id = old_id
+        else:
+            cursor.execute("UPDATE files SET source_id = ? WHERE source_id = ?", (new_id, old_id))
+            cursor.execute("DELETE FROM sources WHERE id = ?", (old_id,))
+        updated = cursor.execute("SELECT COUNT(*) FROM files WHERE source_id = ?", (new_id,)).fetchone()[0]
         conn.commit()
-        print(f"Source '{old_label}' renommée en '{new_label}' : {updated} fichiers mis à jour.")
+        print(f"Source '{old_label}' renommée en '{new_label}' : {updated} fichiers concernés.")
         return updated
     except sqlite3.IntegrityError:
+        conn.rollback()
         print(f"Erreur: Le label '{new_label}' existe déjà pour certains fichiers.")
         return 0
 
@@ -403,18 +2512,43 @@ def main():
 
     # Commande SCAN
     cmd_scan = subparsers.add_parser('scan', help='Scanner un dossier et indexer les fichiers')
-    cmd_scan.add_argument('--path', required=True, help='Chemin du dossier à scanner')
-    cmd_scan.add_argument('--label', required=True, help='Nom unique pour ce disque/source (ex: MASTER, USB1)')
+    cmd_scan.add_argument('--path', required=True, action='append', help='Chemin du dossier à scanner (répétable : un --label par --path, disques scannés en parallèle)')
+    cmd_scan.add_argument('--label', required=True, action='append', help='Nom unique pour ce disque/source (ex: MASTER, USB1)')
     cmd_scan.add_argument('--min-size', type=int, default=DEFAULT_MIN_SIZE, help='Taille min en octets (défaut 10KB)')
     cmd_scan.add_argument('--update', action='store_true', help='Ne pas re-hasher les fichiers inchangés (chemin+taille+date identiques)')
+    cmd_scan.add_argument('--rehash', action='store_true', help='Relire et re-hasher tous les fichiers, sans reprendre aucun hash indexé (contrôle du contenu)')
+    cmd_scan.add_argument('--workers', type=int, default=1, help='Hachages simultanés par disque (limité à 1 sur disque rotatif)')
+    cmd_scan.add_argument('--include-system', action='store_true', help='Parcourir aussi les dossiers système (.lrdata, $RECYCLE.BIN, .Trashes...)')
+    cmd_scan.add_argument('--hash-algo', choices=sorted(HASH_ALGORITHMS), help='Algorithme de hash pour ce scan (défaut : réglage de la base)')
+    cmd_scan.add_argument('--staged', action='store_true', help='Ne hasher que les fichiers dont la taille (puis l\'empreinte partielle) est en collision')
+    cmd_scan.add_argument('--perceptual', action='store_true', help='Calculer aussi l\'empreinte perceptuelle des photos (détection des quasi-doublons)')
+    cmd_scan.add_argument('--profile', action='store_true', help='Profiler le scan (cProfile) et afficher les fonctions les plus coûteuses')
     
+    # Commande WATCH
+    cmd_watch = subparsers.add_parser('watch', help='Suivre un dossier en continu (inotify) et mettre l\'index à jour au fil des changements')
+    cmd_watch.add_argument('--path', required=True, help='Dossier à suivre')
+    cmd_watch.add_argument('--label', required=True, help='Label de la source')
+    cmd_watch.add_argument('--min-size', type=int, default=DEFAULT_MIN_SIZE, help='Taille min en octets (défaut 10KB)')
+    cmd_watch.add_argument('--workers', type=int, default=1, help='Hachages simultanés par disque')
+    cmd_watch.add_argument('--include-system', action='store_true', help='Suivre aussi les dossiers système (.lrdata, $RECYCLE.BIN, .Trashes...)')
+    cmd_watch.add_argument('--hash-algo', choices=sorted(HASH_ALGORITHMS), help='Algorithme de hash (défaut : réglage de la base)')
+    cmd_watch.add_argument('--debounce', type=float, default=2.0, help='Secondes de calme avant de traiter un fichier (défaut 2)')
+    cmd_watch.add_argument('--initial-scan', action='store_true', help='Rattraper d\'abord les changements faits hors suivi (scan --update)')
+
     # Commande REPORT
     cmd_report = subparsers.add_parser('report', help='Afficher les fichiers orphelins (présents sur Cible mais pas sur Maître)')
     cmd_report.add_argument('--master', required=True, help='Label du disque MAÎTRE')
     cmd_report.add_argument('--target', required=True, help='Label du disque à analyser (CIBLE)')
     cmd_report.add_argument('--list', action='store_true', help='Lister les chemins des fichiers orphelins')
     cmd_report.add_argument('--export', help='Chemin du fichier texte pour exporter la liste complète')
+    cmd_report.add_argument('--near', type=int, metavar='D', help='Ignorer les photos ayant une quasi-copie dans le maître (distance perceptuelle <= D, 6 conseillé)')
     
+    # Commande DUPLICATES
+    cmd_dups = subparsers.add_parser('duplicates', help='Afficher les doublons internes d\'un ou plusieurs disques, par place récupérable')
+    cmd_dups.add_argument('--label', required=True, action='append', help='Label à analyser (répétable)')
+    cmd_dups.add_argument('--limit', type=int, default=20, help='Nombre de groupes affichés (défaut 20)')
+    cmd_dups.add_argument('--export', help='Fichier texte (TSV) recevant tous les groupes : label, octets récupérables, chemins')
+
     # Commande COPY
     cmd_copy = subparsers.add_parser('copy', help='Copier les orphelins vers un dossier')
     cmd_copy.add_argument('--master', help='Label du disque MAÎTRE')
@@ -423,16 +2557,84 @@ def main():
     cmd_copy.add_argument('--dry-run', action='store_true', help='Simuler sans copier')
     cmd_copy.add_argument('--from-list', help='Chemin d\'un fichier texte contenant la liste des fichiers à copier (ignorer master/target)')
 
+    # Commande CONFIG
+    cmd_config = subparsers.add_parser('config', help='Afficher ou modifier les réglages de la base')
+    cmd_config.add_argument('--hash-algo', choices=sorted(HASH_ALGORITHMS), help='Algorithme de hash par défaut (les anciens hashs sont migrés à la demande)')
+    cmd_config.add_argument('--bench-hash', action='store_true', help='Mesurer le débit de chaque algorithme de hash sur cette machine (sans rien changer)')
+
     args = parser.parse_args()
     
     conn = init_db()
     
     if args.command == 'scan':
-        scan_directory(conn, args.path, args.label, args.min_size, DEFAULT_EXCLUDE_EXT, args.update)
+        if len(args.path) != len(args.label):
+            parser.error("Il faut autant de --label que de --path")
+        options = dict(min_size=args.min_size, exclude_ext=DEFAULT_EXCLUDE_EXT, update_mode=args.update, rehash=args.rehash, staged=args.staged,
+                       workers=args.workers, skip_system=not args.include_system, hash_algo=args.hash_algo, perceptual=args.perceptual)
+        if len(args.path) == 1:
+            with metrics.profiled(args.profile) as report:
+                scan_directory(conn, args.path[0], args.label[0], **options)
+            if report.text:
+                print(report.text)
+        else:
+            # Plusieurs sources : une file par disque physique, les disques en parallèle
+            import jobs
+            scheduler = jobs.JobScheduler()
+            for path, label in zip(args.path, args.label):
+                try:
+                    job = scheduler.submit(path, label, args.profile, **options)
+                except OSError as e:
+                    print(f"Erreur: {path} inaccessible ({e})")
+                    continue
+                print(f"Job {job.id} : {path} ({label}) sur le disque {job.device}")
+            try:
+                scheduler.wait()
+            except KeyboardInterrupt:
+                for job in scheduler.active():
+                    scheduler.cancel(job.id)
+                scheduler.wait()
+            for job in scheduler.jobs():
+                print(f"Job {job.id} ({job.label}) : {job.state}" + (f" - {job.error}" if job.error else ""))
+                if job.profile_report:
+                    print(job.profile_report)
     
+    elif args.command == 'watch':
+        import watcher
+        try:
+            watch = watcher.Watcher(args.path, args.label, args.min_size, DEFAULT_EXCLUDE_EXT, skip_system=not args.include_system,
+                                    workers=args.workers, hash_algo=args.hash_algo, debounce=args.debounce,
+                                    initial_scan=args.initial_scan)
+        except OSError as e:
+            print(f"Erreur: {e}")
+            return
+        watch.start()
+        try:
+            while watch.alive:
+                watch.join(0.5)
+        except KeyboardInterrupt:
+            print("\nArrêt du suivi...")
+            watch.stop()
+            watch.join()
+        print(', '.join(f"{key}: {value}" for key, value in watch.stats.items()))
+
+    elif args.command == 'config':
+        if args.hash_algo:
+            set_hash_algo(conn, args.hash_algo)
+        if args.bench_hash:
+            for algo, rate in sorted(benchmark_hash_algos().items(), key=lambda item: -item[1]):
+                print(f"{algo:<10} {rate / 1024 / 1024:8.0f} MB/s")
+        print(f"Algorithme de hash : {get_hash_algo(conn)} (disponibles : {', '.join(sorted(HASH_ALGORITHMS))})")
+
     elif args.command == 'report':
-        find_orphans(conn, args.master, args.target, args.list, args.export)
+        if args.near is not None:
+            import perceptual
+            if not 0 <= args.near <= perceptual.MAX_NEAR_DISTANCE:
+                parser.error(f"--near doit être compris entre 0 et {perceptual.MAX_NEAR_DISTANCE}")
+        find_orphans(conn, args.master, args.target, args.list, args.export, near_distance=args.near)
         
+    elif args.command == 'duplicates':
+        find_duplicates(conn, args.label, args.limit, args.export)
+
     elif args.command == 'copy':
         orphans = []
         if args.from_list:
@@ -445,9 +2647,9 @@ def main():
 
         if orphans:
             print(f"Prêt à copier {len(orphans)} fichiers vers {args.dest}")
-            confirm = input(f"Confirmer ? (o/n) ")
+            confirm = input("Confirmer ? (o/n) ")
             if confirm.lower() == 'o':
-                copy_orphans(orphans, args.dest, args.dry_run)
+                copy_orphans(orphans, args.dest, args.dry_run, conn)
             else:
                 print("Annulé.")
     
@@ -0,0 +1,264 @@
+"""Métriques de fonctionnement (scan, index, orphelins, copies) au format texte Prometheus.
+
+Compteurs, jauges et histogrammes en mémoire, sans dépendance, exposés
+par le serveur sur /metrics (``render``). Chaque série est désignée par
+ses labels (label de la source, disque...) ; ``labels()`` renvoie la série,
+à résoudre une fois hors des boucles (voir ``ScanMetrics``).
+
+``profiled`` active cProfile le temps d'un scan (option ``profile`` d'un job).
+"""
+import cProfile
+import io
+import math
+import pstats
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Tranches de taille des fichiers hachés (label ``size`` de media_hash_seconds)
+SIZE_BUCKETS = [
+    (1024 * 1024, '<1M'),
+    (16 * 1024 * 1024, '1M-16M'),
+    (128 * 1024 * 1024, '16M-128M'),
+    (math.inf, '>128M'),
+]
+PROFILE_LINES = 40  # Fonctions gardées dans le rapport cProfile
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Family:
+    """Famille de séries d'un même nom, une par combinaison de labels."""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+        (REGISTRY if registry is None else registry).append(self)
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} attend les labels {self.labelnames}")
+        series = self._series.get(values)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(values, self._new_series())
+        return series
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            items = sorted(self._series.items())
+        for values, series in items:
+            lines.extend(series.render(self.name, self.labelnames, values))
+        return lines
+
+class _Value:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+    def render(self, name, labelnames, values):
+        return [f'{name}{_format_labels(labelnames, values)} {_format_value(self.value)}']
+
+class Counter(_Family):
+    type = 'counter'
+
+    def _new_series(self):
+        return _Value()
+
+class Gauge(_Family):
+    type = 'gauge'
+
+    def _new_series(self):
+        return _Value()
+
+class _Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def render(self, name, labelnames, values):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(list(self.bounds) + [math.inf], counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{_format_labels(labelnames, values, [("le", _format_value(bound))])} {cumulative}')
+        lines.append(f'{name}_sum{_format_labels(labelnames, values)} {_format_value(total)}')
+        lines.append(f'{name}_count{_format_labels(labelnames, values)} {cumulative}')
+        return lines
+
+class Histogram(_Family):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=(), registry=None):
+        self.buckets = sorted(buckets)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_series(self):
+        return _Histogram(self.buckets)
+
+REGISTRY = []
+
+def render(registry=None):
+    """Toutes les séries au format d'exposition texte de Prometheus (0.0.4)."""
+    lines = []
+    for family in REGISTRY if registry is None else registry:
+        lines.extend(family.render())
+    return '\n'.join(lines) + '\n'
+
+_LATENCY = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+_LONG = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+SCAN_FILES = Counter('media_scan_files_total', "Fichiers vus par le scan, selon leur sort (indexed, skipped, error)",
+                     ['label', 'device', 'outcome'])
+SCAN_FILES_PER_SECOND = Gauge('media_scan_files_per_second', "Débit du scan en cours ou du dernier (fichiers indexés ou sautés par seconde)",
+                              ['label', 'device'])
+STAT_SECONDS = Histogram('media_stat_seconds', "Durée d'un stat() pendant le parcours (échantillon : un stat sur 16)",
+                         ['label', 'device'], (5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 1e-3, 0.01, 0.1, 1))
+BYTES_HASHED = Counter('media_bytes_hashed_total', "Octets lus et hachés", ['label', 'device'])
+FILES_HASHED = Counter('media_files_hashed_total', "Fichiers hachés (hash complet)", ['label', 'device'])
+HASH_SECONDS = Histogram('media_hash_seconds', "Durée du hash complet d'un fichier, par tranche de taille",
+                         ['label', 'device', 'size'], _LONG)
+FILES_REUSED = Counter('media_files_reused_total', "Fichiers dont le hash indexé a été repris (déplacés, renommés, autre label)",
+                       ['label', 'device'])
+BYTES_REUSED = Counter('media_bytes_reused_total', "Octets non relus grâce aux hashs repris", ['label', 'device'])
+DB_WRITE_SECONDS = Histogram('media_db_batch_write_seconds', "Durée d'écriture d'un lot dans l'index (executemany + commit)",
+                             ['label', 'device'], _LATENCY)
+DB_ROWS_WRITTEN = Counter('media_db_rows_written_total', "Lignes écrites dans l'index par lots", ['label', 'device'])
+ORPHAN_QUERY_SECONDS = Histogram('media_orphan_query_seconds', "Durée des requêtes d'orphelins, par type de requête",
+                                 ['label', 'query'], _LATENCY)
+COPY_BYTES = Counter('media_copy_bytes_total', "Octets copiés et vérifiés", ['label', 'device'])
+COPY_FILES = Counter('media_copy_files_total', "Fichiers copiés, selon le résultat (copied, mismatch, error)",
+                     ['label', 'device', 'outcome'])
+COPY_BYTES_PER_SECOND = Gauge('media_copy_bytes_per_second', "Débit du dernier lot de copies", ['label', 'device'])
+
+def size_bucket(size):
+    for bound, name in SIZE_BUCKETS:
+        if size < bound:
+            return name
+    return SIZE_BUCKETS[-1][1]
+
+class ScanMetrics:
+    """Séries d'un scan (label, disque), résolues une fois : par fichier, on n'incrémente que des valeurs."""
+
+    def __init__(self, label, device):
+        label = label or ''
+        self.stat = STAT_SECONDS.labels(label, device)
+        self.indexed = SCAN_FILES.labels(label, device, 'indexed')
+        self.skipped = SCAN_FILES.labels(label, device, 'skipped')
+        self.errors = SCAN_FILES.labels(label, device, 'error')
+        self.rate = SCAN_FILES_PER_SECOND.labels(label, device)
+        self.db_write = DB_WRITE_SECONDS.labels(label, device)
+        self.db_rows = DB_ROWS_WRITTEN.labels(label, device)
+        self._bytes = BYTES_HASHED.labels(label, device)
+        self._files = FILES_HASHED.labels(label, device)
+        self._hash = {name: HASH_SECONDS.labels(label, device, name) for _, name in SIZE_BUCKETS}
+        self.files_reused = FILES_REUSED.labels(label, device)
+        self.bytes_reused = BYTES_REUSED.labels(label, device)
+        self._totals = [self.indexed, self.skipped, self.errors, self.files_reused, self.bytes_reused]
+        self._reported = [0] * len(self._totals)
+
+    def progress(self, indexed, skipped, errors, reused, reused_bytes, elapsed):
+        """Reporte les totaux du scan (par écart au précédent rapport) et son débit.
+
+        Appelé au rythme de la progression plutôt qu'à chaque fichier.
+        """
+        totals = (indexed, skipped, errors, reused, reused_bytes)
+        for series, total, reported in zip(self._totals, totals, self._reported):
+            if total > reported:
+                series.inc(total - reported)
+        self._reported = list(totals)
+        self.rate.set(round((indexed + skipped) / max(elapsed, 1e-6), 1))
+
+    def hashed(self, size, seconds):
+        self._bytes.inc(size)
+        self._files.inc()
+        self._hash[size_bucket(size)].observe(seconds)
+
+    def batch_written(self, rows, seconds):
+        self.db_rows.inc(rows)
+        self.db_write.observe(seconds)
+
+class CopyMetrics:
+    """Séries d'un lot de copies vers (label, disque) de destination ; ``finish`` fixe le débit du lot."""
+
+    def __init__(self, label, device):
+        label = label or ''
+        self._bytes = COPY_BYTES.labels(label, device)
+        self._outcomes = {outcome: COPY_FILES.labels(label, device, outcome) for outcome in ('copied', 'mismatch', 'error')}
+        self._rate = COPY_BYTES_PER_SECOND.labels(label, device)
+        self._start = time.perf_counter()
+        self._copied = 0
+
+    def copied(self, size):
+        self._copied += size
+        self._bytes.inc(size)
+        self._outcomes['copied'].inc()
+
+    def failed(self, outcome):
+        self._outcomes[outcome].inc()
+
+    def finish(self):
+        if self._copied:
+            self._rate.set(round(self._copied / max(time.perf_counter() - self._start, 1e-6)))
+
+class ProfileReport:
+    """Rapport cProfile (texte), rempli à la sortie de ``profiled``."""
+
+    def __init__(self):
+        self.text = None
+
+@contextmanager
+def profiled(enabled=True, sort='cumulative', limit=PROFILE_LINES):
+    """Profile (cProfile) le thread courant le temps du bloc.
+
+    Les threads de hachage ne sont pas profilés : le rapport couvre le
+    parcours, la détection des fichiers inchangés, les écritures dans
+    l'index et l'attente des hachages.
+    """
+    report = ProfileReport()
+    if not enabled:
+        yield report
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield report
+    finally:
+        profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats(sort).print_stats(limit)
+        report.text = out.getvalue()
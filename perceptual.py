@@ -0,0 +1,194 @@
+import os
+import threading
+from collections import defaultdict
+
+from PIL import Image
+
+import media_tool
+from thumbnails import open_image
+
+# Empreinte dHash 64 bits : 9x8 pixels en niveaux de gris, un bit par paire
+# de pixels voisins. Robuste au redimensionnement, au ré-encodage et aux
+# retouches légères ; une distance de Hamming <= 6 désigne en pratique la
+# même photo.
+DHASH_SIZE = 8
+DEFAULT_NEAR_DISTANCE = 6
+INDEX_CHUNKS = 4  # Multi-index hashing : 4 blocs de 16 bits
+MAX_NEAR_DISTANCE = INDEX_CHUNKS * 3 - 1  # Sondage à 2 bits près au plus par bloc
+
+def _to_signed(value):
+    # SQLite stocke des entiers signés 64 bits
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+def dhash(filepath):
+    """Calcule le dHash 64 bits d'une image (aperçu embarqué pour les RAW)."""
+    img = open_image(filepath, 64).convert('L').resize((DHASH_SIZE + 1, DHASH_SIZE), Image.BILINEAR)
+    pixels = list(img.getdata())
+    value = 0
+    for row in range(DHASH_SIZE):
+        offset = row * (DHASH_SIZE + 1)
+        for col in range(DHASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+def _safe_dhash(filepath):
+    try:
+        return dhash(filepath)
+    except Exception:
+        return None  # Format illisible : pas d'empreinte, le fichier reste orphelin
+
+def compute_perceptual_hashes(conn, label, progress_callback=None, abort_callback=None, workers=1):
+    """Étape optionnelle du scan : dHash des photos du label qui n'en ont pas.
+
+    Une empreinte est effacée (trigger) quand le fichier change de taille ou
+    de date : elle est alors recalculée au scan suivant.
+    """
+    photo_exts = sorted(media_tool.FILE_CATEGORIES['photo'])
+    candidates = conn.execute(f'''
+        SELECT f.id, f.path FROM file_paths f
+        WHERE f.source_id = ? AND f.is_ignored = 0
+        AND f.extension IN ({','.join('?' * len(photo_exts))})
+        AND NOT EXISTS (SELECT 1 FROM perceptual_hashes p WHERE p.file_id = f.id)
+    ''', [media_tool.source_id(conn, label)] + photo_exts).fetchall()
+    if not candidates:
+        return 0
+
+    print(f"\nEmpreintes perceptuelles : {len(candidates)} photos...")
+    done = 0
+    throttle = media_tool.ProgressThrottle()
+    sql = 'INSERT OR REPLACE INTO perceptual_hashes (file_id, dhash) VALUES (?, ?)'
+    with media_tool.IndexWriter(conn, sql) as writer, media_tool.HashPool(_safe_dhash, workers) as pool:
+        def collect(wait=False):
+            nonlocal done
+            for file_id, value in pool.results(wait):
+                if value is None:
+                    continue
+                writer.add((file_id, _to_signed(value)))
+                done += 1
+                if throttle.due():
+                    print(f"Empreintes perceptuelles : {done}/{len(candidates)}", end='\r')
+                    if progress_callback:
+                        progress_callback({
+                            "status": "scanning",
+                            "stage": "perceptual",
+                            "resolved": done,
+                            "to_resolve": len(candidates),
+                            "label": label
+                        })
+
+        for file_id, path_str in candidates:
+            if abort_callback and abort_callback():
+                break
+            try:
+                st = os.stat(path_str)
+            except OSError:
+                continue
+            pool.submit(path_str, st.st_dev, file_id)
+            collect()
+        collect(wait=True)
+    return done
+
+def _popcount(value):
+    return bin(value).count('1')
+
+def _neighbors(chunk, radius, bits):
+    """Toutes les valeurs à distance de Hamming <= radius d'un bloc."""
+    yield chunk
+    if radius >= 1:
+        for i in range(bits):
+            flipped = chunk ^ (1 << i)
+            yield flipped
+            if radius >= 2:
+                for j in range(i + 1, bits):
+                    yield flipped ^ (1 << j)
+
+class HammingIndex:
+    """Index multi-blocs (multi-index hashing) pour la recherche par distance de Hamming.
+
+    L'empreinte 64 bits est coupée en 4 blocs de 16 bits, chacun indexé dans
+    une table de hachage. Deux empreintes à distance <= d ont forcément un
+    bloc à distance <= d // 4 (principe des tiroirs) : on ne sonde que ces
+    voisins-là au lieu de comparer à toutes les empreintes.
+    """
+
+    def __init__(self, values):
+        self.bits = 64 // INDEX_CHUNKS
+        self.mask = (1 << self.bits) - 1
+        self.tables = [defaultdict(list) for _ in range(INDEX_CHUNKS)]
+        self.size = 0
+        for value in set(values):
+            self.size += 1
+            for i, table in enumerate(self.tables):
+                table[(value >> (i * self.bits)) & self.mask].append(value)
+
+    def has_within(self, value, distance):
+        """Vrai si une empreinte indexée est à distance <= ``distance``."""
+        if not 0 <= distance <= MAX_NEAR_DISTANCE:
+            raise ValueError(f"Distance hors limites (0 à {MAX_NEAR_DISTANCE}) : {distance}")
+        radius = distance // INDEX_CHUNKS
+        for i, table in enumerate(self.tables):
+            chunk = (value >> (i * self.bits)) & self.mask
+            for probe in _neighbors(chunk, radius, self.bits):
+                for candidate in table.get(probe, ()):
+                    if _popcount(candidate ^ value) <= distance:
+                        return True
+        return False
+
+# Index et résultats gardés en mémoire tant que les empreintes ne changent pas
+_index_cache = {}
+_matches_cache = {}
+_cache_lock = threading.Lock()
+
+def _signature(conn, label):
+    return conn.execute('''
+        SELECT COUNT(*), MAX(p.file_id), TOTAL(p.dhash) FROM perceptual_hashes p
+        JOIN files f ON f.id = p.file_id WHERE f.source_id = ?
+    ''', (media_tool.source_id(conn, label),)).fetchone()
+
+def _label_hashes(conn, label):
+    return conn.execute('''
+        SELECT p.file_id, p.dhash FROM perceptual_hashes p
+        JOIN files f ON f.id = p.file_id WHERE f.source_id = ?
+    ''', (media_tool.source_id(conn, label),))
+
+def _master_index(conn, master_label, signature):
+    with _cache_lock:
+        cached = _index_cache.get(master_label)
+        if cached and cached[0] == signature:
+            return cached[1]
+    index = HammingIndex(_to_unsigned(value) for _, value in _label_hashes(conn, master_label))
+    with _cache_lock:
+        _index_cache[master_label] = (signature, index)
+    return index
+
+def near_matches(conn, master_label, target_label, distance=DEFAULT_NEAR_DISTANCE):
+    """Ids des photos de target_label ayant une quasi-copie dans master_label
+    (distance de Hamming <= ``distance``).
+
+    Le résultat est mis en cache : les pages successives d'une même
+    recherche ne refont pas les sondages.
+    """
+    master_sig = _signature(conn, master_label)
+    target_sig = _signature(conn, target_label)
+    key = (master_label, target_label, distance)
+    with _cache_lock:
+        cached = _matches_cache.get(key)
+        if cached and cached[0] == (master_sig, target_sig):
+            return cached[1]
+
+    index = _master_index(conn, master_label, master_sig)
+    matched = set()
+    if index.size:
+        # Une seule recherche par empreinte distincte (rafales, copies exactes)
+        by_value = defaultdict(list)
+        for file_id, value in _label_hashes(conn, target_label):
+            by_value[value].append(file_id)
+        for value, ids in by_value.items():
+            if index.has_within(_to_unsigned(value), distance):
+                matched.update(ids)
+    with _cache_lock:
+        _matches_cache[key] = ((master_sig, target_sig), matched)
+    return matched
@@ -1,6 +1,6 @@
-from fastapi import FastAPI, HTTPException, Query, BackgroundTasks, Body
+from fastapi import FastAPI, HTTPException, Query, Body, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import sqlite3
 import os
@@ -10,92 +10,179 @@ from typing import List, Optional
 import uvicorn
 import threading
 import subprocess
-from collections import defaultdict
+from collections import defaultdict, deque
 import psutil
 import time
+import queue
+import asyncio
+from contextlib import asynccontextmanager
 
 # Import de notre logique existante (un peu hacky mais efficace)
 # On suppose que media_tool.py est dans le même dossier
 import sys
 sys.path.append(os.getcwd())
 import media_tool
+import metrics
+import thumbnails
+import perceptual
+import jobs
+import watcher
 
-app = FastAPI(title="Media Sorter GUI")
+# Connexions SQLite : schéma initialisé une fois, lectures en pool, un écrivain (voir media_tool.ConnectionPool)
+_db_pool = None
+_db_pool_lock = threading.Lock()
 
-# État global du scan
-scan_status = {
-    "is_scanning": False,
-    "stop_requested": False,
-    "progress": None,
-    "error": None
-}
+def db_pool():
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is None:
+            _db_pool = media_tool.ConnectionPool()
+        return _db_pool
+
+@asynccontextmanager
+async def lifespan(app):
+    global thumbnail_service
+    db_pool()  # Migrations au démarrage plutôt qu'à la première requête
+    thumbnail_service = thumbnails.ThumbnailService()
+    yield
+    thumbnail_service.close()
+    for watch in list(watchers.values()):
+        watch.stop()
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is not None:
+            _db_pool.close()
+            _db_pool = None
+
+app = FastAPI(title="Media Sorter GUI", lifespan=lifespan)
+
+# Scans : un job par demande, une file par disque physique (voir jobs.JobScheduler)
+scheduler = jobs.JobScheduler()
+
+def scan_summary(job_list):
+    """État agrégé des scans (format de /api/scan/status) et détail des jobs.
+
+    ``progress`` est celui du dernier job en cours (ou du dernier job) : le
+    statut porte l'état du job quand celui-ci n'est plus en cours de scan.
+    """
+    active = [j for j in job_list if j["state"] in jobs.ACTIVE_STATES]
+    current = next((j for j in reversed(active) if j["state"] != "queued"), None) or (job_list[-1] if job_list else None)
+    progress = None
+    if current:
+        progress = dict(current["progress"] or {})
+        if current["state"] != "running":
+            progress["status"] = current["state"]
+    return {
+        "is_scanning": bool(active),
+        "progress": progress,
+        "error": current["error"] if current else None,
+        "jobs": job_list
+    }
+
+class ProgressStream:
+    """Progression des scans diffusée à cadence fixe (Server-Sent Events).
+
+    Les threads de scan se contentent de remplacer la progression de leur job.
+    Le premier abonné qui se réveille échantillonne les jobs, calcule les
+    débits et sérialise l'événement ; les autres onglets reçoivent le même
+    événement sans travail supplémentaire.
+    """
+
+    def __init__(self, scheduler, interval=0.5, window=6):
+        self.scheduler = scheduler
+        self.interval = interval
+        self.window = window
+        self.seq = 0
+        self._event = None
+        self._sampled_at = 0.0
+        self._active = None
+        self._history = {}  # id du job -> (instant, fichiers, octets) pour les débits
+        self._lock = threading.Lock()
+
+    def _with_rates(self, job, now):
+        progress = job["progress"] = dict(job["progress"] or {})
+        history = self._history.setdefault(job["id"], deque(maxlen=self.window))
+        if job["state"] != "running":
+            history.clear()
+            return
+        files = progress.get("added", 0) + progress.get("skipped", 0) + progress.get("resolved", 0)
+        nbytes = progress.get("bytes", 0)
+        if history and files < history[-1][1]:
+            history.clear()  # Nouvelle étape du scan
+        history.append((now, files, nbytes))
+        if len(history) > 1:
+            t0, files0, bytes0 = history[0]
+            elapsed = now - t0
+            progress["files_per_sec"] = round((files - files0) / elapsed, 1)
+            progress["bytes_per_sec"] = round((nbytes - bytes0) / elapsed)
+
+    def sample(self):
+        """Renvoie (numéro, événement JSON) ; le numéro change avec le contenu."""
+        with self._lock:
+            now = time.monotonic()
+            job_list = [job.to_dict() for job in self.scheduler.jobs()]
+            active = tuple((j["id"], j["state"]) for j in job_list if j["state"] in jobs.ACTIVE_STATES)
+            # Un changement d'état (début, pause, fin) est diffusé sans attendre l'intervalle
+            if self._event is not None and active == self._active and now - self._sampled_at < self.interval:
+                return self.seq, self._event
+            self._sampled_at = now
+            self._active = active
+
+            for job in job_list:
+                self._with_rates(job, now)
+            known = {j["id"] for j in job_list}
+            for job_id in list(self._history):
+                if job_id not in known:
+                    del self._history[job_id]
+
+            event = json.dumps(scan_summary(job_list))
+            if event != self._event:
+                self._event = event
+                self.seq += 1
+            return self.seq, self._event
+
+# Suivis continus (inotify) : un thread par dossier suivi, hors des files de scan
+watchers = {}
+
+# Miniatures (cache disque + pré-génération en tâche de fond), créées au démarrage (lifespan)
+thumbnail_service = None
+progress_stream = ProgressStream(scheduler)
 
 # ... (rest of imports)
 
-def get_db():
-    return media_tool.init_db()
+def read_db():
+    """Connexion en lecture seule empruntée au pool (``with read_db() as conn``)."""
+    return db_pool().reader()
 
-def run_scan_background(path, label, update, include_list=None):
-    global scan_status
-    scan_status["is_scanning"] = True
-    scan_status["stop_requested"] = False
-    scan_status["progress"] = {"status": "starting", "added": 0, "skipped": 0}
-    scan_status["error"] = None
-    
-    conn = get_db()
-    
-    def progress_cb(data):
-        # Inject debug info into progress data
-        if "debug_raw_include" in scan_status:
-            data["debug_raw_include"] = scan_status["debug_raw_include"]
-        scan_status["progress"] = data
-        
-    def abort_cb():
-        return scan_status["stop_requested"]
-        
-    try:
-        print(f"DEBUG: Starting scan for {path} with label {label}")
-        media_tool.scan_directory(
-            conn, 
-            path, 
-            label, 
-            min_size=10*1024, 
-            exclude_ext=media_tool.DEFAULT_EXCLUDE_EXT, 
-            update_mode=update,
-            progress_callback=progress_cb,
-            abort_callback=abort_cb,
-            include_ext=include_list
-        )
-        print("DEBUG: Scan function returned")
-        if scan_status["stop_requested"]:
-            print("DEBUG: Scan stopped by user")
-            scan_status["progress"]["status"] = "stopped"
-        else:
-            print("DEBUG: Scan finished successfully")
-            scan_status["progress"]["status"] = "finished"
-    except Exception as e:
-        print(f"DEBUG: Scan error: {e}")
-        import traceback
-        traceback.print_exc()
-        scan_status["error"] = str(e)
-        scan_status["progress"]["status"] = "error"
-    finally:
-        conn.close()
-        scan_status["is_scanning"] = False
+def write_db(timeout=-1):
+    """Connexion d'écriture partagée, pour les écritures courtes (None si occupée au-delà de ``timeout``)."""
+    return db_pool().writer(timeout)
 
+def orphan_cache(master, target, include_list, exclude_list):
+    """Id du cache d'orphelins de la recherche, sans jamais attendre un écrivain.
 
-@app.post("/api/scan/stop")
-def stop_scan():
-    """Demande l'arrêt du scan en cours."""
-    global scan_status
-    if scan_status["is_scanning"]:
-        scan_status["stop_requested"] = True
-        return {"message": "Arrêt demandé..."}
-    return {"message": "Aucun scan en cours"}
+    Un cache à jour est servi tel quel (lecture seule). Sinon il est mis à
+    jour par delta si le verrou d'écriture se libère en ORPHAN_LOCK_TIMEOUT ;
+    à défaut (scan, copie ou suivi en cours), None : la requête se rabat sur
+    l'anti-jointure directe, sur une connexion du pool de lecture.
+    """
+    with read_db() as conn:
+        cache_id = media_tool.current_orphan_cache(conn, master, target, include_list, exclude_list)
+    if cache_id is not None:
+        return cache_id
+    with write_db(media_tool.ORPHAN_LOCK_TIMEOUT) as conn:
+        if conn is None:
+            return None
+        return media_tool.refresh_orphan_cache(conn, master, target, include_list, exclude_list,
+                                               lock_timeout=media_tool.ORPHAN_LOCK_TIMEOUT)
+
+def task_db():
+    """Connexion propre à une opération longue (copie, corbeille) : l'écrivain partagé reste libre."""
+    db_pool()
+    return media_tool.connect()
 
-@app.get("/api/scan/status")
 def get_scan_status():
-    return scan_status
+    return scan_summary([job.to_dict() for job in scheduler.jobs()])
 
 @app.get("/")
 async def read_root():
@@ -107,11 +194,8 @@ async def read_root():
 
 @app.get("/api/sources")
 def get_sources():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT DISTINCT source_label FROM files ORDER BY source_label")
-    sources = [row[0] for row in cursor.fetchall()]
-    conn.close()
+    with read_db() as conn:
+        sources = media_tool.source_labels(conn)
     return {"sources": sources}
 
 @app.get("/api/drives")
@@ -193,79 +277,201 @@ def browse_directory(path: str):
         return {"error": str(e)}
 
 @app.post("/api/scan")
-def start_scan(background_tasks: BackgroundTasks, path: str = Query(...), label: str = Query(...), update: bool = Query(False), include: Optional[str] = Query(None)):
-    """Lance un scan en arrière-plan."""
-    if scan_status["is_scanning"]:
-        return {"error": "Un scan est déjà en cours"}
-    
-    scan_status["is_scanning"] = True
-    scan_status["progress"] = {"total": 0, "processed": 0, "current_file": "", "status": "starting"}
-    scan_status["stop_requested"] = False # Reset stop flag
+def start_scan(path: str = Query(...), label: str = Query(...), update: bool = Query(False), include: Optional[str] = Query(None), staged: bool = Query(False), workers: int = Query(1, ge=1, le=64), hash_algo: Optional[str] = Query(None), perceptual: bool = Query(False), profile: bool = Query(False), include_system: bool = Query(False), rehash: bool = Query(False)):
+    """Met un scan en file : il démarre dès que son disque est libre (sous cProfile avec ``profile``)."""
+    if hash_algo and hash_algo not in media_tool.HASH_ALGORITHMS:
+        return {"error": f"Algorithme de hash inconnu : {hash_algo}"}
     
     # Parse include list
     include_list = include.split(',') if include else None
-    
-    # Store debug info in scan_status for UI display
-    scan_status["debug_include"] = include_list
-    scan_status["debug_raw_include"] = include
-    
-    background_tasks.add_task(run_scan_background, path, label, update, include_list)
-    return {"message": "Scan démarré", "label": label}
+
+    db_pool()  # Le job ouvre sa propre connexion sur le schéma initialisé
+    try:
+        job = scheduler.submit(
+            path,
+            label,
+            profile=profile,
+            min_size=10*1024,
+            exclude_ext=media_tool.DEFAULT_EXCLUDE_EXT,
+            update_mode=update,
+            rehash=rehash,
+            include_ext=include_list,
+            staged=staged,
+            workers=workers,
+            skip_system=not include_system,
+            hash_algo=hash_algo,
+            perceptual=perceptual
+        )
+    except OSError as e:
+        return {"error": f"Chemin inaccessible : {e}"}
+    return {"message": "Scan démarré", "label": label, "job_id": job.id, "device": job.device}
 
 @app.post("/api/scan/stop")
 def stop_scan():
-    """Demande l'arrêt du scan en cours."""
-    if not scan_status["is_scanning"]:
+    """Demande l'arrêt de tous les scans en cours ou en file."""
+    active = scheduler.active()
+    if not active:
         return {"error": "Aucun scan en cours"}
-    
-    scan_status["stop_requested"] = True
+    for job in active:
+        scheduler.cancel(job.id)
     return {"message": "Arrêt du scan demandé..."}
 
+@app.get("/api/jobs")
+def list_jobs():
+    return {"jobs": [job.to_dict() for job in scheduler.jobs()]}
+
+def _job_or_404(job):
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job introuvable")
+    return job.to_dict()
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: int):
+    return _job_or_404(scheduler.get(job_id))
+
+@app.get("/api/jobs/{job_id}/profile", response_class=PlainTextResponse)
+def get_job_profile(job_id: int):
+    """Rapport cProfile d'un scan lancé avec ``profile``, une fois terminé."""
+    job = scheduler.get(job_id)
+    _job_or_404(job)
+    if not job.profile_report:
+        raise HTTPException(status_code=404, detail="Aucun profil pour ce job (option profile, scan terminé)")
+    return job.profile_report
+
+@app.post("/api/jobs/{job_id}/pause")
+def pause_job(job_id: int):
+    return _job_or_404(scheduler.pause(job_id))
+
+@app.post("/api/jobs/{job_id}/resume")
+def resume_job(job_id: int):
+    return _job_or_404(scheduler.resume(job_id))
+
+@app.post("/api/jobs/{job_id}/cancel")
+def cancel_job(job_id: int):
+    return _job_or_404(scheduler.cancel(job_id))
+
+@app.post("/api/watch")
+def start_watch(path: str = Query(...), label: str = Query(...), workers: int = Query(1, ge=1, le=64),
+                initial_scan: bool = Query(False), include_system: bool = Query(False)):
+    """Suit un dossier : l'index du label est tenu à jour au fil des événements du noyau."""
+    db_pool()
+    for watch in watchers.values():
+        if watch.alive and watch.label == label and watch.root == str(Path(path).resolve()):
+            return watch.to_dict()
+    try:
+        watch = watcher.Watcher(path, label, exclude_ext=media_tool.DEFAULT_EXCLUDE_EXT, workers=workers,
+                                skip_system=not include_system, initial_scan=initial_scan).start()
+    except OSError as e:
+        return {"error": f"Suivi impossible : {e}"}
+    watchers[watch.id] = watch
+    stopped = [w for w in watchers.values() if not w.alive]
+    for old in stopped[:-watcher.MAX_STOPPED_WATCHERS]:
+        del watchers[old.id]
+    return watch.to_dict()
+
+@app.get("/api/watches")
+def list_watches():
+    return {"watches": [watch.to_dict() for watch in watchers.values()]}
+
+@app.post("/api/watches/{watch_id}/stop")
+def stop_watch(watch_id: int):
+    watch = watchers.get(watch_id)
+    if watch is None:
+        raise HTTPException(status_code=404, detail="Suivi inconnu")
+    watch.stop()
+    watch.join(5)
+    return watch.to_dict()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Métriques au format texte Prometheus (scan, hachage, écritures, orphelins, copies)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/api/scan/status")
 def get_status():
     return get_scan_status()
 
+@app.get("/api/scan/events")
+async def scan_events(request: Request):
+    """Flux SSE de la progression du scan (un événement par changement, à cadence fixe)."""
+    async def stream():
+        seq = None
+        idle = 0.0
+        while not await request.is_disconnected():
+            current, event = progress_stream.sample()
+            if current != seq:
+                seq = current
+                idle = 0.0
+                yield f"data: {event}\n\n"
+            elif idle >= 15:
+                idle = 0.0
+                yield ": keepalive\n\n"  # Garde la connexion ouverte derrière un proxy
+            await asyncio.sleep(progress_stream.interval)
+            idle += progress_stream.interval
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/api/settings")
+def get_settings():
+    with read_db() as conn:
+        hash_algo = media_tool.get_hash_algo(conn)
+    return {"hash_algo": hash_algo, "hash_algorithms": sorted(media_tool.HASH_ALGORITHMS)}
+
+@app.post("/api/settings")
+def update_settings(hash_algo: str = Query(...)):
+    """Change l'algorithme de hash par défaut (migration des anciens hashs à la demande)."""
+    try:
+        with write_db() as conn:
+            media_tool.set_hash_algo(conn, hash_algo)
+    except ValueError as e:
+        return {"error": str(e)}
+    return get_settings()
+
 @app.get("/api/orphans")
-def get_orphans(master: str, target: str, include: Optional[str] = None, exclude: Optional[str] = None):
-    """Récupère les orphelins groupés par dossier parent, filtrés par extensions."""
-    conn = get_db()
-    
+def get_orphans(master: str, target: str, include: Optional[str] = None, exclude: Optional[str] = None,
+                near: Optional[int] = Query(None, ge=0, le=perceptual.MAX_NEAR_DISTANCE)):
+    """Récupère les orphelins groupés par dossier parent, filtrés par extensions.
+
+    ``near`` : les photos ayant une quasi-copie dans le maître (distance perceptuelle <= near) sont écartées.
+    """
     # Parsing des listes d'extensions (comma separated)
     include_list = include.split(',') if include else None
     exclude_list = exclude.split(',') if exclude else None
-    
-    # Appel à media_tool avec les nouveaux filtres
-    orphans = media_tool.find_orphans(
-        conn, 
-        master, 
-        target, 
-        list_files=False, 
-        include_ext=include_list, 
-        exclude_ext=exclude_list
-    )
-    conn.close()
 
     grouped = defaultdict(list)
     count = 0
     total_size = 0
-    
-    for o in orphans:
-        # media_tool retourne (path, filename, size, hash)
-        path_str = o[0]
-        filename = o[1]
-        size_bytes = o[2]
-            
-        p = Path(path_str)
-        parent = str(p.parent)
-        
-        item = {
-            "path": path_str,
-            "name": filename,
-            "size": size_bytes
-        }
-        grouped[parent].append(item)
-        count += 1
-        total_size += size_bytes
+
+    cache_id = orphan_cache(master, target, include_list, exclude_list)
+    with read_db() as conn:
+        # Anti-jointure filtrée en SQL, lue au fil du curseur
+        orphans = media_tool.iter_orphans(
+            conn,
+            master,
+            target,
+            include_ext=include_list,
+            exclude_ext=exclude_list,
+            near_distance=near,
+            cache_id=cache_id
+        )
+
+        for o in orphans:
+            # media_tool retourne (path, filename, size, hash)
+            path_str = o[0]
+            filename = o[1]
+            size_bytes = o[2]
+
+            p = Path(path_str)
+            parent = str(p.parent)
+
+            item = {
+                "path": path_str,
+                "name": filename,
+                "size": size_bytes
+            }
+            grouped[parent].append(item)
+            count += 1
+            total_size += size_bytes
 
     # Conversion en liste pour le JSON
     result = []
@@ -287,6 +493,93 @@ def get_orphans(master: str, target: str, include: Optional[str] = None, exclude
         "folders": result
     }
 
+@app.get("/api/orphans/folders")
+def get_orphan_folders(master: str, target: str, include: Optional[str] = None, exclude: Optional[str] = None,
+                       near: Optional[int] = Query(None, ge=0, le=perceptual.MAX_NEAR_DISTANCE)):
+    """Résumé des orphelins par dossier (nombre et volume), calculé en SQL, sans les fichiers."""
+    include_list = include.split(',') if include else None
+    exclude_list = exclude.split(',') if exclude else None
+
+    cache_id = orphan_cache(master, target, include_list, exclude_list)
+    with read_db() as conn:
+        rows = media_tool.orphan_folders(conn, master, target, include_list, exclude_list, near, cache_id=cache_id)
+
+    # Pré-génération des miniatures de ce résultat (remplace la série précédente).
+    # Connexion propre au thread : la série peut durer, elle n'occupe pas le pool.
+    def orphan_thumbnails():
+        thumb_conn = media_tool.connect(readonly=True)
+        try:
+            for path_str, _, _, file_hash in media_tool.iter_orphans(thumb_conn, master, target, include_list, exclude_list, near,
+                                                                     cache_id=cache_id):
+                yield path_str, file_hash
+        finally:
+            thumb_conn.close()
+    thumbnail_service.prefetch(orphan_thumbnails)
+
+    folders = [{"path": path, "count": count, "size": size} for path, count, size in rows]
+    total_size = sum(f["size"] for f in folders)
+    return {
+        "summary": {
+            "total_files": sum(f["count"] for f in folders),
+            "total_size_mb": round(total_size / (1024*1024), 2)
+        },
+        "folders": folders
+    }
+
+def parse_page_cursor(cursor, sort):
+    """Curseur de /api/orphans/files : [nom ou taille selon ``sort``, id], sinon erreur 400."""
+    try:
+        after = json.loads(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Curseur invalide")
+    value_type = str if sort == "name" else int
+    if (not isinstance(after, list) or len(after) != 2
+            or not isinstance(after[0], value_type) or isinstance(after[0], bool)
+            or not isinstance(after[1], int) or isinstance(after[1], bool)):
+        raise HTTPException(status_code=400, detail="Curseur invalide")
+    return after
+
+@app.get("/api/orphans/files")
+def get_orphan_files(master: str, target: str, folder: str, include: Optional[str] = None, exclude: Optional[str] = None,
+                     sort: str = Query("name", pattern="^(name|size)$"), order: str = Query("asc", pattern="^(asc|desc)$"),
+                     cursor: Optional[str] = None, limit: int = Query(200, ge=1, le=1000),
+                     near: Optional[int] = Query(None, ge=0, le=perceptual.MAX_NEAR_DISTANCE)):
+    """Fichiers orphelins d'un dossier, page par page (curseur opaque renvoyé dans next_cursor)."""
+    include_list = include.split(',') if include else None
+    exclude_list = exclude.split(',') if exclude else None
+    after = parse_page_cursor(cursor, sort) if cursor else None
+
+    cache_id = orphan_cache(master, target, include_list, exclude_list)
+    with read_db() as conn:
+        rows, next_cursor = media_tool.orphan_files_page(
+            conn, master, target, folder, include_list, exclude_list,
+            sort=sort, descending=(order == "desc"), after=after, limit=limit, near_distance=near, cache_id=cache_id
+        )
+
+    return {
+        "files": [{"path": path, "name": filename, "size": size} for _, path, filename, size, _ in rows],
+        "next_cursor": json.dumps(next_cursor) if next_cursor else None
+    }
+
+@app.get("/api/duplicates")
+def get_duplicates(labels: str, limit: int = Query(100, ge=1, le=1000), offset: int = Query(0, ge=0)):
+    """Doublons internes des labels (séparés par des virgules), par place récupérable décroissante."""
+    label_list = [label for label in labels.split(',') if label]
+    with read_db() as conn:
+        summary = media_tool.duplicate_summary(conn, label_list)
+        groups = media_tool.duplicate_groups(conn, label_list, limit=limit, offset=offset)
+    for group in groups:
+        group["hash"] = group["hash"].hex()  # Stocké en binaire
+
+    return {
+        "summary": {
+            label: {"groups": count, "extra_files": extra, "reclaimable_mb": round(reclaimable / (1024*1024), 2)}
+            for label, (count, extra, reclaimable) in summary.items()
+        },
+        "groups": groups,
+        "next_offset": offset + limit if len(groups) == limit else None
+    }
+
 @app.get("/api/image")
 def get_image(path: str):
     """Sert l'image locale. Attention sécurité en prod, mais OK en local."""
@@ -294,13 +587,32 @@ def get_image(path: str):
         raise HTTPException(status_code=404, detail="Image not found")
     return FileResponse(path)
 
+@app.get("/api/thumb")
+def get_thumbnail(path: str, size: int = Query(thumbnails.THUMB_SIZE, ge=32, le=1024)):
+    """Sert une miniature JPEG (cache disque adressé par le hash indexé)."""
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    # Le hash indexé n'est valable que si le fichier n'a pas changé depuis le scan
+    with read_db() as conn:
+        key = media_tool.PathIndex(conn).find(path)
+        row = key and conn.execute("SELECT hash FROM files WHERE dir_id = ? AND filename = ? AND mtime = ? AND hash IS NOT NULL",
+                                   key + (mtime,)).fetchone()
+
+    try:
+        thumb = thumbnail_service.get(path, row[0] if row else None, size)
+    except Exception as e:
+        raise HTTPException(status_code=415, detail=f"Thumbnail unavailable: {e}")
+    return FileResponse(thumb, media_type="image/jpeg", headers={"Cache-Control": "max-age=86400"})
+
 @app.post("/api/source/delete")
 async def delete_source_endpoint(label: str):
     """Supprime une source de la base de données."""
     try:
-        conn = get_db()
-        count = media_tool.delete_source(conn, label)
-        conn.close()
+        with write_db() as conn:
+            count = media_tool.delete_source(conn, label)
         return {"deleted": count, "label": label}
     except Exception as e:
         return {"error": str(e)}
@@ -309,146 +621,23 @@ async def delete_source_endpoint(label: str):
 async def rename_source_endpoint(old_label: str, new_label: str):
     """Renomme une source dans la base de données."""
     try:
-        conn = get_db()
-        count = media_tool.rename_source(conn, old_label, new_label)
-        conn.close()
+        with write_db() as conn:
+            count = media_tool.rename_source(conn, old_label, new_label)
         return {"updated": count, "old_label": old_label, "new_label": new_label}
     except Exception as e:
         return {"error": str(e)}
 
 @app.post("/api/copy")
-def copy_files(files: List[str], dest: str, move: bool = False):
+def copy_files(files: List[str], dest: str, move: bool = False, workers: int = Query(media_tool.COPY_WORKERS, ge=1, le=32)):
     """Copie (ou déplace) une liste de fichiers vers la destination.
     
-    Avec vérification de hash et mise à jour automatique de la base de données.
+    Avec vérification de hash (calculé pendant la copie) et mise à jour automatique de la base de données.
     """
-    import shutil
-    from datetime import datetime
-    
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    dest_path = Path(dest)
-    dest_path.mkdir(parents=True, exist_ok=True)
-    
-    # Statistics
-    copied = 0
-    errors = 0
-    verification_failed = 0
-    db_updated = 0
-    
-    for file_path in files:
-        try:
-            src = Path(file_path)
-            
-            # 1. Get source file info from database (hash + metadata)
-            cursor.execute("""
-                SELECT hash, source_label, filename, extension, size_bytes, mtime 
-                FROM files 
-                WHERE path = ?
-            """, (str(src),))
-            source_info = cursor.fetchone()
-            
-            if not source_info:
-                print(f"Warning: {file_path} not found in database, skipping DB update")
-                source_hash = None
-            else:
-                source_hash, source_label, filename, extension, size_bytes, mtime = source_info
-            
-            # 2. Prepare destination path (use provided path directly, no extension sorting)
-            dest_path_obj = Path(dest)
-            dest_path_obj.mkdir(parents=True, exist_ok=True)
-            
-            target_file = dest_path_obj / src.name
-            
-            # Handle name collision
-            if target_file.exists():
-                stem = target_file.stem
-                suffix = target_file.suffix
-                counter = 1
-                while target_file.exists():
-                    target_file = target_dir / f"{stem}_{counter}{suffix}"
-                    counter += 1
-            
-            # 3. Copy file
-            shutil.copy2(src, target_file)
-            
-            # 4. Verify integrity by hashing destination file
-            if source_hash:
-                dest_hash = media_tool.get_file_hash(str(target_file))
-                
-                if dest_hash != source_hash:
-                    verification_failed += 1
-                    print(f"ERROR: Hash mismatch for {target_file}")
-                    print(f"  Source: {source_hash}")
-                    print(f"  Dest:   {dest_hash}")
-                    # Delete corrupted copy
-                    target_file.unlink()
-                    continue
-            else:
-                # No source hash available, hash the destination anyway for DB
-                dest_hash = media_tool.get_file_hash(str(target_file))
-            
-            # 5. Add to database (auto-detect label from destination path)
-            # Try to find which source_label corresponds to the destination
-            # For now, we'll need user to provide destination label or infer from path
-            # Simple heuristic: try to find best match or use a generic label
-            
-            # Let's infer the dest_label from the destination path
-            # Check if dest path corresponds to any known source
-            cursor.execute("SELECT DISTINCT source_label FROM files")
-            known_labels = [row[0] for row in cursor.fetchall()]
-            
-            # Try to match destination path to a known source
-            dest_label = None
-            for label in known_labels:
-                if str(dest_path) in label or label in str(dest_path):
-                    dest_label = label
-                    break
-            
-            if not dest_label:
-                # Use generic label based on destination path
-                dest_label = f"dest_{dest_path.name}"
-            
-            # Insert into database
-            cursor.execute("""
-                INSERT OR REPLACE INTO files 
-                (path, filename, extension, size_bytes, mtime, hash, source_label, scan_date)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                str(target_file),
-                target_file.name,
-                target_file.suffix.lstrip('.'),
-                target_file.stat().st_size,
-                target_file.stat().st_mtime,
-                dest_hash,
-                dest_label,
-                datetime.now().isoformat()
-            ))
-            
-            copied += 1
-            db_updated += 1
-            
-            # 6. If move mode, delete source and remove from DB
-            if move:
-                os.remove(src)
-                cursor.execute("DELETE FROM files WHERE path = ?", (str(src),))
-                
-        except Exception as e:
-            print(f"Error copying {file_path}: {e}")
-            import traceback
-            traceback.print_exc()
-            errors += 1
-    
-    conn.commit()
-    conn.close()
-    
-    return {
-        "copied": copied,
-        "errors": errors,
-        "verification_failed": verification_failed,
-        "db_updated": db_updated
-    }
+    conn = task_db()
+    try:
+        return media_tool.copy_indexed_files(conn, files, dest, move=move, workers=workers)
+    finally:
+        conn.close()
 
 @app.post("/api/open")
 def open_file(path: str = Query(...)):
@@ -482,64 +671,38 @@ def shutdown():
     return {"message": "Server shutting down..."}
 
 @app.post("/api/delete")
-async def delete_files(files: List[str] = Body(...)):
-    """Envoie une liste de fichiers à la corbeille (ou supprime si impossible)."""
-    import subprocess
-    import platform
-    
-    deleted_count = 0
-    errors = []
-    
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    for file_path in files:
+def delete_files(files: List[str] = Body(...), stream: bool = Query(False)):
+    """Envoie une liste de fichiers à la corbeille (ou supprime si impossible).
+
+    Avec ``stream``, la réponse est en JSON lines : la progression
+    ({"done", "total"}) puis le résultat final.
+    """
+    def run(progress_callback=None):
+        conn = task_db()
         try:
-            if os.path.exists(file_path):
-                if os.path.isfile(file_path):
-                    # Try to use trash first
-                    trashed = False
-                    if platform.system() == 'Linux':
-                        try:
-                            # Use gio trash (standard on modern Linux distros like Fedora/Nobara/Ubuntu)
-                            subprocess.run(['gio', 'trash', file_path], check=True, capture_output=True)
-                            trashed = True
-                        except Exception:
-                            pass
-                            
-                    if not trashed:
-                        # Fallback to permanent delete if trash fails or not on Linux
-                        # But maybe we should warn? For now, let's assume if gio fails we might want to keep it or force delete?
-                        # User asked for trash. If trash fails, we should probably error out or try os.remove if they really want delete.
-                        # Let's try os.remove as fallback but maybe log it.
-                        os.remove(file_path)
-                    
-                    # Remove from DB if successful
-                    try:
-                        cursor.execute("DELETE FROM files WHERE path = ?", (file_path,))
-                        conn.commit()
-                    except Exception as e:
-                        print(f"Error removing from DB {file_path}: {e}")
-                        
-                    deleted_count += 1
-                else:
-                    errors.append(f"Not a file: {file_path}")
-            else:
-                # File doesn't exist on disk, but we should remove it from DB to clean up
-                try:
-                    cursor.execute("DELETE FROM files WHERE path = ?", (file_path,))
-                    conn.commit()
-                    deleted_count += 1 # Count as deleted/cleaned
-                except Exception as e:
-                    print(f"Error removing from DB {file_path}: {e}")
-                
-                # Still warn user but consider it "handled"
-                errors.append(f"Not found (removed from DB): {file_path}")
-        except Exception as e:
-            errors.append(f"Error processing {file_path}: {str(e)}")
-            
-    return {"deleted_count": deleted_count, "errors": errors}
+            deleted_count, errors = media_tool.trash_files(conn, files, progress_callback=progress_callback)
+        finally:
+            conn.close()
+        return {"status": "finished", "deleted_count": deleted_count, "errors": errors}
+
+    if not stream:
+        return run()
+
+    def events():
+        updates = queue.Queue()
+        def worker():
+            try:
+                updates.put(run(updates.put))
+            except Exception as e:
+                updates.put({"status": "error", "deleted_count": 0, "errors": [str(e)]})
+        threading.Thread(target=worker, daemon=True).start()
+        while True:
+            update = updates.get()
+            yield json.dumps(update) + "\n"
+            if update["status"] != "deleting":
+                return
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
 
 if __name__ == "__main__":
-    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
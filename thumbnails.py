@@ -0,0 +1,214 @@
+import os
+import io
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+try:
+    # Support HEIC/HEIF optionnel
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:
+    pass
+
+# Configuration par défaut
+THUMB_CACHE_DIR = ".thumb_cache"
+THUMB_CACHE_MAX_BYTES = 512 * 1024 * 1024  # 512 MB
+THUMB_SIZE = 256
+THUMB_QUALITY = 80
+PREVIEW_SCAN_BYTES = 8 * 1024 * 1024  # Zone lue pour trouver un aperçu JPEG embarqué (RAW)
+
+# Extensions pour lesquelles on tente une miniature
+THUMB_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.tif', '.webp', '.heic', '.heif',
+                    '.raw', '.cr2', '.cr3', '.nef', '.arw', '.dng', '.orf', '.rw2', '.pef', '.raf'}
+
+def _embedded_preview(filepath, size):
+    """Cherche un aperçu JPEG embarqué (RAW, TIFF) au moins aussi grand que ``size``.
+
+    Les RAW contiennent presque tous un ou plusieurs JPEG d'aperçu : on
+    garde le plus petit qui suffit, décodé en mode draft.
+    """
+    with open(filepath, 'rb') as f:
+        data = f.read(PREVIEW_SCAN_BYTES)
+    best = None
+    pos = data.find(b'\xff\xd8\xff', 1)
+    tries = 0
+    while pos != -1 and tries < 20:
+        tries += 1
+        try:
+            img = Image.open(io.BytesIO(data[pos:]))
+            if img.format == 'JPEG' and min(img.size) >= size:
+                if best is None or img.size[0] < best.size[0]:
+                    best = img
+        except Exception:
+            pass
+        pos = data.find(b'\xff\xd8\xff', pos + 3)
+    return best
+
+def open_image(filepath, size):
+    """Ouvre une image pour un affichage réduit à ``size`` pixels.
+
+    Les JPEG sont décodés en mode ``draft`` (réduction à la décompression) ;
+    les RAW passent par leur aperçu embarqué quand Pillow ne sait pas les lire.
+    """
+    ext = os.path.splitext(filepath)[1].lower()
+    img = None
+    if ext not in {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.heic', '.heif'}:
+        img = _embedded_preview(filepath, size)
+    if img is None:
+        img = Image.open(filepath)
+    img.draft('RGB', (size, size))
+    return ImageOps.exif_transpose(img)
+
+def make_thumbnail(filepath, dest, size=THUMB_SIZE):
+    """Écrit une miniature JPEG de ``filepath`` dans ``dest``."""
+    img = open_image(filepath, size)
+    img.thumbnail((size, size))
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    # Écriture atomique : un lecteur ne voit jamais de miniature tronquée
+    tmp = f"{dest}.{threading.get_ident()}.tmp"
+    img.save(tmp, 'JPEG', quality=THUMB_QUALITY)
+    os.replace(tmp, dest)
+
+class ThumbnailCache:
+    """Cache disque adressé par contenu (hash indexé), borné en taille (LRU).
+
+    La date de modification d'une miniature sert de date de dernier accès :
+    elle est rafraîchie à chaque lecture, les plus anciennes sont évincées
+    quand le cache dépasse ``max_bytes``.
+    """
+
+    def __init__(self, root=THUMB_CACHE_DIR, max_bytes=THUMB_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._total = sum(e.stat().st_size for e in self._entries())
+
+    def _entries(self):
+        for sub in os.scandir(self.root):
+            if sub.is_dir():
+                for entry in os.scandir(sub.path):
+                    if entry.name.endswith('.jpg'):
+                        yield entry
+
+    def path_for(self, key, size):
+        return os.path.join(self.root, key[:2], f"{key}_{size}.jpg")
+
+    def get(self, key, size):
+        path = self.path_for(key, size)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def put(self, key, size, filepath):
+        """Génère et stocke la miniature, renvoie son chemin."""
+        path = self.path_for(key, size)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        make_thumbnail(filepath, path, size)
+        with self._lock:
+            self._total += os.path.getsize(path)
+            if self._total > self.max_bytes:
+                self._evict()
+        return path
+
+    def _evict(self):
+        # On redescend à 90 % de la limite pour ne pas évincer à chaque ajout
+        entries = sorted(self._entries(), key=lambda e: e.stat().st_mtime)
+        target = self.max_bytes * 0.9
+        for entry in entries:
+            if self._total <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self._total -= size
+            except OSError:
+                pass
+
+class ThumbnailService:
+    """Miniatures à la demande et pré-génération en tâche de fond.
+
+    ``prefetch`` remplace la série en cours : une nouvelle recherche
+    d'orphelins annule la pré-génération de la précédente. ``close`` arrête
+    la série et le pool (arrêt du serveur).
+    """
+
+    def __init__(self, cache=None, workers=2):
+        self.cache = cache or ThumbnailCache()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumb')
+        self._slots = threading.BoundedSemaphore(workers * 4)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()  # Protège _generation (requêtes, threads de pré-génération)
+        self._generation = 0
+
+    def _current(self, generation):
+        with self._lock:
+            return generation == self._generation and not self._stop.is_set()
+
+    @staticmethod
+    def cache_key(filepath, file_hash):
+        """Le hash indexé (en hexadécimal) ; à défaut (scan staged), chemin + taille + date."""
+        if file_hash:
+            return file_hash.hex()
+        st = os.stat(filepath)
+        ident = f"{filepath}|{st.st_size}|{st.st_mtime}".encode()
+        return hashlib.blake2b(ident, digest_size=16).hexdigest()
+
+    def get(self, filepath, file_hash, size=THUMB_SIZE):
+        """Chemin de la miniature (générée sur place si absente du cache)."""
+        key = self.cache_key(filepath, file_hash)
+        return self.cache.get(key, size) or self.cache.put(key, size, filepath)
+
+    def _generate(self, generation, filepath, file_hash, size):
+        try:
+            if self._current(generation):
+                self.get(filepath, file_hash, size)
+        except Exception:
+            pass  # Fichier illisible ou format non géré : pas de miniature
+        finally:
+            self._slots.release()
+
+    def prefetch(self, items_factory, size=THUMB_SIZE):
+        """Pré-génère les miniatures de ``items_factory()`` ((path, hash)...).
+
+        L'itération se fait dans un thread dédié (la fabrique peut ouvrir sa
+        propre connexion SQLite) ; la file d'attente reste bornée.
+        """
+        with self._lock:
+            if self._stop.is_set():
+                return
+            self._generation += 1
+            generation = self._generation
+
+        def feed():
+            for filepath, file_hash in items_factory():
+                if os.path.splitext(filepath)[1].lower() not in THUMB_EXTENSIONS:
+                    continue
+                # Attente d'une place par paliers : une série remplacée ou un arrêt ne reste pas bloqué
+                while not self._slots.acquire(timeout=0.5):
+                    if not self._current(generation):
+                        return
+                if not self._current(generation):
+                    self._slots.release()
+                    return
+                try:
+                    self._executor.submit(self._generate, generation, filepath, file_hash, size)
+                except RuntimeError:
+                    self._slots.release()  # Pool arrêté entre-temps
+                    return
+
+        threading.Thread(target=feed, name='thumb-prefetch', daemon=True).start()
+
+    def close(self):
+        """Arrête la pré-génération : la série en cours s'interrompt, les tâches en attente sont annulées."""
+        with self._lock:
+            self._stop.set()
+            self._generation += 1
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,486 @@
+import os
+import sys
+import stat
+import errno
+import struct
+import select
+import ctypes
+import ctypes.util
+import itertools
+import json
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import media_tool
+import metrics
+
+# Événements inotify (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_ONLYDIR)
+
+DEBOUNCE_SECONDS = 2.0  # Calme exigé sur un chemin avant de le (re)hacher
+EVENT_BUFFER_SIZE = 64 * 1024
+MAX_STOPPED_WATCHERS = 20  # Suivis arrêtés conservés pour consultation (serveur)
+
+_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len (suivi du nom)
+_libc = None
+
+def _inotify_libc():
+    global _libc
+    if _libc is None:
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, "Le mode watch utilise inotify (Linux uniquement)")
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        _libc = libc
+    return _libc
+
+def _errno_error(path=None):
+    err = ctypes.get_errno()
+    return OSError(err, os.strerror(err), path)
+
+class Inotify:
+    """Accès minimal à inotify par ctypes : une instance, ses watches, ses événements."""
+
+    def __init__(self):
+        self._libc = _inotify_libc()
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise _errno_error()
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise _errno_error(path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._libc.inotify_rm_watch(self.fd, wd)  # Échec sans gravité : dossier déjà disparu
+
+    def read(self, timeout):
+        """Événements (wd, mask, cookie, nom) arrivés dans les ``timeout`` secondes."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, EVENT_BUFFER_SIZE)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class Watcher:
+    """Indexation continue d'un label : les événements inotify sous la racine
+    remplacent le parcours complet de ``scan --update``.
+
+    Les événements sont regroupés par chemin et appliqués quand le chemin
+    est resté calme ``debounce`` secondes : une copie en cours produit des
+    dizaines de IN_MODIFY, le fichier n'est haché qu'une fois, à la fin.
+    Un renommage (IN_MOVED_FROM puis IN_MOVED_TO de même cookie) déplace
+    les lignes sans rien re-hacher, dossier entier compris. Un dossier créé
+    ou arrivé de l'extérieur est rescanné (des fichiers ont pu y être écrits
+    avant la pose de son watch). Si la file du noyau déborde
+    (IN_Q_OVERFLOW), les événements perdus ne disent pas où chercher : la
+    racine est rescannée en mode update (stat seulement, hachage des seuls
+    fichiers modifiés).
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, path, label, min_size=media_tool.DEFAULT_MIN_SIZE, exclude_ext=media_tool.DEFAULT_EXCLUDE_EXT,
+                 include_ext=None, skip_system=True, workers=1, hash_algo=None, debounce=DEBOUNCE_SECONDS,
+                 initial_scan=False):
+        _inotify_libc()  # Refus immédiat hors Linux
+        self.id = next(Watcher._ids)
+        self.root = str(Path(path).resolve())
+        if not os.path.isdir(self.root):
+            raise OSError(errno.ENOTDIR, "Dossier introuvable", self.root)
+        self.label = label
+        self.min_size = min_size
+        self.exclude_ext = exclude_ext
+        self.include_ext = include_ext
+        self.skip_system = skip_system
+        self.workers = workers
+        self.hash_algo = hash_algo
+        self.debounce = debounce
+        self.initial_scan = initial_scan
+        self.state = 'starting'
+        self.error = None
+        self.stats = {"events": 0, "indexed": 0, "removed": 0, "moved": 0, "rescans": 0, "overflows": 0, "reused": 0}
+        self.last_change = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._dirs = {}        # wd -> dossier
+        self._wds = {}         # dossier -> wd
+        self._pending = {}     # chemin -> (instant du dernier événement, 'update' | 'delete' | 'delete_dir')
+        self._moves = []       # (ancien chemin, nouveau chemin, dossier ?) à appliquer au prochain passage
+        self._moved_from = {}  # cookie -> (chemin, dossier ?, instant)
+        self._rescans = {}     # dossier -> instant de la demande
+        self.paths = None      # media_tool.PathIndex du passage en cours
+
+    # --- Cycle de vie ---
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name=f'watch-{self.label}', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout=None):
+        if self._thread:
+            self._thread.join(timeout)
+
+    @property
+    def alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def run(self):
+        self.conn = media_tool.connect()
+        self.algo = self.hash_algo or media_tool.get_hash_algo(self.conn)
+        self.source = media_tool.source_id(self.conn, self.label, create=True)
+        self.conn.commit()
+        self.meter = metrics.ScanMetrics(self.label, media_tool.physical_device(os.stat(self.root).st_dev))
+        self._inotify = None
+        try:
+            self._inotify = Inotify()
+            self._add_tree(self.root)
+            if self.initial_scan:
+                # Après la pose des watches : aucun changement ne passe entre les deux
+                self._rescans[self.root] = -self.debounce
+            self.state = 'watching'
+            print(f"Suivi de {self.root} (Label: {self.label}, {len(self._dirs)} dossiers)")
+            while not self._stop.is_set():
+                for event in self._inotify.read(self._timeout()):
+                    self.stats["events"] += 1
+                    self._handle(*event)
+                self._flush()
+            self._flush(force=True)
+            self.state = 'stopped'
+        except Exception as e:
+            self.error = str(e)
+            self.state = 'error'
+            print(f"\nErreur du suivi {self.root}: {e}")
+        finally:
+            if self._inotify:
+                self._inotify.close()
+            self.conn.close()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "path": self.root,
+            "label": self.label,
+            "state": self.state,
+            "error": self.error,
+            "watched_dirs": len(self._dirs),
+            "pending": len(self._pending) + len(self._rescans),
+            "last_change": self.last_change,
+            **self.stats
+        }
+
+    # --- Watches ---
+
+    def _add_tree(self, top):
+        """Pose un watch sur ``top`` et tous ses sous-dossiers (hors dossiers système)."""
+        stack = [top]
+        while stack:
+            directory = stack.pop()
+            try:
+                wd = self._inotify.add_watch(directory)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    raise OSError(e.errno, "Limite de watches atteinte (sysctl fs.inotify.max_user_watches)", directory)
+                continue  # Dossier disparu ou illisible
+            self._dirs[wd] = directory
+            self._wds[directory] = wd
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False) and not (self.skip_system and media_tool.is_system_dir(entry.name)):
+                            stack.append(entry.path)
+            except OSError:
+                pass
+
+    def _under(self, path, top):
+        return path == top or path.startswith(top + os.sep)
+
+    def _rename_tree(self, old, new):
+        """Un dossier renommé : watches, chemins en attente et rescans suivent."""
+        for wd, directory in list(self._dirs.items()):
+            if self._under(directory, old):
+                moved = new + directory[len(old):]
+                self._dirs[wd] = moved
+                if self._wds.get(directory) == wd:
+                    del self._wds[directory]
+                self._wds[moved] = wd
+        for table in (self._pending, self._rescans):
+            for path in [p for p in table if self._under(p, old)]:
+                table[new + path[len(old):]] = table.pop(path)
+
+    def _drop_tree(self, top):
+        for wd, directory in list(self._dirs.items()):
+            if self._under(directory, top):
+                self._inotify.rm_watch(wd)  # IN_IGNORED suivra
+
+    # --- Événements ---
+
+    def _handle(self, wd, mask, cookie, name):
+        now = time.monotonic()
+        if mask & IN_Q_OVERFLOW:
+            self.stats["overflows"] += 1
+            print(f"\n[Attention] File inotify saturée : rescan de {self.root}")
+            self._rescans[self.root] = now
+            return
+        if mask & IN_IGNORED:
+            directory = self._dirs.pop(wd, None)
+            if directory is not None and self._wds.get(directory) == wd:
+                del self._wds[directory]
+            return
+        directory = self._dirs.get(wd)
+        if directory is None or mask & IN_DELETE_SELF or not name:
+            return
+        is_dir = bool(mask & IN_ISDIR)
+        if is_dir and self.skip_system and media_tool.is_system_dir(name):
+            return
+        path = os.path.join(directory, name)
+
+        if mask & IN_MOVED_FROM:
+            # Sortie de l'arbre tant qu'aucun IN_MOVED_TO ne reprend le cookie
+            self._moved_from[cookie] = (path, is_dir, now)
+            self._pending[path] = (now, 'delete_dir' if is_dir else 'delete')
+        elif mask & IN_MOVED_TO:
+            origin = self._moved_from.pop(cookie, None)
+            if origin:
+                old = origin[0]
+                state = self._pending.pop(old, None)
+                self._moves.append((old, path, is_dir))
+                if is_dir:
+                    self._rename_tree(old, path)
+                else:
+                    # Vérifié au passage suivant : rien à hacher si taille et date suivent
+                    self._pending[path] = (now, 'update')
+                    if state and state[1] == 'update':
+                        self._pending[path] = state
+            elif is_dir:
+                self._pending.pop(path, None)
+                self._add_tree(path)
+                self._rescans[path] = now
+            else:
+                self._pending[path] = (now, 'update')
+        elif is_dir:
+            if mask & IN_CREATE:
+                self._pending.pop(path, None)
+                self._add_tree(path)
+                self._rescans[path] = now
+            elif mask & IN_DELETE:
+                self._pending[path] = (now, 'delete_dir')
+        elif mask & IN_DELETE:
+            self._pending[path] = (now, 'delete')
+        else:  # IN_CREATE, IN_MODIFY, IN_CLOSE_WRITE
+            self._pending[path] = (now, 'update')
+
+    def _timeout(self):
+        waits = [t + self.debounce for t, _ in self._pending.values()] + [t + self.debounce for t in self._rescans.values()]
+        if self._moves:
+            return 0
+        if not waits:
+            return 1.0  # Reste réactif à stop()
+        return min(1.0, max(0.05, min(waits) - time.monotonic()))
+
+    # --- Application à l'index ---
+
+    def _flush(self, force=False):
+        now = time.monotonic()
+        for cookie, (_, _, seen) in list(self._moved_from.items()):
+            if now - seen >= self.debounce:
+                del self._moved_from[cookie]
+
+        due = [path for path, (seen, _) in self._pending.items() if force or now - seen >= self.debounce]
+        rescans = [path for path, seen in self._rescans.items() if force or now - seen >= self.debounce]
+        if not (self._moves or due or rescans):
+            return
+
+        moves, self._moves = self._moves, []
+        ops = {path: self._pending.pop(path)[1] for path in due}
+        self.paths = media_tool.PathIndex(self.conn)  # Dossiers internés, le temps du passage
+        for path in rescans:
+            del self._rescans[path]
+
+        if moves:
+            self._apply_moves(moves)
+        removed = [path for path, op in ops.items() if op == 'delete']
+        removed_dirs = [path for path, op in ops.items() if op == 'delete_dir']
+        for directory in removed_dirs:
+            self._drop_tree(directory)
+        if removed or removed_dirs:
+            self._forget(removed, removed_dirs)
+        updates = [path for path, op in ops.items() if op == 'update']
+        if updates:
+            self._index(updates)
+        # Un rescan englobé par un autre est inutile
+        for directory in sorted(rescans, key=len):
+            if not any(self._under(directory, other) for other in rescans if other != directory and len(other) < len(directory)):
+                self._rescan(directory)
+        self.last_change = time.time()
+
+    def _apply_moves(self, moves):
+        now = datetime.now().isoformat()
+        # Bruit technique recalculé sur le nouveau chemin (dossier + nom)
+        ignored_sql = ' OR '.join('instr(? || filename, ?) > 0' for _ in media_tool.IGNORED_PATTERNS)
+        for old, new, is_dir in moves:
+            if is_dir:
+                # Chaque dossier du sous-arbre passe à son équivalent sous le nouveau nom
+                moved = 0
+                for dir_id, directory in self.paths.subtree(old):
+                    target = new + directory[len(old):]
+                    target_id = self.paths.dir_id(target)
+                    if target_id == dir_id:
+                        continue
+                    moved += self.conn.execute(
+                        'UPDATE OR REPLACE files SET dir_id = ?, scan_date = ? WHERE source_id = ? AND dir_id = ?',
+                        (target_id, now, self.source, dir_id)).rowcount
+                    params = []
+                    for pattern in media_tool.IGNORED_PATTERNS:
+                        params += [target + os.sep, pattern]
+                    self.conn.execute(f'UPDATE files SET is_ignored = ({ignored_sql}) WHERE source_id = ? AND dir_id = ?',
+                                      params + [self.source, target_id])
+                self.stats["moved"] += moved
+                continue
+            name = os.path.basename(new)
+            ext = media_tool._suffix(name)
+            old_key = self.paths.find(old)
+            if old_key is None:
+                continue
+            if not self._accepts(name, ext):
+                cursor = self.conn.execute('DELETE FROM files WHERE source_id = ? AND dir_id = ? AND filename = ?',
+                                           (self.source,) + old_key)
+                self.stats["removed"] += cursor.rowcount
+                continue
+            cursor = self.conn.execute('''
+                UPDATE OR REPLACE files SET dir_id = ?, filename = ?, extension = ?, is_ignored = ?, scan_date = ?
+                WHERE source_id = ? AND dir_id = ? AND filename = ?
+            ''', (self.paths.dir_id(os.path.dirname(new)), name, ext, media_tool.is_ignored_path(new), now, self.source) + old_key)
+            self.stats["moved"] += cursor.rowcount
+        self.conn.commit()
+
+    def _forget(self, paths, directories):
+        keys = list(self.paths.find_all(paths).values())
+        cursor = self.conn.executemany('DELETE FROM files WHERE source_id = ? AND dir_id = ? AND filename = ?',
+                                       [(self.source,) + key for key in keys])
+        count = cursor.rowcount if keys else 0
+        for directory in directories:
+            dir_ids = [dir_id for dir_id, _ in self.paths.subtree(directory)]
+            count += self.conn.execute('DELETE FROM files WHERE source_id = ? AND dir_id IN (SELECT value FROM json_each(?))',
+                                       (self.source, json.dumps(dir_ids))).rowcount
+        self.conn.commit()
+        self.stats["removed"] += count
+
+    def _accepts(self, name, ext, size=None):
+        # Mêmes règles que le parcours du scan (walk_files + taille minimale)
+        if self.skip_system and name in media_tool.SKIP_FILE_NAMES:
+            return False
+        if ext in self.exclude_ext or (self.include_ext is not None and ext not in self.include_ext):
+            return False
+        return size is None or size >= self.min_size
+
+    def _index(self, paths):
+        """Hache et indexe les fichiers créés ou modifiés ; oublie ceux qui ont disparu.
+
+        Un fichier arrivé d'ailleurs sur le volume reprend son hash indexé ; sa
+        ligne à l'ancien chemin est retirée (voir HashReuse).
+        """
+        gone = []
+        with media_tool.IndexWriter(self.conn, on_flush=self.meter.batch_written) as writer, \
+                media_tool.HashPool(lambda task: media_tool.measured_file_hash(task, None, self.algo), self.workers) as pool:
+            reuse = media_tool.HashReuse(self.conn, writer, self.algo, self.source, same_path=True)
+
+            def add(path, name, ext, st, file_hash):
+                dir_id = self.paths.dir_id(os.path.dirname(path))
+                writer.release()  # Dossier nouveau validé aussitôt, hors des hachages
+                writer.add((dir_id, name, ext, st.st_size, st.st_mtime, file_hash,
+                            self.algo, self.source, datetime.now().isoformat(), media_tool.is_ignored_path(path), st.st_ino))
+                self.stats["indexed"] += 1
+                self.meter.indexed.inc()
+
+            def collect(wait=False):
+                for (path, name, ext, st), file_hash in pool.results(wait):
+                    if file_hash:
+                        add(path, name, ext, st, file_hash)
+
+            for path in paths:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    gone.append(path)
+                    continue
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+                name = os.path.basename(path)
+                ext = media_tool._suffix(name)
+                if not self._accepts(name, ext, st.st_size):
+                    gone.append(path)
+                    continue
+                key = self.paths.find(path)
+                row = key and self.conn.execute(
+                    'SELECT size_bytes, mtime FROM files WHERE source_id = ? AND dir_id = ? AND filename = ? AND hash IS NOT NULL',
+                    (self.source,) + key).fetchone()
+                if row and row[0] == st.st_size and row[1] == st.st_mtime:
+                    continue  # Renommage ou rescan déjà passé : rien de neuf
+                volume_id = self.paths.volume_id(os.path.dirname(path))
+                writer.release()
+                file_hash, unchanged = reuse.lookup(volume_id, path, st)
+                if file_hash:
+                    add(path, name, ext, st, file_hash)
+                    if unchanged:
+                        continue  # Même chemin, indexé sous un autre label
+                    self.stats["reused"] += 1
+                    self.meter.files_reused.inc()
+                    self.meter.bytes_reused.inc(st.st_size)
+                    continue
+                pool.submit((path, st.st_size, self.meter), st.st_dev, (path, name, ext, st))
+                collect()
+            collect(wait=True)
+        if gone:
+            self._forget(gone, [])
+
+    def _rescan(self, directory):
+        """Rescan (mode update) d'un sous-arbre, puis oubli des fichiers disparus."""
+        self.stats["rescans"] += 1
+        media_tool.scan_directory(self.conn, directory, self.label, self.min_size, self.exclude_ext, True,
+                                  include_ext=self.include_ext, workers=self.workers, skip_system=self.skip_system,
+                                  hash_algo=self.algo)
+        self.paths = media_tool.PathIndex(self.conn)  # Volumes et dossiers ajoutés par le scan
+        gone = []
+        for dir_id, dirpath in self.paths.subtree(directory):
+            for name, in self.conn.execute('SELECT filename FROM files WHERE source_id = ? AND dir_id = ?', (self.source, dir_id)):
+                path = os.path.join(dirpath, name)
+                if not os.path.exists(path):
+                    gone.append(path)
+        self._forget(gone, [])